@@ -1,9 +1,11 @@
 from __future__ import unicode_literals
 from django.core.exceptions import ObjectDoesNotExist
 
+import copy
 from django.db import models
 from common.models import Student
 from catalog_parse.utils.catalog_constants import *
+from .schedule import DAYS, parse_meetings, schedule_options
 
 class Attribute:
     """
@@ -71,6 +73,12 @@ class CommunicationAttribute(Attribute):
         course.communication_requirement = self.requirement
         return course
 
+# Maximum number of generic courses kept by Course.make_generic
+GENERIC_COURSE_CACHE_LIMIT = 256
+
+# Generic courses by subject ID, with whether each needs a unique ID
+_generic_courses = {}
+
 class CourseFields:
     subject_id = "subject_id"
     title = "title"
@@ -231,8 +239,26 @@ class Course(models.Model):
         """Creates a generic course that satisfies the requirements separated by
         spaces in the given subject ID, e.g. "CI-H HASS-A". Returns a Course whose
         subject ID has unique ID appended. Raises a ValueError if one or more
-        generic attributes are invalid."""
+        generic attributes are invalid. The combined attributes of each subject
+        ID are cached, so repeated generic courses are copied rather than
+        rebuilt."""
+
+        cached = _generic_courses.get(subject_id)
+        if cached is None:
+            cached = cls._combine_generic_attributes(subject_id)
+            if len(_generic_courses) < GENERIC_COURSE_CACHE_LIMIT:
+                _generic_courses[subject_id] = cached
+        template, needs_unique_id = cached
+        generic_course = copy.copy(template)
+        if needs_unique_id:
+            generic_course.id = template.id + str(unique_id)
+        return generic_course
 
+    @classmethod
+    def _combine_generic_attributes(cls, subject_id):
+        """Returns a tuple (generic course, whether it needs a unique ID) for the
+        given generic subject ID. Raises a ValueError if one or more generic
+        attributes are invalid."""
         is_generic_course = False
         if "." not in subject_id:
             #potential a generic course
@@ -258,8 +284,8 @@ class Course(models.Model):
 
         #add all matching attributes to generic course
         if is_generic_course:
-            generic_course = Attribute.combine(matching_attributes, unique_id).course
-            return generic_course
+            attribute = Attribute.combine(matching_attributes, "")
+            return attribute.course, attribute.needs_unique_id
         else:
             raise ValueError
 
@@ -276,16 +302,13 @@ class Course(models.Model):
     meets_with_subjects = models.TextField(default="", null=True)
 
     def _get_courses(self, val):
+        """Returns the public courses listed in the given comma-separated string,
+        in order, fetched in a single query."""
         if val is None: return []
-        comps = val.split(",")
-        result = []
-        for comp in comps:
-            try:
-                course = Course.public_courses().get(subject_id=comp)
-                result.append(course)
-            except ObjectDoesNotExist:
-                continue
-        return result
+        comps = [comp for comp in val.split(",") if len(comp) > 0]
+        if len(comps) == 0: return []
+        courses = {c.subject_id: c for c in Course.public_courses().filter(subject_id__in=comps)}
+        return [courses[comp] for comp in comps if comp in courses]
 
     def get_equivalent_subjects(self):
         return self._get_courses(self.equivalent_subjects)
@@ -470,11 +493,16 @@ class Course(models.Model):
         return data
 
 
-    def satisfies(self, requirement, all_courses=None):
+    def satisfies(self, requirement, all_courses=None, catalog=None):
         """
         If `allCourses` is not nil, it may be a list of course objects that can
         potentially satisfy the requirement. If a combination of courses
         satisfies the requirement, this method will return true.
+
+        If `catalog` is not nil, it should be the current CatalogSnapshot, whose
+        precomputed subject equivalence classes are used instead of this
+        course's joint and equivalent subject lists, and whose parent/children
+        map is used instead of looking up the parent course.
         """
 
         req = requirement.replace("GIR:","")
@@ -489,7 +517,12 @@ class Course(models.Model):
         if "CI-" in req and self.communication_requirement is not None and len(self.communication_requirement) > 0 and self.communication_requirement == req:
             return True
 
-        if self.subject_id == req or req in self.joint_subjects.split(",") or req in self.equivalent_subjects.split(","):
+        if self.subject_id == req:
+            return True
+        if catalog is not None and self.public:
+            if catalog.equivalence.equivalent(self.subject_id, req):
+                return True
+        elif req in self.joint_subjects.split(",") or req in self.equivalent_subjects.split(","):
             return True
 
         # For example: 6.00 satisfies the 6.0001 requirement
@@ -498,12 +531,102 @@ class Course(models.Model):
 
         # For example: 6.0001 and 6.0002 together satsify the 6.00 requirement
         if all_courses is not None and self.parent is not None and req == self.parent:
-            try:
-                parent_course = Course.public_courses().get(subject_id=self.parent)
+            if catalog is not None:
+                children = catalog.relations.children(self.parent)
                 ids = set(c.subject_id for c in all_courses)
-                if parent_course.children is not None and all((child in ids) for child in parent_course.children.split(",")):
+                if len(children) > 0 and ids.issuperset(children):
                     return True
-            except:
-                pass
+            else:
+                try:
+                    parent_course = Course.public_courses().get(subject_id=self.parent)
+                    ids = set(c.subject_id for c in all_courses)
+                    if parent_course.children is not None and all((child in ids) for child in parent_course.children.split(",")):
+                        return True
+                except:
+                    pass
 
         return False
+
+# Schedule fields from which sections are built, and the term of each
+SECTION_TERMS = (
+    ("schedule", ""),
+    ("schedule_fall", "fall"),
+    ("schedule_IAP", "IAP"),
+    ("schedule_spring", "spring"),
+)
+
+class Section(models.Model):
+    """
+    A weekly meeting of one section option of a public course, decoded from the
+    course's schedule fields. An option that meets on several days has one
+    Section per day, sharing the same section type and index. Times are given
+    in 30-minute slots from midnight (see catalog.schedule), with the end slot
+    exclusive. TBA options have no Sections.
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="sections")
+    subject_id = models.CharField(max_length=20)
+
+    # Empty for the general schedule, otherwise "fall", "IAP" or "spring"
+    term = models.CharField(max_length=10, default="")
+    section_type = models.CharField(max_length=30)
+    # Position among the options of the same section type
+    index = models.IntegerField(default=0)
+
+    location = models.CharField(max_length=50, default="")
+    # The building of the location, e.g. "10" for "10-250"
+    building = models.CharField(max_length=20, default="")
+
+    # 0 for Monday through 5 for Saturday
+    day = models.IntegerField()
+    start_slot = models.IntegerField()
+    end_slot = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["term", "day", "start_slot", "end_slot"], name="section_time_idx"),
+            models.Index(fields=["building", "location"], name="section_location_idx"),
+        ]
+
+    def __str__(self):
+        return "<Section {} {} {}: {} {}-{} in {}>".format(self.subject_id, self.section_type, self.index,
+                                                            DAYS[self.day], self.start_slot, self.end_slot,
+                                                            self.location)
+
+    @classmethod
+    def from_course(cls, course):
+        """Returns a list of unsaved Sections for the schedule fields of the
+        given course. Options whose times cannot be decoded are skipped."""
+        sections = []
+        for field, term in SECTION_TERMS:
+            for section_type, index, option in schedule_options(getattr(course, field)):
+                try:
+                    location, meetings = parse_meetings(option)
+                except ValueError:
+                    continue
+                location = location.strip()
+                for days, start, end in meetings:
+                    for day in days:
+                        sections.append(cls(course=course,
+                                            subject_id=course.subject_id,
+                                            term=term,
+                                            section_type=section_type,
+                                            index=index,
+                                            location=location,
+                                            building=location.split("-")[0] if "-" in location else location,
+                                            day=DAYS.index(day),
+                                            start_slot=start,
+                                            end_slot=end))
+        return sections
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """Replaces all Sections with those decoded from the current public
+        courses, inserting them in bulk."""
+        cls.objects.all().delete()
+        sections = []
+        for course in Course.public_courses().iterator():
+            sections.extend(cls.from_course(course))
+            if len(sections) >= batch_size:
+                cls.objects.bulk_create(sections, batch_size=batch_size)
+                sections = []
+        cls.objects.bulk_create(sections, batch_size=batch_size)
@@ -0,0 +1,409 @@
+"""
+Compiles prerequisite and corequisite strings into boolean expression trees, and
+assembles them into a subject-level prerequisite graph.
+
+Prerequisite strings are in the format produced by
+catalog_parse.utils.parse_prereqs, for example
+"18.701/(18.703, (18.06/18.700))/''permission of instructor''". Commas join
+requirements that must all be satisfied, slashes join alternatives (binding more
+tightly than commas), parentheses group, "GIR:XXX" names a GIR, and text in
+doubled single quotes is a plain-text requirement.
+
+The PrerequisiteGraph is built once per catalog snapshot. Subjects are referred
+to by their position in the snapshot's sorted course list, and the transitive
+prerequisites and dependents of each subject are stored as integer bitsets.
+Roads are validated against the graph semester by semester, with the subjects
+taken so far also held as a bitset.
+"""
+
+import re
+
+PREREQ_TOKEN_REGEX = re.compile(r"''.*?''|[(),/]|[^(),/']+")
+SUBJECT_ID_REGEX = re.compile(r"[A-Za-z0-9]+\.[A-Za-z0-9]+")
+GIR_PREFIX = "GIR:"
+
+class PrereqSubject(object):
+    """A requirement that a particular subject has been taken."""
+    __slots__ = ("subject_id",)
+
+    def __init__(self, subject_id):
+        self.subject_id = subject_id
+
+    def evaluate(self, completed):
+        return completed.has_subject(self.subject_id)
+
+    def subject_ids(self):
+        return [self.subject_id]
+
+    def gir_ids(self):
+        return []
+
+    def to_json_object(self):
+        return self.subject_id
+
+class PrereqGIR(object):
+    """A requirement that a subject fulfilling a particular GIR has been taken."""
+    __slots__ = ("gir_id",)
+
+    def __init__(self, gir_id):
+        self.gir_id = gir_id
+
+    def evaluate(self, completed):
+        return completed.has_gir(self.gir_id)
+
+    def subject_ids(self):
+        return []
+
+    def gir_ids(self):
+        return [self.gir_id]
+
+    def to_json_object(self):
+        return GIR_PREFIX + self.gir_id
+
+class PrereqText(object):
+    """A plain-text requirement, such as "permission of instructor". These
+    cannot be checked automatically, so whether they are considered satisfied
+    is up to the set of completed subjects."""
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+    def evaluate(self, completed):
+        return completed.has_text(self.text)
+
+    def subject_ids(self):
+        return []
+
+    def gir_ids(self):
+        return []
+
+    def to_json_object(self):
+        return {"text": self.text}
+
+class PrereqGroup(object):
+    """A group of requirements that must all be satisfied (if require_all is
+    True) or of which at least one must be satisfied."""
+    __slots__ = ("require_all", "children")
+
+    def __init__(self, require_all, children):
+        self.require_all = require_all
+        self.children = children
+
+    def evaluate(self, completed):
+        if self.require_all:
+            return all(child.evaluate(completed) for child in self.children)
+        return any(child.evaluate(completed) for child in self.children)
+
+    def subject_ids(self):
+        return [subject_id for child in self.children for subject_id in child.subject_ids()]
+
+    def gir_ids(self):
+        return [gir_id for child in self.children for gir_id in child.gir_ids()]
+
+    def to_json_object(self):
+        return {"all" if self.require_all else "any": [child.to_json_object() for child in self.children]}
+
+
+def _compile_atom(token):
+    """Returns the expression for a single requirement token."""
+    if token.startswith("''") and token.endswith("''") and len(token) >= 4:
+        return PrereqText(token[2:-2].strip())
+    if token.startswith(GIR_PREFIX):
+        return PrereqGIR(token[len(GIR_PREFIX):].strip())
+    match = SUBJECT_ID_REGEX.match(token)
+    if match is not None:
+        return PrereqSubject(match.group(0))
+    return PrereqText(token)
+
+def _make_group(require_all, children):
+    if len(children) == 1:
+        return children[0]
+    return PrereqGroup(require_all, children)
+
+def compile_prereqs(text):
+    """
+    Compiles the given prerequisite or corequisite string into an expression
+    tree, or returns None if the string is empty. Malformed strings are
+    compiled as leniently as possible.
+    """
+    if not text or not text.strip():
+        return None
+    tokens = [token.strip() for token in PREREQ_TOKEN_REGEX.findall(text) if token.strip()]
+    position = [0]
+
+    def peek():
+        return tokens[position[0]] if position[0] < len(tokens) else None
+
+    def parse_all():
+        children = [parse_any()]
+        while peek() == ",":
+            position[0] += 1
+            children.append(parse_any())
+        return _make_group(True, [child for child in children if child is not None])
+
+    def parse_any():
+        children = [parse_atom()]
+        while peek() == "/":
+            position[0] += 1
+            children.append(parse_atom())
+        children = [child for child in children if child is not None]
+        return _make_group(False, children) if children else None
+
+    def parse_atom():
+        token = peek()
+        if token is None or token in (",", "/", ")"):
+            return None
+        position[0] += 1
+        if token == "(":
+            group = parse_all() if peek() != ")" else None
+            if peek() == ")":
+                position[0] += 1
+            return group
+        return _compile_atom(token)
+
+    expressions = []
+    while position[0] < len(tokens):
+        start = position[0]
+        expression = parse_all()
+        if expression is not None:
+            expressions.append(expression)
+        if position[0] == start:
+            # Skip a stray token such as an unmatched closing parenthesis
+            position[0] += 1
+    if not expressions:
+        return None
+    return _make_group(True, expressions)
+
+
+def bitset_indexes(bitset):
+    """Returns the positions of the set bits in the given integer, in
+    increasing order."""
+    indexes = []
+    while bitset:
+        low_bit = bitset & -bitset
+        indexes.append(low_bit.bit_length() - 1)
+        bitset ^= low_bit
+    return indexes
+
+
+class CompletedSubjects(object):
+    """A set of completed subjects against which prerequisites are evaluated.
+    Subjects equivalent to a completed subject also count as completed."""
+
+    def __init__(self, snapshot, subject_ids):
+        self.classes = set(snapshot.equivalence.class_id(subject_id) for subject_id in subject_ids)
+        self.equivalence = snapshot.equivalence
+        self.girs = set()
+        for subject_id in subject_ids:
+            course = snapshot.get(subject_id)
+            if course is not None and course.gir_attribute:
+                self.girs.add(course.gir_attribute.replace(GIR_PREFIX, ""))
+
+    def has_subject(self, subject_id):
+        return self.equivalence.class_id(subject_id) in self.classes
+
+    def has_gir(self, gir_id):
+        return gir_id in self.girs
+
+    def has_text(self, text):
+        return False
+
+
+class RoadState(object):
+    """The subjects taken so far in a road, stored as a bitset over the
+    positions of subjects in a PrerequisiteGraph. Subjects equivalent to a
+    taken subject also count as taken. Plain-text requirements cannot be
+    checked, so they are assumed to be satisfied."""
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.bits = 0
+        # Classes of taken subjects that are not in the catalog
+        self.other_classes = set()
+        self.girs = set()
+
+    def copy(self):
+        state = RoadState(self.graph)
+        state.bits = self.bits
+        state.other_classes = set(self.other_classes)
+        state.girs = set(self.girs)
+        return state
+
+    def add(self, subject_id):
+        equivalence = self.graph.snapshot.equivalence
+        for member in equivalence.members(subject_id):
+            i = self.graph.index_of.get(member)
+            if i is not None:
+                self.bits |= 1 << i
+            else:
+                self.other_classes.add(equivalence.class_id(member))
+        i = self.graph.index_of.get(subject_id)
+        if i is not None and self.graph.courses[i].gir_attribute:
+            self.girs.add(self.graph.courses[i].gir_attribute.replace(GIR_PREFIX, ""))
+
+    def has_subject(self, subject_id):
+        i = self.graph.index_of.get(subject_id)
+        if i is not None:
+            return (self.bits >> i) & 1 == 1
+        return self.graph.snapshot.equivalence.class_id(subject_id) in self.other_classes
+
+    def has_gir(self, gir_id):
+        return gir_id in self.girs
+
+    def has_text(self, text):
+        return True
+
+
+class PrerequisiteGraph(object):
+    """
+    The compiled prerequisites and corequisites of every subject in a catalog
+    snapshot, together with a prerequisite graph whose edges lead from each
+    subject to the subjects that list it as a prerequisite. GIR and plain-text
+    requirements are not part of the graph.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.courses = snapshot.courses
+        self.index_of = index_of = {course.subject_id: i for i, course in enumerate(self.courses)}
+
+        self.prerequisites = []
+        self.corequisites = []
+        # Bitsets of direct prerequisites and direct dependents of each subject
+        self.direct_prereqs = [0] * len(self.courses)
+        self.direct_dependents = [0] * len(self.courses)
+        # Bitsets of the subjects whose prerequisites mention each GIR
+        self.gir_dependents = {}
+
+        for i, course in enumerate(self.courses):
+            prereqs = compile_prereqs(course.prerequisites)
+            self.prerequisites.append(prereqs)
+            self.corequisites.append(compile_prereqs(course.corequisites))
+            if prereqs is None:
+                continue
+            for subject_id in prereqs.subject_ids():
+                j = index_of.get(subject_id)
+                if j is None or j == i:
+                    continue
+                self.direct_prereqs[i] |= 1 << j
+                self.direct_dependents[j] |= 1 << i
+            for gir_id in prereqs.gir_ids():
+                self.gir_dependents[gir_id] = self.gir_dependents.get(gir_id, 0) | (1 << i)
+
+        self.ancestors = self._transitive_closure(self.direct_prereqs)
+        self.descendants = self._transitive_closure(self.direct_dependents)
+
+    @staticmethod
+    def _transitive_closure(edges):
+        """Given a list of bitsets of the direct neighbors of each node, returns
+        a list of bitsets of the nodes reachable from each node. Nodes are
+        processed in topological order; any nodes left in cycles are updated
+        until nothing changes."""
+        count = len(edges)
+        closure = list(edges)
+        remaining = [len(bitset_indexes(bitset)) for bitset in edges]
+        reverse = [[] for _ in range(count)]
+        for i, bitset in enumerate(edges):
+            for j in bitset_indexes(bitset):
+                reverse[j].append(i)
+
+        ready = [i for i in range(count) if remaining[i] == 0]
+        processed = [False] * count
+        while ready:
+            j = ready.pop()
+            processed[j] = True
+            for i in reverse[j]:
+                closure[i] |= closure[j]
+                remaining[i] -= 1
+                if remaining[i] == 0:
+                    ready.append(i)
+
+        cyclic = [i for i in range(count) if not processed[i]]
+        changed = True
+        while changed:
+            changed = False
+            for i in cyclic:
+                updated = closure[i]
+                for j in bitset_indexes(edges[i]):
+                    updated |= closure[j]
+                if updated != closure[i]:
+                    closure[i] = updated
+                    changed = True
+        return closure
+
+    def _records(self, bitset):
+        return [self.courses[i] for i in bitset_indexes(bitset)]
+
+    def all_prerequisites(self, subject_id):
+        """Returns the records of all direct and indirect prerequisites of the
+        given subject, sorted by subject ID."""
+        i = self.index_of.get(subject_id)
+        return [] if i is None else self._records(self.ancestors[i] & ~(1 << i))
+
+    def all_dependents(self, subject_id):
+        """Returns the records of all subjects that directly or indirectly
+        require the given subject, sorted by subject ID."""
+        i = self.index_of.get(subject_id)
+        return [] if i is None else self._records(self.descendants[i] & ~(1 << i))
+
+    def unlocked_by(self, subject_ids):
+        """Returns the records of the subjects whose prerequisites mention and
+        are satisfied by the given completed subjects (or subjects equivalent
+        to them), excluding the completed subjects themselves. Sorted by
+        subject ID."""
+        completed = CompletedSubjects(self.snapshot, subject_ids)
+        candidates = 0
+        completed_bits = 0
+        for subject_id in subject_ids:
+            for member in self.snapshot.equivalence.members(subject_id):
+                i = self.index_of.get(member)
+                if i is not None:
+                    candidates |= self.direct_dependents[i]
+                    completed_bits |= 1 << i
+        for gir_id in completed.girs:
+            candidates |= self.gir_dependents.get(gir_id, 0)
+        candidates &= ~completed_bits
+        return [self.courses[i] for i in bitset_indexes(candidates)
+                if self.prerequisites[i].evaluate(completed)]
+
+    def validate_road(self, selections):
+        """
+        Checks the prerequisites and corequisites of the subjects in a road.
+        selections is a list of (subject ID, semester) tuples, where semesters
+        are integers in chronological order. Prerequisites must be satisfied by
+        subjects in earlier semesters (or the same semester, if the subject
+        allows its prerequisites to be taken as corequisites), and corequisites
+        by subjects in earlier semesters or the same semester. Subjects in
+        semester 0 (prior credit) are not checked.
+
+        Returns a list of (subject ID, semester, prerequisite expression or
+        None, corequisite expression or None) tuples for the subjects whose
+        requirements are not satisfied, in road order. The expressions are
+        those that failed.
+        """
+        semesters = {}
+        for position, (subject_id, semester) in enumerate(selections):
+            semesters.setdefault(semester, []).append((position, subject_id))
+
+        violations = []
+        state = RoadState(self)
+        for semester in sorted(semesters):
+            before = state.copy()
+            for _, subject_id in semesters[semester]:
+                state.add(subject_id)
+            if semester <= 0:
+                continue
+            for position, subject_id in semesters[semester]:
+                i = self.index_of.get(subject_id)
+                if i is None:
+                    continue
+                prereqs, coreqs = self.prerequisites[i], self.corequisites[i]
+                # Some subjects' prerequisites may also be taken as corequisites
+                prereq_state = state if self.courses[i].either_prereq_or_coreq else before
+                failed_prereqs = prereqs if prereqs is not None and not prereqs.evaluate(prereq_state) else None
+                failed_coreqs = coreqs if coreqs is not None and not coreqs.evaluate(state) else None
+                if failed_prereqs is not None or failed_coreqs is not None:
+                    violations.append((position, (subject_id, semester, failed_prereqs, failed_coreqs)))
+        violations.sort(key=lambda violation: violation[0])
+        return [violation for _, violation in violations]
@@ -0,0 +1,56 @@
+"""
+An in-memory index of the relationships between catalog subjects, which the
+Course model stores as comma-separated lists of subject IDs. The index is built
+once per catalog snapshot, and answers both forward lookups ("which subjects
+are equivalent to 6.006") and reverse lookups ("which subjects list 6.006 as
+equivalent") without splitting strings or querying the database.
+"""
+
+# Course fields holding comma-separated lists of related subject IDs
+RELATION_FIELDS = ("equivalent_subjects", "joint_subjects", "meets_with_subjects", "children")
+
+def split_subject_ids(value):
+    """Splits a comma-separated list of subject IDs, ignoring empty entries."""
+    if not value:
+        return []
+    return [comp.strip() for comp in value.split(",") if comp.strip()]
+
+
+class SubjectRelations(object):
+    """
+    Forward and reverse adjacency maps for each of the relation fields in
+    RELATION_FIELDS, plus a map from each subject to its parent subject.
+    """
+
+    def __init__(self, courses):
+        self.forward = {field: {} for field in RELATION_FIELDS}
+        self.reverse = {field: {} for field in RELATION_FIELDS}
+        self.parents = {}
+        for course in courses:
+            for field in RELATION_FIELDS:
+                subject_ids = tuple(split_subject_ids(getattr(course, field)))
+                if not subject_ids:
+                    continue
+                self.forward[field][course.subject_id] = subject_ids
+                for other in subject_ids:
+                    self.reverse[field].setdefault(other, []).append(course.subject_id)
+            if course.parent:
+                self.parents[course.subject_id] = course.parent
+
+    def related(self, subject_id, relation):
+        """Returns a tuple of the subject IDs listed in the given relation field
+        of the given subject, e.g. related("6.0001", "equivalent_subjects")."""
+        return self.forward[relation].get(subject_id, ())
+
+    def referencing(self, subject_id, relation):
+        """Returns a tuple of the subject IDs whose given relation field lists
+        the given subject."""
+        return tuple(self.reverse[relation].get(subject_id, ()))
+
+    def children(self, subject_id):
+        """Returns a tuple of the child subject IDs of the given subject."""
+        return self.related(subject_id, "children")
+
+    def parent(self, subject_id):
+        """Returns the parent subject ID of the given subject, or None."""
+        return self.parents.get(subject_id)
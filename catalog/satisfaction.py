@@ -0,0 +1,144 @@
+"""
+An index from requirement strings, as they appear in the leaves of requirements
+lists (subject IDs, "GIR:" attributes, HASS and CI attributes), to the subject
+IDs in the catalog that satisfy them. The index is built once per catalog
+snapshot, so that evaluating a leaf requirement against a road is a set
+intersection rather than a call to Course.satisfies for every course.
+
+The index follows the rules of Course.satisfies with a catalog, except that
+courses outside the catalog (such as generic courses) are still matched with
+Course.satisfies. See IndexedRoad.
+"""
+
+class RequirementIndex(object):
+    """
+    Maps requirement strings to frozensets of satisfying subject IDs for the
+    records of a CatalogSnapshot. The satisfying set of each requirement is
+    computed from attribute and relation maps on first use and then cached.
+    """
+
+    def __init__(self, snapshot):
+        self.relations = snapshot.relations
+        self.equivalence = snapshot.equivalence
+        self.subject_ids = frozenset(snapshot.subject_ids)
+        self.gir = {}
+        self.hass = {}
+        self.any_hass = set()
+        self.communication = {}
+        self.by_parent = {}
+        half_classes = set()
+        for course in snapshot.courses:
+            subject_id = course.subject_id
+            if course.gir_attribute:
+                self.gir.setdefault(course.gir_attribute, set()).add(subject_id)
+            hasses = course.get_hass_attributes()
+            for hass in hasses:
+                self.hass.setdefault(hass, set()).add(subject_id)
+            if hasses:
+                self.any_hass.add(subject_id)
+            if course.communication_requirement:
+                self.communication.setdefault(course.communication_requirement, set()).add(subject_id)
+            if course.parent:
+                self.by_parent.setdefault(course.parent, set()).add(subject_id)
+            if course.is_half_class:
+                half_classes.add(subject_id)
+        self.half_classes = frozenset(half_classes)
+        self._satisfying = {}
+
+    def satisfying(self, requirement):
+        """Returns a frozenset of the subject IDs in the catalog that satisfy
+        the given requirement on their own. Parent subjects that are satisfied
+        by taking all of their children are not included (see
+        parent_requirement)."""
+        result = self._satisfying.get(requirement)
+        if result is not None:
+            return result
+
+        req = requirement.replace("GIR:", "")
+        ids = set()
+        if "GIR:" in requirement:
+            ids.update(self.gir.get(req, ()))
+        if "HASS" in req:
+            ids.update(self.any_hass if req == "HASS" else self.hass.get(req, ()))
+        if "CI-" in req:
+            ids.update(self.communication.get(req, ()))
+        # The subject itself and its equivalent and joint subjects
+        ids.update(self.equivalence.members(req))
+        # Subjects with the requirement as a child, e.g. 6.00 satisfies 6.0001
+        ids.update(self.relations.referencing(req, "children"))
+        result = frozenset(ids & self.subject_ids)
+        self._satisfying[requirement] = result
+        return result
+
+    def parent_requirement(self, requirement):
+        """Returns a tuple (children, subject IDs) if the given requirement is a
+        parent subject, where children are the subject IDs that together
+        satisfy it and subject IDs are the subjects whose parent it is.
+        Otherwise returns None."""
+        req = requirement.replace("GIR:", "")
+        members = self.by_parent.get(req)
+        children = self.relations.children(req)
+        if not members or not children:
+            return None
+        return children, members
+
+    def road(self, courses):
+        """Returns an IndexedRoad for the given list of courses."""
+        return IndexedRoad(self, courses)
+
+
+class IndexedRoad(object):
+    """
+    The courses of a road prepared for matching against a RequirementIndex.
+    Public courses in the catalog are looked up by subject ID, while other
+    courses (such as generic courses) are matched with Course.satisfies.
+    Results are lists of courses in road order, as Course.satisfies would give
+    when iterating over the road.
+    """
+
+    def __init__(self, index, courses):
+        self.index = index
+        self.courses = list(courses)
+        self.subject_ids = set(c.subject_id for c in self.courses)
+        self.positions = {}
+        self.other_positions = []
+        self.is_half_class = []
+        for position, course in enumerate(self.courses):
+            if course.public and course.subject_id in index.subject_ids:
+                self.positions.setdefault(course.subject_id, []).append(position)
+                self.is_half_class.append(course.subject_id in index.half_classes)
+            else:
+                self.other_positions.append(position)
+                self.is_half_class.append(course.is_half_class)
+        self.catalog_ids = frozenset(self.positions)
+
+    def satisfying_positions(self, requirement, catalog=None):
+        """Returns a sorted list of the positions of the courses in the road
+        that satisfy the given requirement. catalog is passed through to
+        Course.satisfies for courses outside the index."""
+        satisfying = self.index.satisfying(requirement)
+        if len(satisfying) < len(self.catalog_ids):
+            matched = set(s for s in satisfying if s in self.catalog_ids)
+        else:
+            matched = set(s for s in self.catalog_ids if s in satisfying)
+
+        parent = self.index.parent_requirement(requirement)
+        if parent is not None and self.subject_ids.issuperset(parent[0]):
+            matched.update(s for s in parent[1] if s in self.catalog_ids)
+
+        positions = [p for subject_id in matched for p in self.positions[subject_id]]
+        positions += [p for p in self.other_positions
+                      if self.courses[p].satisfies(requirement, self.courses, catalog)]
+        positions.sort()
+        return positions
+
+    def satisfying_courses(self, requirement, separate_half_classes=False, catalog=None):
+        """Returns a tuple (whole courses, half courses) of the courses in the
+        road that satisfy the given requirement. If separate_half_classes is
+        False, all satisfying courses are returned in the first list."""
+        positions = self.satisfying_positions(requirement, catalog)
+        if not separate_half_classes:
+            return [self.courses[p] for p in positions], []
+        whole_courses = [self.courses[p] for p in positions if not self.is_half_class[p]]
+        half_courses = [self.courses[p] for p in positions if self.is_half_class[p]]
+        return whole_courses, half_courses
@@ -0,0 +1,392 @@
+"""
+Decodes the schedule strings stored on each course (see
+catalog_parse.utils.parse_schedule) into weekly time-slot bitmasks, so that
+meeting times can be compared without parsing the strings again.
+
+A schedule string such as
+"Lecture,10-250/MWF/0/10;Recitation,34-301/M/0/11,34-302/M/1/7 PM" lists
+section types separated by semicolons. Each type is followed by its section
+options, separated by commas, and each option consists of a location followed
+by one or more (days, evening flag, time) triples. A TBA option is written as
+"TBA".
+
+Each option's meeting times are encoded as an integer in which bit
+day * SLOTS_PER_DAY + slot is set if the option meets during that 30-minute
+slot of the week. Two options conflict if their masks have a bit in common, and
+courses are compared by first checking the union of all their options' masks.
+"""
+
+import re
+import time
+
+SCHEDULE_FIELDS = ("schedule", "schedule_fall", "schedule_IAP", "schedule_spring")
+
+# Terms whose schedule fields take precedence over the general schedule field
+TERM_SCHEDULE_FIELDS = {
+    "fall": "schedule_fall",
+    "iap": "schedule_IAP",
+    "spring": "schedule_spring",
+}
+
+DAYS = "MTWRFS"
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+# Daytime hours below this are in the afternoon, e.g. "MWF1" meets at 1 PM
+FIRST_MORNING_HOUR = 8
+
+TIME_RANGE_REGEX = re.compile(r"^\s*([0-9]+)(?:[.:]([0-9]+))?(?:\s*-\s*([0-9]+)(?:[.:]([0-9]+))?)?\s*(AM|PM)?\s*$",
+                              re.I)
+TBA = "TBA"
+
+def _to_slot(hour, minute):
+    return (hour * 60 + minute) // SLOT_MINUTES
+
+def _daytime_hour(hour):
+    return hour + 12 if hour < FIRST_MORNING_HOUR else hour
+
+def parse_time_range(time, evening=False):
+    """
+    Returns the (start slot, end slot) of the given time or time range, such as
+    "10", "9.30-11" or (in the evening) "7-9 PM". Slots are counted from
+    midnight, and the end slot is exclusive. A time without an end lasts one
+    hour. Raises a ValueError if the time cannot be parsed.
+    """
+    match = TIME_RANGE_REGEX.match(time)
+    if match is None:
+        raise ValueError("invalid time: {}".format(time))
+    start_hour, start_minute, end_hour, end_minute, meridiem = match.groups()
+    start_hour, start_minute = int(start_hour), int(start_minute or 0)
+    if end_hour is None:
+        end_hour, end_minute = start_hour + 1, start_minute
+    else:
+        end_hour, end_minute = int(end_hour), int(end_minute or 0)
+
+    if evening:
+        # Evening times are in the afternoon unless marked AM
+        if (meridiem or "PM").upper() == "PM":
+            if end_hour < 12:
+                end_hour += 12
+            if start_hour < 12 and start_hour + 12 <= end_hour:
+                start_hour += 12
+    else:
+        start_hour = _daytime_hour(start_hour)
+        end_hour = _daytime_hour(end_hour)
+        if (end_hour, end_minute) <= (start_hour, start_minute):
+            end_hour += 12
+
+    start = _to_slot(start_hour, start_minute)
+    end = min(_to_slot(end_hour, end_minute + SLOT_MINUTES - 1), SLOTS_PER_DAY)
+    if end <= start:
+        raise ValueError("invalid time: {}".format(time))
+    return start, end
+
+def slot_mask(days, start, end):
+    """Returns the bitmask for the slots from start (inclusive) to end
+    (exclusive) on each of the given days, such as "MWF"."""
+    day_mask = (1 << end) - (1 << start)
+    mask = 0
+    for day in days:
+        index = DAYS.find(day)
+        if index < 0:
+            raise ValueError("invalid day: {}".format(day))
+        mask |= day_mask << (index * SLOTS_PER_DAY)
+    return mask
+
+
+class ScheduleSection(object):
+    """One option for a section type of a course, such as a single recitation
+    time. The index is the option's position among the options of its type in
+    the schedule string. TBA sections have a mask of zero."""
+    __slots__ = ("section_type", "index", "location", "mask")
+
+    def __init__(self, section_type, index, location, mask):
+        self.section_type = section_type
+        self.index = index
+        self.location = location
+        self.mask = mask
+
+    def conflicts(self, mask):
+        return (self.mask & mask) != 0
+
+    def to_json_object(self):
+        return {"type": self.section_type, "index": self.index}
+
+
+class CourseSchedule(object):
+    """
+    The decoded schedule of a course: a list of (section type, options) tuples
+    in the order they appear in the schedule string, where options is a list
+    of ScheduleSections. A student takes one option of each section type.
+    """
+    __slots__ = ("section_types", "union_mask")
+
+    def __init__(self, section_types):
+        self.section_types = section_types
+        self.union_mask = 0
+        for _, options in section_types:
+            for section in options:
+                self.union_mask |= section.mask
+
+    def sections(self):
+        return [section for _, options in self.section_types for section in options]
+
+    def mask(self):
+        """Returns the union of the meeting times of all of the options."""
+        return self.union_mask
+
+    def restricted(self, selected=None, allowed=None):
+        """
+        Returns a CourseSchedule containing only the options that a schedule
+        file permits. selected maps section types to the index of the chosen
+        option, and allowed maps section types to lists of permitted indexes
+        (see the schedule file format). Section types are compared case-
+        insensitively, and types with no permitted options keep all of theirs.
+        """
+        selected = {key.lower(): value for key, value in (selected or {}).items()}
+        allowed = {key.lower(): value for key, value in (allowed or {}).items()}
+        section_types = []
+        for section_type, options in self.section_types:
+            key = section_type.lower()
+            if key in selected:
+                permitted = [selected[key]]
+            elif key in allowed:
+                permitted = allowed[key]
+            else:
+                section_types.append((section_type, options))
+                continue
+            restricted = [section for section in options if section.index in permitted]
+            section_types.append((section_type, restricted or options))
+        return CourseSchedule(section_types)
+
+    def __len__(self):
+        return len(self.section_types)
+
+
+def schedule_conflicts(schedule, other):
+    """
+    Returns a tuple (unavoidable, section pairs) describing the conflicts
+    between two CourseSchedules, or None if none of their options overlap.
+    The section pairs are the (section, other section) tuples that meet at the
+    same time. The conflict is unavoidable if, for some section type of each
+    course, every option of one type overlaps every option of the other.
+    """
+    if not schedule.union_mask & other.union_mask:
+        return None
+    pairs = []
+    unavoidable = False
+    for _, options in schedule.section_types:
+        for _, other_options in other.section_types:
+            all_overlap = True
+            for section in options:
+                for other_section in other_options:
+                    if section.mask & other_section.mask:
+                        pairs.append((section, other_section))
+                    else:
+                        all_overlap = False
+            unavoidable = unavoidable or all_overlap
+    return (unavoidable, pairs) if pairs else None
+
+def has_unavoidable_conflict(schedule, other):
+    """Returns whether the two CourseSchedules have an unavoidable conflict, as
+    defined in schedule_conflicts."""
+    if not schedule.union_mask & other.union_mask:
+        return False
+    for _, options in schedule.section_types:
+        for _, other_options in other.section_types:
+            if all(section.mask & other_section.mask
+                   for section in options for other_section in other_options):
+                return True
+    return False
+
+
+def parse_meetings(option):
+    """Returns a tuple (location, meetings) for the given option string of a
+    section type, such as "10-250/MWF/0/10", where meetings is a list of
+    (days, start slot, end slot) tuples. TBA options have no meetings. Raises a
+    ValueError if the option cannot be decoded."""
+    if option.strip() == TBA:
+        return TBA, []
+    comps = option.split("/")
+    location, times = comps[0], comps[1:]
+    if len(times) == 0 or len(times) % 3 != 0:
+        raise ValueError("invalid section: {}".format(option))
+    meetings = []
+    for i in range(0, len(times), 3):
+        days, evening, time = times[i:i + 3]
+        days = days.strip()
+        if not days or any(day not in DAYS for day in days):
+            raise ValueError("invalid days: {}".format(days))
+        start, end = parse_time_range(time, evening.strip() == "1")
+        meetings.append((days, start, end))
+    return location, meetings
+
+def parse_section(section_type, index, option):
+    """Returns a ScheduleSection for the given option string of a section type,
+    such as "10-250/MWF/0/10". Raises a ValueError if it cannot be decoded."""
+    location, meetings = parse_meetings(option)
+    mask = 0
+    for days, start, end in meetings:
+        mask |= slot_mask(days, start, end)
+    return ScheduleSection(section_type, index, location, mask)
+
+def schedule_options(schedule):
+    """Yields a (section type, index, option string) tuple for each option in
+    the given schedule string."""
+    for type_string in (schedule or "").split(";"):
+        comps = type_string.split(",")
+        section_type = comps[0].strip()
+        if not section_type:
+            continue
+        for index, option in enumerate(comps[1:]):
+            yield section_type, index, option
+
+def decode_schedule(schedule):
+    """
+    Decodes the given schedule string into a CourseSchedule, or returns None if
+    the string is empty. Options whose times cannot be decoded are skipped, as
+    are section types with no decodable options.
+    """
+    if not schedule:
+        return None
+    section_types = []
+    for section_type, index, option in schedule_options(schedule):
+        try:
+            section = parse_section(section_type, index, option)
+        except ValueError:
+            continue
+        if index == 0 or not section_types or section_types[-1][0] != section_type:
+            section_types.append((section_type, []))
+        section_types[-1][1].append(section)
+    return CourseSchedule(section_types) if section_types else None
+
+def find_conflicts(schedules):
+    """
+    Returns a list of (index, other index, unavoidable, section pairs) tuples
+    for each pair of the given CourseSchedules that has conflicting sections,
+    as described in schedule_conflicts. The indexes refer to positions in the
+    given list, with index < other index.
+    """
+    results = []
+    for i, schedule in enumerate(schedules):
+        for j in range(i + 1, len(schedules)):
+            conflict = schedule_conflicts(schedule, schedules[j])
+            if conflict is not None:
+                results.append((i, j) + conflict)
+    return results
+
+def conflicting_indexes(schedules, busy):
+    """Returns the positions of the CourseSchedules in schedules (which may
+    contain None) that have an unavoidable conflict with any of the
+    CourseSchedules in busy."""
+    busy_mask = 0
+    for other in busy:
+        busy_mask |= other.union_mask
+    return [i for i, schedule in enumerate(schedules)
+            if schedule is not None and schedule.union_mask & busy_mask and
+            any(has_unavoidable_conflict(schedule, other) for other in busy)]
+
+
+# Preferences for ranking generated schedules
+PREFER_NO_EARLY = "no_early"
+PREFER_NO_EVENING = "no_evening"
+PREFER_COMPACT = "compact"
+SCHEDULE_PREFERENCES = (PREFER_NO_EARLY, PREFER_NO_EVENING, PREFER_COMPACT)
+
+# Meetings before this slot (10 AM) count as early, and from this slot (5 PM)
+# as evening
+EARLY_SLOT_END = 20
+EVENING_SLOT_START = 34
+
+def _bit_count(mask):
+    return bin(mask).count("1")
+
+def _day_masks(mask):
+    day_mask = (1 << SLOTS_PER_DAY) - 1
+    return [(mask >> (day * SLOTS_PER_DAY)) & day_mask for day in range(len(DAYS))]
+
+def schedule_penalty(mask, preferences):
+    """Returns a penalty for the weekly meeting times in the given mask, which
+    is lower for schedules that better match the given preferences:
+    PREFER_NO_EARLY counts the slots meeting before 10 AM, PREFER_NO_EVENING
+    the slots meeting from 5 PM, and PREFER_COMPACT the free slots between each
+    day's first and last meetings."""
+    early_mask = (1 << EARLY_SLOT_END) - 1
+    evening_mask = ((1 << SLOTS_PER_DAY) - 1) & ~((1 << EVENING_SLOT_START) - 1)
+    penalty = 0
+    for day in _day_masks(mask):
+        if not day:
+            continue
+        if PREFER_NO_EARLY in preferences:
+            penalty += _bit_count(day & early_mask)
+        if PREFER_NO_EVENING in preferences:
+            penalty += _bit_count(day & evening_mask)
+        if PREFER_COMPACT in preferences:
+            first = (day & -day).bit_length() - 1
+            penalty += day.bit_length() - first - _bit_count(day)
+    return penalty
+
+def generate_schedules(schedules, limit, time_limit):
+    """
+    Enumerates the combinations of one option of each section type of each of
+    the given CourseSchedules such that no two chosen options meet at the same
+    time. Backtracking chooses the section type with the fewest options that
+    are still free at each step, and discards options that overlap the union
+    of the options chosen so far.
+
+    Stops after finding limit combinations or after time_limit seconds. Returns
+    a tuple (combinations, complete), where each combination is a list of the
+    chosen ScheduleSections for each schedule (parallel to schedules) and
+    complete indicates whether every combination was found.
+    """
+    variables = [(i, options) for i, schedule in enumerate(schedules) for _, options in schedule.section_types]
+    chosen = [None] * len(variables)
+    results = []
+    deadline = time.time() + time_limit
+    state = {"complete": True}
+
+    def search(busy, remaining):
+        # Returns False once the search should stop
+        if len(results) >= limit or time.time() > deadline:
+            state["complete"] = False
+            return False
+        if not remaining:
+            combination = [[] for _ in schedules]
+            for (i, _), section in zip(variables, chosen):
+                combination[i].append(section)
+            results.append(combination)
+            return True
+
+        best, best_options = None, None
+        for v in remaining:
+            free = [option for option in variables[v][1] if not option.mask & busy]
+            if not free:
+                return True
+            if best_options is None or len(free) < len(best_options):
+                best, best_options = v, free
+        rest = [v for v in remaining if v != best]
+        for option in best_options:
+            chosen[best] = option
+            if not search(busy | option.mask, rest):
+                return False
+        chosen[best] = None
+        return True
+
+    search(0, list(range(len(variables))))
+    return results, state["complete"]
+
+def ranked_schedules(schedules, preferences, count, search_limit, time_limit):
+    """Generates up to search_limit conflict-free combinations of the given
+    CourseSchedules (see generate_schedules), and returns a tuple
+    ([(penalty, combination)], complete) with the count combinations that best
+    match the given preferences, lowest penalty first."""
+    combinations, complete = generate_schedules(schedules, search_limit, time_limit)
+    scored = []
+    for position, combination in enumerate(combinations):
+        mask = 0
+        for sections in combination:
+            for section in sections:
+                mask |= section.mask
+        scored.append((schedule_penalty(mask, preferences), position, combination))
+    scored.sort(key=lambda item: item[:2])
+    return [(penalty, combination) for penalty, _, combination in scored[:count]], complete
@@ -0,0 +1,286 @@
+"""
+Full-text search over the catalog snapshot. A SearchIndex is built once per
+CatalogSnapshot and holds:
+
+* a token index over subject IDs, titles, instructors and descriptions, mapping
+  each token to the weighted number of times it appears in each course;
+* a trigram index over lowercased subject IDs and titles, used to narrow down
+  candidates for substring (contains/starts/ends) matches.
+
+A CompletionIndex, also built once per snapshot, serves autocomplete requests.
+
+Courses are referred to by their position in the snapshot's sorted course list,
+so posting sets can be intersected cheaply and results tie-break by subject ID.
+"""
+
+import math
+import re
+from bisect import bisect_left
+
+TOKEN_REGEX = re.compile(r"[a-z0-9]+(?:\.[a-z0-9]+)*")
+
+# Relative weight of a token appearing in each indexed field
+FIELD_WEIGHTS = (
+    ("subject_id", 8.0),
+    ("old_id", 8.0),
+    ("title", 4.0),
+    ("instructors", 2.0),
+    ("description", 1.0),
+)
+
+EXACT_ID_BOOST = 100.0
+ID_PREFIX_BOOST = 20.0
+TITLE_MATCH_BOOST = 10.0
+ENROLLMENT_WEIGHT = 1.0
+
+# Query tokens at least this long also match indexed tokens they are a prefix of
+MIN_PREFIX_LENGTH = 3
+
+def tokenize(text):
+    """Splits the given text into lowercase alphanumeric tokens. Periods between
+    alphanumeric characters are kept, so subject IDs such as "6.0001" form a
+    single token."""
+    if not text:
+        return []
+    return TOKEN_REGEX.findall(text.lower())
+
+def trigrams(text):
+    """Returns the set of three-character substrings of the given text."""
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+def id_title_matcher(term, match_type):
+    """Returns a function that takes a lowercase string and returns whether it
+    matches the given lowercase search term using the given match type
+    ("contains", "matches", "starts", or "ends"). Raises a ValueError if the
+    match type is invalid."""
+    if match_type == "contains":
+        return lambda value: term in value
+    elif match_type == "matches":
+        return lambda value: term == value
+    elif match_type == "starts":
+        return lambda value: value.startswith(term)
+    elif match_type == "ends":
+        return lambda value: value.endswith(term)
+    raise ValueError
+
+
+class SearchIndex(object):
+    """
+    An inverted index over a list of course records, which should be sorted by
+    subject ID.
+    """
+
+    def __init__(self, courses):
+        self.courses = list(courses)
+        self.postings = {}
+        self.trigrams = {}
+        self.id_title_keys = []
+
+        for index, course in enumerate(self.courses):
+            for field, weight in FIELD_WEIGHTS:
+                for token in tokenize(getattr(course, field)):
+                    course_weights = self.postings.setdefault(token, {})
+                    course_weights[index] = course_weights.get(index, 0.0) + weight
+
+            keys = (course.subject_id.lower(), (course.title or "").lower())
+            self.id_title_keys.append(keys)
+            for key in keys:
+                for trigram in trigrams(key):
+                    self.trigrams.setdefault(trigram, set()).add(index)
+
+        self.sorted_tokens = sorted(self.postings)
+
+    def _id_title_matches(self, term, match_type, candidates):
+        """Returns the indexes of courses whose subject ID or title matches the
+        term, considering only the given candidate indexes if not None."""
+        matcher = id_title_matcher(term, match_type)
+        term_trigrams = trigrams(term)
+        if term_trigrams:
+            # Any substring match must contain all of the term's trigrams
+            postings = sorted((self.trigrams.get(t, set()) for t in term_trigrams), key=len)
+            narrowed = set(postings[0]).intersection(*postings[1:])
+            candidates = narrowed if candidates is None else narrowed & candidates
+        elif candidates is None:
+            candidates = range(len(self.courses))
+        return set(i for i in candidates if any(matcher(key) for key in self.id_title_keys[i]))
+
+    def _token_postings(self, token, allow_prefix):
+        """Returns a dictionary mapping course indexes to weights for the given
+        query token, merging in the tokens it is a prefix of if allowed."""
+        if not allow_prefix or len(token) < MIN_PREFIX_LENGTH:
+            return self.postings.get(token, {})
+        merged = {}
+        position = bisect_left(self.sorted_tokens, token)
+        while position < len(self.sorted_tokens) and self.sorted_tokens[position].startswith(token):
+            for index, weight in self.postings[self.sorted_tokens[position]].items():
+                merged[index] = max(merged.get(index, 0.0), weight)
+            position += 1
+        return merged
+
+    def search(self, search_term, match_type="contains", candidates=None):
+        """Returns the course records matching the given search term, sorted by
+        descending relevance. See scored_search for details."""
+        return [course for score, course in self.scored_search(search_term, match_type, candidates)]
+
+    def scored_search(self, search_term, match_type="contains", candidates=None):
+        """
+        Returns a list of (score, course record) tuples for the courses matching
+        the given search term, sorted by descending score and then by subject
+        ID. A course matches if its subject ID or title
+        matches the term according to match_type, or (for "contains" searches)
+        if every token in the term appears in its indexed text. If candidates is
+        not None, only the course indexes in that set are considered.
+        """
+        term = search_term.lower()
+        if candidates is not None and not candidates:
+            return []
+
+        matches = self._id_title_matches(term, match_type, candidates)
+
+        # Token relevance, and full-text matches for contains searches
+        query_tokens = tokenize(term)
+        token_postings = [self._token_postings(token, i == len(query_tokens) - 1)
+                          for i, token in enumerate(query_tokens)]
+        if match_type == "contains" and token_postings:
+            found = set(token_postings[0])
+            for postings in token_postings[1:]:
+                found.intersection_update(postings)
+            if candidates is not None:
+                found &= candidates
+            matches |= found
+
+        num_courses = float(len(self.courses))
+        scores = {}
+        for index in matches:
+            course = self.courses[index]
+            score = 0.0
+            for postings in token_postings:
+                if index in postings:
+                    score += postings[index] * math.log(1.0 + num_courses / len(postings))
+            subject_id, title = self.id_title_keys[index]
+            if subject_id == term or (course.old_id or "").lower() == term:
+                score += EXACT_ID_BOOST
+            elif subject_id.startswith(term):
+                score += ID_PREFIX_BOOST
+            if term in title:
+                score += TITLE_MATCH_BOOST
+            score += ENROLLMENT_WEIGHT * math.log(1.0 + max(course.enrollment_number or 0.0, 0.0))
+            scores[index] = score
+        return [(scores[i], self.courses[i]) for i in sorted(scores, key=lambda i: (-scores[i], i))]
+
+
+# Ranks for the ways a completion key can match, from best to worst
+COMPLETION_EXACT = 0
+COMPLETION_SUBJECT_ID = 1
+COMPLETION_OLD_ID = 2
+COMPLETION_TITLE = 3
+COMPLETION_FUZZY = 4
+
+def max_edit_distance(term):
+    """Returns the number of typos tolerated when completing the given term."""
+    if len(term) < 4:
+        return 0
+    elif len(term) < 8:
+        return 1
+    return 2
+
+def next_edit_row(previous, term, key_char, depth, max_distance):
+    """Given the row of edit distances between each prefix of term and a key
+    prefix, returns the row for that key prefix extended by key_char, which
+    becomes depth characters long. Distances above max_distance are capped at
+    max_distance + 1, so only the cells near the diagonal are computed."""
+    cap = max_distance + 1
+    current = [min(depth, cap)] + [cap] * len(term)
+    for j in range(max(1, depth - max_distance), min(len(term), depth + max_distance) + 1):
+        current[j] = min(previous[j] + 1,
+                         current[j - 1] + 1,
+                         previous[j - 1] + (term[j - 1] != key_char),
+                         cap)
+    return current
+
+
+class CompletionIndex(object):
+    """
+    Completes partial subject IDs, old subject IDs and title words using a
+    sorted array of lowercase keys, which is searched by binary search for
+    prefix matches. Misspelled terms are matched within a small edit distance
+    against the keys that share the term's first character, by walking the
+    sorted keys as a trie and pruning prefixes that are already too far from
+    the term.
+    """
+
+    def __init__(self, courses):
+        self.courses = list(courses)
+        entries = []
+        for index, course in enumerate(self.courses):
+            entries.append((course.subject_id.lower(), COMPLETION_SUBJECT_ID, index))
+            if course.old_id:
+                entries.append((course.old_id.lower(), COMPLETION_OLD_ID, index))
+            for word in set(tokenize(course.title)):
+                entries.append((word, COMPLETION_TITLE, index))
+        entries.sort()
+        self.keys = [entry[0] for entry in entries]
+        self.entries = entries
+
+    def _prefix_range(self, prefix):
+        """Returns the range of entry positions whose keys begin with prefix."""
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + u"\uffff", lo=start)
+        return start, end
+
+    def _fuzzy_ranges(self, term, max_distance):
+        """Returns a list of (start, end) ranges of entry positions whose keys
+        begin with the term's first character and have a prefix within
+        max_distance edits of the term. The sorted keys are walked as an
+        implicit trie, in which the children of a prefix are the runs of keys
+        sharing each next character."""
+        ranges = []
+        start, end = self._prefix_range(term[0])
+        first_row = next_edit_row(range(len(term) + 1), term, term[0], 1, max_distance)
+        stack = [(term[0], first_row, start, end)]
+        while stack:
+            prefix, row, start, end = stack.pop()
+            if row[-1] <= max_distance:
+                # Every key beginning with this prefix matches
+                ranges.append((start, end))
+                continue
+            if min(row) > max_distance:
+                continue
+            depth = len(prefix)
+            position = start
+            while position < end:
+                key = self.keys[position]
+                if len(key) <= depth:
+                    position += 1
+                    continue
+                child = prefix + key[depth]
+                child_end = bisect_left(self.keys, child + u"\uffff", lo=position, hi=end)
+                stack.append((child, next_edit_row(row, term, key[depth], depth + 1, max_distance),
+                              position, child_end))
+                position = child_end
+        return ranges
+
+    def complete(self, term, limit=10):
+        """Returns up to limit course records completing the given term, best
+        matches first. Ties are broken by enrollment, then subject ID."""
+        term = term.strip().lower()
+        if not term or limit <= 0:
+            return []
+        best = {}
+        def add(index, rank):
+            if rank < best.get(index, COMPLETION_FUZZY + 1):
+                best[index] = rank
+
+        start, end = self._prefix_range(term)
+        for key, kind, index in self.entries[start:end]:
+            add(index, COMPLETION_EXACT if key == term and kind != COMPLETION_TITLE else kind)
+
+        max_distance = max_edit_distance(term)
+        if len(best) < limit and max_distance > 0:
+            for start, end in self._fuzzy_ranges(term, max_distance):
+                for key, kind, index in self.entries[start:end]:
+                    add(index, COMPLETION_FUZZY)
+
+        enrollment = lambda i: -(self.courses[i].enrollment_number or 0.0)
+        ranked = sorted(best, key=lambda i: (best[i], enrollment(i), i))
+        return [self.courses[i] for i in ranked[:limit]]
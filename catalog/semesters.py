@@ -0,0 +1,95 @@
+"""
+Reads the catalog of a semester from the parsed catalog files in
+CATALOG_BASE_DIR, the same files that update_db.py loads into the database.
+This allows the catalogs of semesters other than the current one to be served
+from memory (see catalog.snapshot.get_semester_snapshot) without reloading the
+database.
+"""
+
+import csv
+import os
+import re
+from django.conf import settings
+from courseupdater.views import compute_semester_delta, current_version_for_catalog, semester_dir_prefix
+from catalog_parse.utils.catalog_constants import CourseAttribute
+from .models import Course, CSV_HEADERS
+
+# Filenames that contain these words will be skipped
+EXCLUDED_FILENAMES = ["condensed", "courses", "features", "enrollment", "departments"]
+
+SEMESTER_REGEX = re.compile(r"^[a-z]+-[0-9]{4}$")
+
+def semester_version(semester):
+    """Returns the latest delta version of the catalog files for the given
+    semester, e.g. "fall-2017". Raises a ValueError if the semester is badly
+    formatted or has no catalog files."""
+    if not SEMESTER_REGEX.match(semester or ""):
+        raise ValueError("invalid semester: {}".format(semester))
+    try:
+        return current_version_for_catalog(semester_dir_prefix + semester)
+    except OSError:
+        raise ValueError("no catalog for semester: {}".format(semester))
+
+def catalog_file_paths(semester):
+    """Returns a tuple (catalog file paths, related file path or None) for the
+    given semester, relative to CATALOG_BASE_DIR. Excluded files are skipped."""
+    paths = []
+    related_path = None
+    for path in compute_semester_delta(semester.split("-"), 0)["delta"]:
+        filename = os.path.basename(path)
+        if any(f in filename for f in EXCLUDED_FILENAMES):
+            continue
+        if "related" in filename:
+            related_path = path
+        else:
+            paths.append(path)
+    return paths, related_path
+
+def read_catalog_rows(path):
+    """Yields a dictionary mapping CSV headers to values for each course in the
+    given catalog file."""
+    with open(path, 'r') as file:
+        reader = csv.reader(file)
+        headers = None
+        for comps in reader:
+            if CourseAttribute.subjectID in comps:
+                headers = comps
+                continue
+            if headers is None:
+                print("Can't read CSV file {} - no headers".format(path))
+                continue
+            yield dict(zip(headers, comps))
+
+def set_catalog_fields(course, info, semester):
+    """Sets the fields of the given course from a row of a catalog file."""
+    course.catalog_semester = semester
+    for key, val in info.items():
+        if key not in CSV_HEADERS: continue
+        prop, converter = CSV_HEADERS[key]
+        setattr(course, prop, converter(val.decode('utf-8')))
+
+def read_related_rows(path):
+    """Yields a tuple (subject ID, related subjects string) for each line of
+    the given related subjects file."""
+    with open(path, 'r') as file:
+        for line in file:
+            comps = line.strip().replace("[J]", "").replace("J", "").split(",")
+            yield comps[0], ",".join(comps[1:])
+
+def read_semester_courses(semester):
+    """Returns a list of unsaved public Course objects for the given semester,
+    read from its catalog files."""
+    paths, related_path = catalog_file_paths(semester)
+    courses = {}
+    for path in paths:
+        for info in read_catalog_rows(os.path.join(settings.CATALOG_BASE_DIR, path)):
+            subject_id = info[CourseAttribute.subjectID]
+            course = courses.get(subject_id)
+            if course is None:
+                course = courses[subject_id] = Course(public=True, subject_id=subject_id)
+            set_catalog_fields(course, info, semester)
+    if related_path is not None:
+        for subject_id, related in read_related_rows(os.path.join(settings.CATALOG_BASE_DIR, related_path)):
+            if subject_id in courses:
+                courses[subject_id].related_subjects = related
+    return list(courses.values())
@@ -0,0 +1,358 @@
+"""
+An in-memory, read-only copy of the public course catalog. Catalog reads make up
+most of the server's traffic, so rather than querying the Course table on every
+request, the catalog endpoints read from a CatalogSnapshot that is built once
+per catalog version and replaced wholesale when the catalog changes. Each
+record also carries its basic and full JSON serializations, so endpoints can
+join the cached fragments instead of re-serializing courses.
+
+A snapshot is invalidated when update_db.py finishes loading a new catalog
+(see courseupdater.views.mark_catalog_loaded), or when a public Course is saved
+or deleted in this process.
+
+The database holds only the current semester's catalog. Snapshots of other
+semesters are read from their catalog files on first use (see
+catalog.semesters), and the most recently used few are kept in memory.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+from django.db.models.signals import post_save, post_delete
+from courseupdater.views import loaded_catalog_version
+from .models import Course
+from .search import SearchIndex, CompletionIndex
+from .table import CatalogTable
+from .relations import SubjectRelations
+from .prereqs import PrerequisiteGraph
+from .satisfaction import RequirementIndex
+from .semesters import semester_version, read_semester_courses
+from .schedule import SCHEDULE_FIELDS, TERM_SCHEDULE_FIELDS, decode_schedule
+from catalog_parse.utils.equivalence import EquivalenceResolver
+
+# Relation fields whose subjects satisfy each other's requirements
+EQUIVALENCE_FIELDS = ("equivalent_subjects", "joint_subjects")
+
+# Attribute names copied from each Course into its CourseRecord
+RECORD_FIELDS = tuple(f.attname for f in Course._meta.concrete_fields if f.name != "creator")
+
+class CourseRecord(object):
+    """
+    A compact, read-only copy of a public Course. Records expose the same
+    attributes as the Course model, so the model's serialization and
+    requirement-matching logic can be shared between the two.
+    """
+    __slots__ = RECORD_FIELDS + ("basic_json", "full_json", "_full_object")
+
+    # Public catalog courses never have a creator
+    creator = None
+
+    def __init__(self, course):
+        for field in RECORD_FIELDS:
+            setattr(self, field, getattr(course, field))
+        self.basic_json = json.dumps(self.to_json_object(full=False))
+        self.full_json = json.dumps(self.to_json_object(full=True))
+        self._full_object = None
+
+    def __str__(self):
+        return "<CourseRecord {}: {}>".format(self.subject_id, self.title)
+
+    def json_fragment(self, full=True):
+        """Returns the serialized JSON for this course, equivalent to
+        json.dumps(self.to_json_object(full=full))."""
+        return self.full_json if full else self.basic_json
+
+    def json_projection(self, fields):
+        """Returns serialized JSON containing only the given keys of the full
+        JSON description. Keys that the course doesn't have are omitted."""
+        if self._full_object is None:
+            self._full_object = self.to_json_object(full=True)
+        full_object = self._full_object
+        return json.dumps({field: full_object[field] for field in fields if field in full_object})
+
+    def department_code(self):
+        """Returns the department prefix of the subject ID, e.g. "21M" for "21M.030"."""
+        return self.subject_id.split(".")[0]
+
+    get_hass_attributes = Course.__dict__["get_hass_attributes"]
+    to_json_object = Course.__dict__["to_json_object"]
+    satisfies = Course.__dict__["satisfies"]
+
+
+class CatalogSnapshot(object):
+    """
+    Describes every public course in the catalog at a particular version,
+    sorted by subject ID and indexed by subject ID and department.
+    """
+
+    def __init__(self, courses, version=None):
+        self.version = version
+        self.courses = sorted((CourseRecord(c) for c in courses if c.subject_id),
+                              key=lambda c: c.subject_id)
+        self.subject_ids = [c.subject_id for c in self.courses]
+        self.by_subject_id = {}
+        self.by_department = {}
+        self._json_lists = {}
+        self._search_index = None
+        self._completion_index = None
+        self._table = None
+        self._prereq_graph = None
+        self._requirement_index = None
+        self._schedules = {}
+        for course in self.courses:
+            self.by_subject_id[course.subject_id] = course
+            self.by_department.setdefault(course.department_code(), []).append(course)
+        self.relations = SubjectRelations(self.courses)
+        self.equivalence = EquivalenceResolver()
+        for field in EQUIVALENCE_FIELDS:
+            for subject_id, others in self.relations.forward[field].items():
+                for other_id in others:
+                    self.equivalence.union(subject_id, other_id)
+
+    @classmethod
+    def build(cls, version=None):
+        """Builds a snapshot from the public courses currently in the database."""
+        return cls(Course.public_courses().iterator(), version=version)
+
+    def get(self, subject_id):
+        """Returns the record with the given subject ID, or None if it doesn't exist."""
+        return self.by_subject_id.get(subject_id)
+
+    def related(self, subject_id, relation):
+        """Returns the records listed in the given relation field (see
+        catalog.relations.RELATION_FIELDS) of the given subject, skipping subject
+        IDs that are not in the catalog."""
+        records = (self.by_subject_id.get(other) for other in self.relations.related(subject_id, relation))
+        return [record for record in records if record is not None]
+
+    def referencing(self, subject_id, relation):
+        """Returns the records whose given relation field lists the given
+        subject, sorted by subject ID."""
+        return sorted((self.by_subject_id[other] for other in self.relations.referencing(subject_id, relation)),
+                      key=lambda c: c.subject_id)
+
+    def page(self, after=None, limit=None):
+        """Returns the records whose subject IDs come after the given subject ID
+        (or from the beginning if after is None), up to limit records."""
+        start = 0 if after is None else bisect_right(self.subject_ids, after)
+        end = len(self.courses) if limit is None else start + limit
+        return self.courses[start:end]
+
+    def department(self, dept):
+        """Returns the records whose subject IDs begin with the given
+        department code, sorted by subject ID."""
+        if "." not in dept:
+            return self.by_department.get(dept, [])
+        prefix = dept + "."
+        return [c for c in self.courses if c.subject_id.startswith(prefix)]
+
+    def json_list(self, full=False):
+        """Returns a serialized JSON array of every course in the snapshot. The
+        result is computed once per snapshot."""
+        if full not in self._json_lists:
+            self._json_lists[full] = json_array(c.json_fragment(full) for c in self.courses)
+        return self._json_lists[full]
+
+    def search_index(self):
+        """Returns the full-text search index for this snapshot, building it on
+        first use."""
+        if self._search_index is None:
+            self._search_index = SearchIndex(self.courses)
+        return self._search_index
+
+    def completion_index(self):
+        """Returns the autocomplete index for this snapshot, building it on
+        first use."""
+        if self._completion_index is None:
+            self._completion_index = CompletionIndex(self.courses)
+        return self._completion_index
+
+    def table(self):
+        """Returns the columnar CatalogTable for this snapshot, building it on
+        first use."""
+        if self._table is None:
+            self._table = CatalogTable(self.courses)
+        return self._table
+
+    def prereq_graph(self):
+        """Returns the compiled PrerequisiteGraph for this snapshot, building it
+        on first use."""
+        if self._prereq_graph is None:
+            self._prereq_graph = PrerequisiteGraph(self)
+        return self._prereq_graph
+
+    def requirement_index(self):
+        """Returns the RequirementIndex mapping requirement strings to the
+        subjects that satisfy them, building it on first use."""
+        if self._requirement_index is None:
+            self._requirement_index = RequirementIndex(self)
+        return self._requirement_index
+
+    def schedules(self, field="schedule"):
+        """Returns a list of the decoded CourseSchedules (or None) of the given
+        schedule field of each course, in the same order as the course list.
+        Each field is decoded on first use."""
+        if field not in SCHEDULE_FIELDS:
+            raise ValueError("invalid schedule field: {}".format(field))
+        if field not in self._schedules:
+            self._schedules[field] = [decode_schedule(getattr(c, field)) for c in self.courses]
+        return self._schedules[field]
+
+    def term_schedules(self, term=None):
+        """Returns a list of the decoded CourseSchedules (or None) of each course
+        in the given term ("fall", "IAP" or "spring"), in the same order as the
+        course list. A course's term-specific schedule is used if it has one,
+        and its general schedule otherwise. If term is None, the general
+        schedules are returned. Raises a ValueError if the term is invalid."""
+        if term is None:
+            return self.schedules()
+        key = term.lower()
+        if key not in TERM_SCHEDULE_FIELDS:
+            raise ValueError("invalid term: {}".format(term))
+        if key not in self._schedules:
+            self._schedules[key] = [specific if specific is not None else general
+                                    for specific, general in zip(self.schedules(TERM_SCHEDULE_FIELDS[key]),
+                                                                 self.schedules())]
+        return self._schedules[key]
+
+    def position(self, subject_id):
+        """Returns the index of the given subject in the course list, or None if
+        it doesn't exist."""
+        index = bisect_left(self.subject_ids, subject_id)
+        if index == len(self.subject_ids) or self.subject_ids[index] != subject_id:
+            return None
+        return index
+
+    def schedule(self, subject_id, field="schedule"):
+        """Returns the decoded CourseSchedule of the given schedule field of the
+        given subject, or None if it has no schedule or doesn't exist."""
+        index = self.position(subject_id)
+        return None if index is None else self.schedules(field)[index]
+
+    def __len__(self):
+        return len(self.courses)
+
+    def __iter__(self):
+        return iter(self.courses)
+
+
+def json_array(fragments):
+    """Joins the given serialized JSON values into a serialized JSON array."""
+    return "[" + ",".join(fragments) + "]"
+
+# Number of course fragments written per chunk of a streamed response
+STREAM_CHUNK_SIZE = 200
+
+def iter_json_array(fragments, chunk_size=STREAM_CHUNK_SIZE):
+    """Yields a serialized JSON array of the given serialized JSON values in
+    chunks, so that the array never has to be held in memory as a whole."""
+    chunk = ["["]
+    count = 0
+    for fragment in fragments:
+        if count > 0:
+            chunk.append(",")
+        chunk.append(fragment)
+        count += 1
+        if count % chunk_size == 0:
+            yield "".join(chunk)
+            chunk = []
+    chunk.append("]")
+    yield "".join(chunk)
+
+
+_snapshot = None
+_generation = 0
+_build_lock = threading.Lock()
+
+def current_version():
+    """Returns a key that changes whenever the public catalog changes: the
+    semester and delta version last loaded by update_db.py, plus a counter of
+    public course changes made in this process."""
+    return (loaded_catalog_version(), _generation)
+
+def get_snapshot():
+    """Returns the snapshot for the current catalog version, building it if
+    necessary. Concurrent callers wait for a single build, and readers never see
+    a partially-built snapshot."""
+    global _snapshot
+    version = current_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with _build_lock:
+        if _snapshot is not None and _snapshot.version == version:
+            return _snapshot
+        snapshot = CatalogSnapshot.build(version)
+        _snapshot = snapshot
+    return snapshot
+
+def invalidate_snapshot():
+    """Forces the snapshot to be rebuilt on its next use."""
+    global _generation
+    _generation += 1
+
+def _public_course_changed(sender, instance, **kwargs):
+    if instance.public:
+        invalidate_snapshot()
+
+post_save.connect(_public_course_changed, sender=Course)
+post_delete.connect(_public_course_changed, sender=Course)
+
+# Number of snapshots of semesters other than the current one kept in memory
+SEMESTER_SNAPSHOT_LIMIT = 4
+
+_semester_snapshots = OrderedDict()
+# Guards _semester_snapshots and _semester_build_locks, but is not held while
+# a snapshot is built
+_semester_lock = threading.Lock()
+# Locks held while building each semester's snapshot, so that concurrent
+# callers wait for a single build without blocking other semesters
+_semester_build_locks = {}
+
+def _cached_semester_snapshot(semester, version):
+    """Returns the cached snapshot for the given semester if it has the given
+    version, marking it as most recently used, or None. Must be called with
+    _semester_lock held."""
+    snapshot = _semester_snapshots.get(semester)
+    if snapshot is None or snapshot.version != version:
+        return None
+    del _semester_snapshots[semester]
+    _semester_snapshots[semester] = snapshot
+    return snapshot
+
+def is_current_semester(semester):
+    """Returns whether the given semester is None or is the semester whose
+    catalog is loaded in the database."""
+    if not semester:
+        return True
+    loaded = loaded_catalog_version()
+    return loaded is not None and loaded[0] == semester
+
+def get_semester_snapshot(semester=None):
+    """
+    Returns the snapshot for the given semester, e.g. "fall-2017". If semester
+    is None or the current semester, this is the same as get_snapshot. Other
+    semesters are read from their catalog files, and rebuilt when their delta
+    version changes; only the SEMESTER_SNAPSHOT_LIMIT most recently used are
+    kept. Raises a ValueError if the semester has no catalog files.
+    """
+    if is_current_semester(semester):
+        return get_snapshot()
+    version = semester_version(semester)
+    with _semester_lock:
+        snapshot = _cached_semester_snapshot(semester, version)
+        if snapshot is not None:
+            return snapshot
+        build_lock = _semester_build_locks.setdefault(semester, threading.Lock())
+    with build_lock:
+        with _semester_lock:
+            snapshot = _cached_semester_snapshot(semester, version)
+        if snapshot is not None:
+            return snapshot
+        snapshot = CatalogSnapshot(read_semester_courses(semester), version=version)
+        with _semester_lock:
+            _semester_snapshots[semester] = snapshot
+            while len(_semester_snapshots) > SEMESTER_SNAPSHOT_LIMIT:
+                _semester_snapshots.popitem(last=False)
+    return snapshot
@@ -0,0 +1,63 @@
+"""
+A columnar view of the catalog snapshot, used to evaluate search filters. Each
+attribute that can be filtered on is stored as a NumPy array with one entry per
+course, in the same order as the snapshot's sorted course list, so a filter is
+a single vectorized comparison producing a boolean mask.
+"""
+
+import numpy as np
+
+class CatalogTable(object):
+    """
+    Boolean, categorical and numeric columns describing a list of course
+    records. Categorical columns hold strings, with missing values stored as
+    empty strings.
+    """
+
+    def __init__(self, courses):
+        courses = list(courses)
+        self.size = len(courses)
+
+        def column(getter, dtype):
+            return np.array([getter(c) for c in courses], dtype=dtype)
+
+        def hass_column(attribute):
+            return column(lambda c: attribute in (c.hass_attribute or "").upper(), bool)
+
+        self.offered_fall = column(lambda c: bool(c.offered_fall), bool)
+        self.offered_IAP = column(lambda c: bool(c.offered_IAP), bool)
+        self.offered_spring = column(lambda c: bool(c.offered_spring), bool)
+        self.offered_summer = column(lambda c: bool(c.offered_summer), bool)
+
+        self.level = column(lambda c: c.level or "", object)
+        self.gir_attribute = column(lambda c: c.gir_attribute or "", object)
+        self.communication_requirement = column(lambda c: c.communication_requirement or "", object)
+
+        self.hass_any = column(lambda c: bool(c.hass_attribute), bool)
+        self.hass_a = hass_column("HASS-A")
+        self.hass_s = hass_column("HASS-S")
+        self.hass_h = hass_column("HASS-H")
+
+        self.total_units = column(lambda c: c.total_units or 0, np.int32)
+        self.rating = column(lambda c: c.rating or 0.0, np.float64)
+        self.hours = column(lambda c: (c.in_class_hours or 0.0) + (c.out_of_class_hours or 0.0), np.float64)
+
+    def index_mask(self, indexes):
+        """Returns a boolean array that is True at the given course indexes."""
+        result = np.zeros(self.size, dtype=bool)
+        result[list(indexes)] = True
+        return result
+
+    def mask(self, filters):
+        """Returns a boolean array indicating which courses satisfy all of the
+        given filters. Each filter is a function that takes this table and
+        returns a boolean array."""
+        result = np.ones(self.size, dtype=bool)
+        for mask_filter in filters:
+            result &= mask_filter(self)
+        return result
+
+    def indexes(self, filters):
+        """Returns the set of course indexes that satisfy all of the given
+        filters."""
+        return set(np.flatnonzero(self.mask(filters)).tolist())
@@ -1,8 +1,26 @@
-from django.test import TestCase
-from .models import Course, CourseFields
+from django.test import TestCase, override_settings
+from .models import Course, CourseFields, Section
 from django.test.client import RequestFactory
 from . import views
+from .snapshot import get_snapshot, iter_json_array, get_semester_snapshot
+from . import snapshot as snapshot_module
+from catalog_parse.utils.catalog_constants import CourseAttribute
+import os
+from courseupdater.views import mark_catalog_loaded
+from catalog_parse.utils.equivalence import EquivalenceResolver
+from .prereqs import compile_prereqs
+from .schedule import parse_time_range, slot_mask, decode_schedule, generate_schedules, schedule_penalty, \
+    SLOTS_PER_DAY, PREFER_NO_EARLY, PREFER_COMPACT
+from django.http import Http404
+from django.test import Client
+from django.contrib.auth.models import User
+from sync.models import Schedule
+from common.models import APIClient
+from common.token_gen import generate_token
 import json
+import shutil
+import tempfile
+import threading
 
 
 class CourseCatalogTest(TestCase):
@@ -187,6 +205,24 @@ class CourseCatalogTest(TestCase):
         self.assertTrue(courses[0].satisfies("6.00", all_courses=courses))
         self.assertTrue(courses[1].satisfies("6.00", all_courses=courses))
 
+    def test_make_generic(self):
+        course = Course.make_generic("CI-H HASS-A", 3)
+        self.assertEqual("CI-H HASS-A", course.subject_id)
+        self.assertEqual("CI-H HASS-A3", course.id)
+        self.assertTrue(course.satisfies("CI-H"))
+        self.assertTrue(course.satisfies("HASS-A"))
+        # Each repeatable generic course gets its own ID
+        self.assertEqual("REST0", Course.make_generic("REST", 0).id)
+        self.assertEqual("REST1", Course.make_generic("REST", 1).id)
+        self.assertEqual("CAL1", Course.make_generic("CAL1", 2).id)
+        # Cached generic courses are copied, so changes don't leak between calls
+        course = Course.make_generic("CAL1", 0)
+        course.total_units = 99
+        self.assertIsNot(course, Course.make_generic("CAL1", 0))
+        self.assertNotEqual(99, Course.make_generic("CAL1", 0).total_units)
+        self.assertRaises(ValueError, Course.make_generic, "CI-H FOO", 0)
+        self.assertRaises(ValueError, Course.make_generic, "6.0001", 0)
+
     ### Catalog endpoints
 
     def test_lookup_subject(self):
@@ -290,3 +326,701 @@ class CourseCatalogTest(TestCase):
         self.assertEqual(200, response.status_code)
         results = json.loads(response.content)
         self.assertEqual([], results)
+
+    def test_search_description_and_instructors(self):
+        request = self.factory.get("/courses/search/")
+        for term in ["zimmer", "test description", "descrip"]:
+            results = json.loads(views.search(request, search_term=term).content)
+            self.assertEqual(["21M.030"], [c[CourseFields.subject_id] for c in results])
+        # Other match types only consider the subject ID and title
+        request = self.factory.get("/courses/search/", {"type": "starts"})
+        self.assertEqual([], json.loads(views.search(request, search_term="zimmer").content))
+
+    def test_search_relevance(self):
+        Course.objects.create(subject_id="6.01", title="Intro to EECS", public=True,
+                              enrollment_number=300.0).save()
+        request = self.factory.get("/courses/search/")
+        results = json.loads(views.search(request, search_term="6.0001").content)
+        self.assertEqual("6.0001", results[0][CourseFields.subject_id])
+        # Enrollment breaks ties between equally relevant courses
+        results = json.loads(views.search(request, search_term="intro").content)
+        self.assertEqual(["6.01", "6.00", "6.0001", "6.0002"],
+                         [c[CourseFields.subject_id] for c in results])
+
+    def test_search_invalid_type(self):
+        request = self.factory.get("/courses/search/", {"type": "fuzzy"})
+        self.assertEqual(400, views.search(request, search_term="foo").status_code)
+
+    def test_catalog_table_masks(self):
+        table = get_snapshot().table()
+        ids = lambda mask: [c.subject_id for c, m in zip(get_snapshot(), mask) if m]
+        self.assertEqual(["21M.030"], ids(views.offered_filter("fall")(table)))
+        self.assertEqual(["21L.013", "21M.030"], ids(views.hass_filter("a")(table)))
+        self.assertEqual(["21L.001"], ids(views.ci_filter("cihw")(table)))
+        self.assertEqual(["21M.030", "8.01"], ids(views.gir_filter("any")(table)))
+        self.assertEqual(["21M.030"], ids(table.mask([views.level_filter("undergrad"),
+                                                     views.units_filter("6-12")])))
+
+    def test_search_range_filters(self):
+        def search_ids(params):
+            request = self.factory.get("/courses/search/", params)
+            response = views.search(request, search_term="music")
+            self.assertEqual(200, response.status_code)
+            return [c[CourseFields.subject_id] for c in json.loads(response.content)]
+        self.assertEqual(["21M.030"], search_ids({"units": "12"}))
+        self.assertEqual([], search_ids({"units": "0-11"}))
+        self.assertEqual(["21M.030"], search_ids({"rating": "4.5", "hours": "9"}))
+        self.assertEqual([], search_ids({"rating": "5.5"}))
+        self.assertEqual([], search_ids({"hours": "8"}))
+        request = self.factory.get("/courses/search/", {"units": "a-b"})
+        self.assertEqual(400, views.search(request, search_term="music").status_code)
+
+    ### Batch lookup
+
+    def test_lookup_batch_get(self):
+        request = self.factory.get("/courses/lookup_batch", {"ids": "21M.030, 8.01,18.01"})
+        get_snapshot()
+        with self.assertNumQueries(0):
+            response = views.lookup_batch(request)
+        self.assertEqual(200, response.status_code)
+        result = json.loads(response.content)
+        self.assertEqual(["18.01"], result["missing"])
+        self.assertEqual(set(["21M.030", "8.01"]), set(result["courses"]))
+        self.assertEqual(Course.objects.get(subject_id="21M.030").to_json_object(full=True),
+                         result["courses"]["21M.030"])
+
+    def test_lookup_batch_post(self):
+        request = self.factory.post("/courses/lookup_batch?full=false", json.dumps(["6.0001", "6.0002"]),
+                                    content_type="application/json")
+        result = json.loads(views.lookup_batch(request).content)
+        self.assertEqual([], result["missing"])
+        self.assertEqual(Course.objects.get(subject_id="6.0001").to_json_object(full=False),
+                         result["courses"]["6.0001"])
+
+        request = self.factory.post("/courses/lookup_batch", json.dumps({"ids": "6.0001"}),
+                                    content_type="application/json")
+        self.assertEqual(400, views.lookup_batch(request).status_code)
+        request = self.factory.post("/courses/lookup_batch", "[", content_type="application/json")
+        self.assertEqual(400, views.lookup_batch(request).status_code)
+
+    ### Field projection
+
+    def test_fields_projection(self):
+        params = {"fields": "subject_id,title,description"}
+        result = json.loads(views.lookup(self.factory.get("/courses/lookup/", params), subject_id="21M.030").content)
+        self.assertEqual({"subject_id": "21M.030", "title": "World Music",
+                          "description": "Test description of 21M.030"}, result)
+
+        results = json.loads(views.list_all(self.factory.get("/courses/all/", params)).content)
+        self.assertEqual(10, len(results))
+        self.assertEqual({"subject_id": "2.001", "title": "Foo"}, results[0])
+
+        results = json.loads(views.department(self.factory.get("/courses/dept/21M/", params), dept="21M").content)
+        self.assertEqual(["21M.030"], [c["subject_id"] for c in results])
+        self.assertIn("description", results[0])
+
+        results = json.loads(views.search(self.factory.get("/courses/search/", params), search_term="physics").content)
+        self.assertEqual([{"subject_id": "8.01", "title": "Physics"}], results)
+
+        request = self.factory.get("/courses/lookup_batch", {"ids": "8.01", "fields": "total_units"})
+        self.assertEqual({"8.01": {"total_units": 0}}, json.loads(views.lookup_batch(request).content)["courses"])
+
+    def test_fields_invalid(self):
+        request = self.factory.get("/courses/all/", {"fields": "subject_id,password"})
+        self.assertEqual(400, views.list_all(request).status_code)
+        self.assertEqual(400, views.lookup(request, subject_id="8.01").status_code)
+        self.assertEqual(400, views.search(request, search_term="physics").status_code)
+
+    ### Pagination
+
+    def collect_pages(self, view, params, **kwargs):
+        """Requests pages from the given view until no cursor is returned, and
+        returns the list of pages of subject IDs."""
+        pages = []
+        params = dict(params)
+        while True:
+            response = view(self.factory.get("/", params), **kwargs)
+            self.assertEqual(200, response.status_code)
+            result = json.loads(response.content)
+            pages.append([c[CourseFields.subject_id] for c in result["courses"]])
+            if result["next"] is None:
+                return pages
+            params["cursor"] = result["next"]
+
+    def test_list_all_pagination(self):
+        pages = self.collect_pages(views.list_all, {"limit": 4})
+        self.assertEqual([4, 4, 2], [len(page) for page in pages])
+        all_ids = json.loads(views.list_all(self.factory.get("/courses/all/")).content)
+        self.assertEqual([c[CourseFields.subject_id] for c in all_ids], sum(pages, []))
+
+        response = views.list_all(self.factory.get("/courses/all/", {"limit": 10, "total": "true"}))
+        result = json.loads(response.content)
+        self.assertEqual(10, result["total"])
+        self.assertIsNone(result["next"])
+
+    def test_search_pagination(self):
+        unpaginated = json.loads(views.search(self.factory.get("/courses/search/"), search_term="o").content)
+        pages = self.collect_pages(views.search, {"limit": 3}, search_term="o")
+        self.assertEqual([c[CourseFields.subject_id] for c in unpaginated], sum(pages, []))
+        self.assertTrue(all(len(page) == 3 for page in pages[:-1]))
+
+    def test_invalid_page_parameters(self):
+        for params in [{"limit": 0}, {"limit": "x"}, {"cursor": "abc"}, {"limit": 2, "cursor": "!!"}]:
+            self.assertEqual(400, views.list_all(self.factory.get("/courses/all/", params)).status_code)
+            self.assertEqual(400, views.search(self.factory.get("/courses/search/", params), search_term="o").status_code)
+
+    def test_tampered_search_cursor(self):
+        for key in [[[], "6.00"], [{"a": 1}, "6.00"], [True, "6.00"], ["-1", "6.00"], [-1.0, 2], {"a": 1}, [-1.0]]:
+            params = {"limit": 2, "cursor": views.encode_cursor(key)}
+            response = views.search(self.factory.get("/courses/search/", params), search_term="o")
+            self.assertEqual(400, response.status_code)
+
+    ### Autocomplete
+
+    def autocomplete_ids(self, term, **params):
+        request = self.factory.get("/courses/autocomplete/", params)
+        response = views.autocomplete(request, search_term=term)
+        self.assertEqual(200, response.status_code)
+        return [c[CourseFields.subject_id] for c in json.loads(response.content)]
+
+    def test_autocomplete_prefix(self):
+        self.assertEqual(["6.00", "6.0001", "6.0002"], self.autocomplete_ids("6.00"))
+        self.assertEqual(["21L.001", "21L.013"], self.autocomplete_ids("21l"))
+        self.assertEqual(["21M.030"], self.autocomplete_ids("mus"))
+        self.assertEqual(["6.00", "6.0001"], self.autocomplete_ids("6.00", limit=2))
+
+    def test_autocomplete_old_id(self):
+        Course.objects.create(subject_id="6.100A", old_id="6.0001", title="Intro to Python",
+                              public=True).save()
+        self.assertEqual(["6.0001", "6.100A", "6.0002"], self.autocomplete_ids("6.0001"))
+
+    def test_autocomplete_typos(self):
+        self.assertEqual(["8.01"], self.autocomplete_ids("physcs"))
+        self.assertEqual(["21L.013"], self.autocomplete_ids("supernatral"))
+        self.assertEqual([], self.autocomplete_ids("phz"))
+
+    def test_autocomplete_basic_fields(self):
+        request = self.factory.get("/courses/autocomplete/", {"limit": "x"})
+        self.assertEqual(400, views.autocomplete(request, search_term="6").status_code)
+        results = json.loads(views.autocomplete(self.factory.get("/"), search_term="world").content)
+        self.assertEqual([Course.objects.get(subject_id="21M.030").to_json_object(full=False)], results)
+
+    ### Subject relations
+
+    def test_get_related_subjects_single_query(self):
+        Course.objects.create(subject_id="21M.830", title="World Music (Grad)", public=True).save()
+        Course.objects.create(subject_id="21M.031", title="World Music II", public=True).save()
+        course = Course.objects.get(subject_id="21M.030")
+        with self.assertNumQueries(1):
+            self.assertEqual(["21M.830"], [c.subject_id for c in course.get_joint_subjects()])
+        with self.assertNumQueries(0):
+            self.assertEqual([], course.get_meets_with_subjects())
+        self.assertEqual(["21M.031"], [c.subject_id for c in course.get_equivalent_subjects()])
+
+    def test_snapshot_relations(self):
+        Course.objects.create(subject_id="21M.031", title="World Music II", public=True).save()
+        snapshot = get_snapshot()
+        relations = snapshot.relations
+        self.assertEqual(("21M.830", "21M.290"), relations.related("21M.030", "joint_subjects"))
+        self.assertEqual(("21M.030",), relations.referencing("21M.031", "equivalent_subjects"))
+        self.assertEqual(("6.0001", "6.0002"), relations.children("6.00"))
+        self.assertEqual("6.00", relations.parent("6.0002"))
+        self.assertIsNone(relations.parent("6.00"))
+        with self.assertNumQueries(0):
+            self.assertEqual(["21M.031"], [c.subject_id for c in snapshot.related("21M.030", "equivalent_subjects")])
+            self.assertEqual([], snapshot.related("21M.030", "joint_subjects"))
+            self.assertEqual(["21M.030"], [c.subject_id for c in snapshot.referencing("21M.031", "equivalent_subjects")])
+
+    ### Subject equivalence
+
+    def test_equivalence_resolver(self):
+        resolver = EquivalenceResolver([("6.006", "6.1210"), ("6.1210", "18.410")])
+        resolver.union("8.01", "8.011")
+        self.assertTrue(resolver.equivalent("6.006", "18.410"))
+        self.assertFalse(resolver.equivalent("6.006", "8.01"))
+        self.assertTrue(resolver.equivalent("21M.030", "21M.030"))
+        self.assertEqual("18.410", resolver.class_id("6.006"))
+        self.assertEqual(frozenset(["6.006", "6.1210", "18.410"]), resolver.members("6.1210"))
+        self.assertEqual(frozenset(["2.001"]), resolver.members("2.001"))
+
+        resolver = EquivalenceResolver.from_courses({"A": {"eq": ["B"], "joint": "C,D"}, "E": {}}, ["eq", "joint"])
+        self.assertEqual(frozenset(["A", "B", "C", "D"]), resolver.members("D"))
+        self.assertIn("E", resolver)
+
+    def test_satisfies_with_catalog_equivalence(self):
+        Course.objects.create(subject_id="21M.031", title="World Music II", public=True,
+                              equivalent_subjects="21M.032").save()
+        snapshot = get_snapshot()
+        course = Course.objects.get(subject_id="21M.030")
+        self.assertTrue(course.satisfies("21M.830", catalog=snapshot))
+        # Equivalence is transitive through 21M.031
+        self.assertTrue(course.satisfies("21M.032", catalog=snapshot))
+        self.assertFalse(course.satisfies("21M.032"))
+        self.assertFalse(course.satisfies("21M.051", catalog=snapshot))
+
+    def test_satisfies_parent_with_catalog(self):
+        snapshot = get_snapshot()
+        courses = list(Course.objects.filter(subject_id__in=["6.0001", "6.0002"]))
+        child = courses[0]
+        with self.assertNumQueries(0):
+            self.assertTrue(child.satisfies("6.00", courses, snapshot))
+            self.assertFalse(child.satisfies("6.00", courses[:1], snapshot))
+            self.assertFalse(child.satisfies("6.00", None, snapshot))
+        self.assertTrue(child.satisfies("6.00", courses))
+        self.assertFalse(child.satisfies("6.00", courses[:1]))
+
+    def test_requirement_index(self):
+        snapshot = get_snapshot()
+        index = snapshot.requirement_index()
+        self.assertEqual(frozenset(["21M.030", "21L.013"]), index.satisfying("HASS-A"))
+        self.assertEqual(frozenset(["6.0001", "6.00"]), index.satisfying("6.0001"))
+
+        ids = ["6.0001", "6.0002", "21M.030", "21L.013", "21L.001", "6.00", "2.001"]
+        courses = list(Course.objects.filter(subject_id__in=ids)) + [Course.make_generic("CI-H", 0)]
+        requirements = ["HASS", "HASS-A", "HASS-H", "GIR:REST", "CI-H", "CI-HW", "21M.830",
+                        "6.0001", "6.00", "2.001", "2.002"]
+        for road in (courses, courses[:1] + courses[2:]):
+            with self.assertNumQueries(0):
+                indexed_road = index.road(road)
+                for req in requirements:
+                    expected = [c for c in road if c.satisfies(req, road, snapshot)]
+                    self.assertEqual((expected, []), indexed_road.satisfying_courses(req, catalog=snapshot))
+
+    ### Prerequisites
+
+    def test_compile_prereqs(self):
+        expression = compile_prereqs("18.701/(18.703, (18.06/18.700))/''permission of instructor''")
+        self.assertEqual({"any": ["18.701",
+                                  {"all": ["18.703", {"any": ["18.06", "18.700"]}]},
+                                  {"text": "permission of instructor"}]},
+                         expression.to_json_object())
+        self.assertEqual(["18.701", "18.703", "18.06", "18.700"], expression.subject_ids())
+        self.assertEqual("GIR:CAL2", compile_prereqs("GIR:CAL2").to_json_object())
+        self.assertEqual({"all": ["6.006", {"any": ["6.042", "18.062"]}]},
+                         compile_prereqs("6.006, 6.042/18.062").to_json_object())
+        self.assertIsNone(compile_prereqs(""))
+        self.assertIsNone(compile_prereqs(None))
+
+    def make_prereq_courses(self):
+        Course.objects.filter(subject_id="6.0001").update(prerequisites="GIR:PHY1")
+        Course.objects.create(subject_id="6.006", title="Algorithms", public=True,
+                              prerequisites="6.0001, 2.001/2.002").save()
+        Course.objects.create(subject_id="6.046", title="Design and Analysis of Algorithms",
+                              public=True, prerequisites="6.006/''permission of instructor''").save()
+        Course.objects.create(subject_id="6.854", title="Advanced Algorithms", public=True,
+                              prerequisites="6.046, 21M.030").save()
+
+    def test_prereq_graph(self):
+        self.make_prereq_courses()
+        graph = get_snapshot().prereq_graph()
+        ids = lambda courses: [c.subject_id for c in courses]
+        self.assertEqual(["2.001", "2.002", "21M.030", "6.0001", "6.006", "6.046"],
+                         ids(graph.all_prerequisites("6.854")))
+        self.assertEqual(["6.006", "6.046", "6.854"], ids(graph.all_dependents("6.0001")))
+        self.assertEqual([], ids(graph.all_prerequisites("21M.999")))
+
+        self.assertEqual(["6.0001"], ids(graph.unlocked_by(["8.01"])))
+        self.assertEqual([], ids(graph.unlocked_by(["6.0001"])))
+        self.assertEqual(["6.006"], ids(graph.unlocked_by(["6.0001", "2.002"])))
+        self.assertEqual(["6.046"], ids(graph.unlocked_by(["6.006"])))
+
+    def test_prereq_endpoints(self):
+        self.make_prereq_courses()
+        response = views.prerequisites(self.factory.get("/courses/prereqs/6.046"), subject_id="6.046")
+        result = json.loads(response.content)
+        self.assertEqual({"any": ["6.006", {"text": "permission of instructor"}]}, result["prerequisites"])
+        self.assertIsNone(result["corequisites"])
+        self.assertEqual(["2.001", "2.002", "6.0001", "6.006"], result["all_prerequisites"])
+        self.assertEqual(404, views.prerequisites(self.factory.get("/"), subject_id="6.999").status_code)
+
+        request = self.factory.get("/courses/unlocked", {"completed": "6.0001,2.001", "fields": "subject_id"})
+        self.assertEqual([{"subject_id": "6.006"}], json.loads(views.unlocked(request).content))
+        request = self.factory.post("/courses/unlocked", json.dumps(["6.006", "21M.030", "6.046"]),
+                                    content_type="application/json")
+        self.assertEqual(["6.854"], [c["subject_id"] for c in json.loads(views.unlocked(request).content)])
+
+    ### Schedules
+
+    def test_parse_time_range(self):
+        self.assertEqual((20, 22), parse_time_range("10"))
+        self.assertEqual((19, 22), parse_time_range("9.30-11"))
+        self.assertEqual((26, 28), parse_time_range("1"))
+        self.assertEqual((20, 26), parse_time_range("10-1"))
+        self.assertEqual((38, 40), parse_time_range("7 PM", evening=True))
+        self.assertEqual((35, 38), parse_time_range("5.30-7 PM", evening=True))
+        self.assertEqual((38, 44), parse_time_range("7-10", evening=True))
+        self.assertRaises(ValueError, parse_time_range, "noon")
+
+    def test_decode_schedule(self):
+        schedule = decode_schedule("Lecture,10-250/MWF/0/10;Recitation,34-301/M/0/11,34-302/T/1/7 PM,TBA;"
+                                   "Lab,4-409/T/0/2-5/R/0/1")
+        self.assertEqual(["Lecture", "Recitation", "Lab"], [t for t, _ in schedule.section_types])
+        lecture, recitations, lab = [options for _, options in schedule.section_types]
+        self.assertEqual(slot_mask("MWF", 20, 22), lecture[0].mask)
+        self.assertEqual(["34-301", "34-302", "TBA"], [r.location for r in recitations])
+        self.assertEqual(1 << (SLOTS_PER_DAY + 38), recitations[1].mask & -recitations[1].mask)
+        self.assertEqual(0, recitations[2].mask)
+        self.assertEqual(slot_mask("T", 28, 34) | slot_mask("R", 26, 28), lab[0].mask)
+        self.assertFalse(lecture[0].conflicts(recitations[0].mask))
+        self.assertTrue(lecture[0].conflicts(slot_mask("W", 21, 22)))
+
+        self.assertIsNone(decode_schedule(""))
+        self.assertIsNone(decode_schedule("Lecture,1-190/MW/0/sometime"))
+
+    def test_snapshot_schedules(self):
+        snapshot = get_snapshot()
+        schedule = snapshot.schedule("21M.030")
+        self.assertEqual(slot_mask("MW", 19, 25), schedule.mask())
+        self.assertIs(schedule, snapshot.schedules()[snapshot.subject_ids.index("21M.030")])
+        self.assertIsNone(snapshot.schedule("21M.030", "schedule_fall"))
+        self.assertIsNone(snapshot.schedule("21M.999"))
+        self.assertRaises(ValueError, snapshot.schedules, "title")
+
+    def make_scheduled_courses(self):
+        Course.objects.create(subject_id="18.03", title="Differential Equations", public=True,
+                              schedule="Lecture,2-190/MWF/0/11;Recitation,2-131/T/0/1,2-132/R/0/10").save()
+        Course.objects.create(subject_id="6.036", title="Machine Learning", public=True,
+                              schedule="Lecture,32-123/TR/0/1;Recitation,36-155/W/0/10,36-156/F/0/10",
+                              schedule_fall="Lecture,32-123/TR/0/3").save()
+        Course.objects.create(subject_id="6.042", title="Math for CS", public=True,
+                              schedule="Lecture,4-370/TR/0/1-2.30").save()
+
+    def test_conflicts(self):
+        self.make_scheduled_courses()
+        request = self.factory.get("/courses/conflicts", {"subjects": "21M.030,18.03,6.036,6.042,2.001,6.999"})
+        result = json.loads(views.conflicts(request).content)
+        self.assertEqual(["2.001", "6.999"], result["unscheduled"])
+        conflicts = {tuple(c["subjects"]): c for c in result["conflicts"]}
+        self.assertEqual({("21M.030", "18.03"), ("21M.030", "6.036"), ("18.03", "6.036"), ("6.036", "6.042"),
+                          ("18.03", "6.042")}, set(conflicts))
+        self.assertFalse(conflicts[("21M.030", "18.03")]["unavoidable"])
+        self.assertEqual([[{"type": "Lecture", "index": 1}, {"type": "Lecture", "index": 0}]],
+                         conflicts[("21M.030", "18.03")]["sections"])
+        self.assertTrue(conflicts[("6.036", "6.042")]["unavoidable"])
+
+        # Fall schedules take precedence
+        request = self.factory.get("/courses/conflicts", {"subjects": "6.036,6.042", "term": "fall"})
+        self.assertEqual([], json.loads(views.conflicts(request).content)["conflicts"])
+        request = self.factory.get("/courses/conflicts", {"subjects": "6.036", "term": "summer"})
+        self.assertEqual(400, views.conflicts(request).status_code)
+
+        # Only selected and allowed sections are considered
+        contents = {"selectedSubjects": [
+            {"subject_id": "18.03", "selectedSections": {"Recitation": 0}},
+            {"subject_id": "6.036", "allowedSections": {"recitation": [1]}},
+            {"subject_id": "21M.030", "selectedSections": {"Lecture": 0}}
+        ]}
+        request = self.factory.post("/courses/conflicts", json.dumps(contents), content_type="application/json")
+        result = json.loads(views.conflicts(request).content)
+        self.assertEqual([{"subjects": ["18.03", "6.036"], "unavoidable": True,
+                           "sections": [[{"type": "Recitation", "index": 0}, {"type": "Lecture", "index": 0}]]}],
+                         result["conflicts"])
+        request = self.factory.post("/courses/conflicts", "[1]", content_type="application/json")
+        self.assertEqual(400, views.conflicts(request).status_code)
+        for sections in [{"allowedSections": {"recitation": 1}}, {"allowedSections": {"recitation": {"a": 1}}},
+                         {"allowedSections": {"recitation": ["1"]}}, {"selectedSections": {"Lecture": [0]}}]:
+            sections["subject_id"] = "6.036"
+            request = self.factory.post("/courses/conflicts", json.dumps({"selectedSubjects": [sections]}),
+                                        content_type="application/json")
+            self.assertEqual(400, views.conflicts(request).status_code)
+
+    def test_search_no_conflict_with(self):
+        self.make_scheduled_courses()
+        request = self.factory.get("/courses/search/.", {"no_conflict_with": "6.036", "fields": "subject_id"})
+        result = [c["subject_id"] for c in json.loads(views.search(request, search_term=".").content)]
+        self.assertIn("18.03", result)
+        self.assertIn("21M.030", result)
+        self.assertIn("2.001", result)
+        self.assertNotIn("6.036", result)
+        self.assertNotIn("6.042", result)
+
+        request = self.factory.get("/courses/search/.", {"no_conflict_with": "6.036", "term": "fall",
+                                                         "fields": "subject_id"})
+        result = [c["subject_id"] for c in json.loads(views.search(request, search_term=".").content)]
+        self.assertIn("6.042", result)
+
+    def test_conflicts_stored_schedule_with_token(self):
+        self.make_scheduled_courses()
+        user = User.objects.create_user(username="student", password="password")
+        schedule = Schedule.objects.create(user=user, name="Fall", contents=json.dumps(
+            {"selectedSubjects": [{"id": "6.036"}, {"id": "6.042"}]}))
+        url = "/courses/conflicts?schedule={}".format(schedule.pk)
+
+        client = Client()
+        self.assertEqual(403, client.get(url).status_code)
+        no_permission = generate_token(None, user, 3600, APIClient(name="No schedules"))
+        response = client.get(url, HTTP_AUTHORIZATION="Bearer " + no_permission)
+        self.assertEqual(403, response.status_code)
+
+        token = generate_token(None, user, 3600, APIClient(name="Schedules", can_view_schedules=True))
+        response = Client().get(url, HTTP_AUTHORIZATION="Bearer " + token)
+        self.assertEqual(200, response.status_code)
+        result = json.loads(response.content)
+        self.assertEqual([["6.036", "6.042"]], [c["subjects"] for c in result["conflicts"]])
+
+    def test_generate_schedules(self):
+        lecture = decode_schedule("Lecture,1-190/MWF/0/10")
+        recitations = decode_schedule("Lecture,2-190/TR/0/11;Recitation,2-131/M/0/10,2-132/T/0/9,2-133/W/0/2")
+        combinations, complete = generate_schedules([lecture, recitations], 10, 5.0)
+        self.assertTrue(complete)
+        self.assertEqual([[0, 1], [0, 2]], sorted([s.index for s in c[1]] for c in combinations))
+
+        combinations, complete = generate_schedules([lecture, recitations], 1, 5.0)
+        self.assertFalse(complete)
+        self.assertEqual(1, len(combinations))
+        self.assertEqual([], generate_schedules([lecture, lecture], 10, 5.0)[0])
+
+        self.assertEqual(4, schedule_penalty(slot_mask("MW", 18, 20), [PREFER_NO_EARLY]))
+        self.assertEqual(3, schedule_penalty(slot_mask("M", 18, 20) | slot_mask("M", 23, 24), [PREFER_COMPACT]))
+        self.assertEqual(0, schedule_penalty(slot_mask("M", 18, 20), []))
+
+    def test_generate_schedules_endpoint(self):
+        self.make_scheduled_courses()
+        request = self.factory.get("/courses/generate_schedules", {"subjects": "18.03,6.036,2.001",
+                                                                   "prefer": "no_early"})
+        response = views.generate_schedules(request)
+        result = json.loads("".join(response.streaming_content))
+        self.assertTrue(result["complete"])
+        self.assertEqual(["2.001"], result["unscheduled"])
+        self.assertEqual([0, 1], sorted(s["selectedSections"]["6.036"]["Recitation"] for s in result["schedules"]))
+        for schedule in result["schedules"]:
+            self.assertEqual({"Lecture": 0, "Recitation": 1}, schedule["selectedSections"]["18.03"])
+            self.assertEqual(0, schedule["penalty"])
+
+        contents = '{"ssub":[{"subject_id":"18.03"},{"subject_id":"6.036","as":{"Recitation":[0]}}]}'
+        request = self.factory.post("/courses/generate_schedules?limit=1", contents,
+                                    content_type="application/json")
+        result = json.loads("".join(views.generate_schedules(request).streaming_content))
+        self.assertTrue(result["complete"])
+        self.assertEqual([{"selectedSections": {"18.03": {"Lecture": 0, "Recitation": 1},
+                                                "6.036": {"Lecture": 0, "Recitation": 0}}, "penalty": 0}],
+                         result["schedules"])
+
+        # Allowed sections drive the search even when a section is selected
+        contents = {"selectedSubjects": [
+            {"subject_id": "18.03"},
+            {"subject_id": "6.036", "selectedSections": {"Lecture": 0, "Recitation": 0},
+             "allowedSections": {"Recitation": [0, 1]}}
+        ]}
+        request = self.factory.post("/courses/generate_schedules", json.dumps(contents),
+                                    content_type="application/json")
+        result = json.loads("".join(views.generate_schedules(request).streaming_content))
+        self.assertEqual([0, 1], sorted(s["selectedSections"]["6.036"]["Recitation"] for s in result["schedules"]))
+
+        request = self.factory.get("/courses/generate_schedules", {"subjects": "18.03", "prefer": "late"})
+        self.assertEqual(400, views.generate_schedules(request).status_code)
+
+    def test_rebuild_sections(self):
+        self.make_scheduled_courses()
+        Section.rebuild(batch_size=2)
+        self.assertEqual(5, Section.objects.filter(subject_id="18.03", term="").count())
+        self.assertEqual(4, Section.objects.filter(subject_id="21M.030").count())
+        # Tuesday at 2pm
+        meeting = Section.objects.filter(term="", day=1, start_slot__lte=28, end_slot__gt=28)
+        self.assertEqual(["6.042"], [s.subject_id for s in meeting])
+        fall = Section.objects.get(subject_id="6.036", term="fall", day=3)
+        self.assertEqual(("Lecture", "32-123", "32", 30, 32),
+                         (fall.section_type, fall.location, fall.building, fall.start_slot, fall.end_slot))
+        self.assertEqual({"6.036", "18.03"},
+                         set(Section.objects.filter(building__in=["2", "36"]).values_list("subject_id", flat=True)))
+
+        # Rebuilding replaces the existing sections
+        Course.objects.filter(subject_id="6.042").delete()
+        Section.rebuild()
+        self.assertFalse(Section.objects.filter(subject_id="6.042").exists())
+        self.assertEqual(5, Section.objects.filter(subject_id="18.03").count())
+
+    ### Catalog snapshot
+
+    def test_snapshot_indexes(self):
+        snapshot = get_snapshot()
+        self.assertEqual(10, len(snapshot))
+        self.assertEqual("World Music", snapshot.get("21M.030").title)
+        self.assertIsNone(snapshot.get("21M.999"))
+        self.assertEqual(["21L.001", "21L.013"],
+                         [c.subject_id for c in snapshot.department("21L")])
+        self.assertEqual(sorted(c.subject_id for c in snapshot),
+                         [c.subject_id for c in snapshot])
+
+    def test_snapshot_record_json(self):
+        record = get_snapshot().get("21M.030")
+        course = Course.objects.get(subject_id="21M.030")
+        self.assertDictEqual(course.to_json_object(), record.to_json_object())
+        self.assertDictEqual(course.to_json_object(full=False), record.to_json_object(full=False))
+
+    def test_snapshot_reads_without_queries(self):
+        get_snapshot()
+        request = self.factory.get("/courses/all/")
+        with self.assertNumQueries(0):
+            views.list_all(request)
+            views.lookup(request, subject_id="2.001")
+            views.department(request, dept="6")
+            views.search(request, search_term="foo")
+
+    def test_snapshot_invalidated_on_save(self):
+        request = self.factory.get("/courses/lookup/")
+        self.assertEqual(404, views.lookup(request, subject_id="18.01").status_code)
+        Course.objects.create(subject_id="18.01", title="Calculus", public=True)
+        self.assertEqual(200, views.lookup(request, subject_id="18.01").status_code)
+        Course.objects.filter(subject_id="18.01").delete()
+        self.assertEqual(404, views.lookup(request, subject_id="18.01").status_code)
+
+    def test_snapshot_json_fragments(self):
+        snapshot = get_snapshot()
+        for record in snapshot:
+            self.assertEqual(record.to_json_object(full=False), json.loads(record.json_fragment(full=False)))
+            self.assertEqual(record.to_json_object(full=True), json.loads(record.json_fragment(full=True)))
+        self.assertEqual([c.to_json_object(full=True) for c in snapshot],
+                         json.loads(snapshot.json_list(full=True)))
+
+    def test_list_all_full(self):
+        request = self.factory.get("/courses/all/", {"full": "true"})
+        response = views.list_all(request)
+        self.assertEqual(200, response.status_code)
+        courses = {c[CourseFields.subject_id]: c for c in json.loads(response.content)}
+        self.assertEqual(10, len(courses))
+        self.assertEqual(u"Test description of 21M.030", courses["21M.030"][CourseFields.description])
+
+    ### Conditional requests
+
+    def test_no_etag_without_loaded_catalog(self):
+        request = self.factory.get("/courses/all/")
+        response = views.list_all(request)
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_catalog_etag(self):
+        base_dir = tempfile.mkdtemp()
+        try:
+            with override_settings(CATALOG_BASE_DIR=base_dir):
+                mark_catalog_loaded("fall-2018", 3)
+                response = views.list_all(self.factory.get("/courses/all/"))
+                self.assertEqual(200, response.status_code)
+                etag = response["ETag"]
+
+                request = self.factory.get("/courses/all/", HTTP_IF_NONE_MATCH=etag)
+                with self.assertNumQueries(0):
+                    response = views.list_all(request)
+                self.assertEqual(304, response.status_code)
+                request = self.factory.get("/courses/dept/21L/", HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(304, views.department(request, dept="21L").status_code)
+
+                # A new catalog version changes the ETag
+                mark_catalog_loaded("fall-2018", 4)
+                request = self.factory.get("/courses/all/", HTTP_IF_NONE_MATCH=etag)
+                response = views.list_all(request)
+                self.assertEqual(200, response.status_code)
+                self.assertNotEqual(etag, response["ETag"])
+        finally:
+            shutil.rmtree(base_dir)
+
+    ### Semesters
+
+    def write_semester_catalog(self, base_dir, semester, version, rows):
+        """Writes a catalog file and delta file for the given semester, with
+        the given (subject ID, title) rows."""
+        comps = semester.split("-")
+        delta_dir = os.path.join(base_dir, "deltas", "sem-" + semester)
+        if not os.path.exists(delta_dir):
+            os.makedirs(delta_dir)
+            os.makedirs(os.path.join(base_dir, "sem-" + semester))
+        with open(os.path.join(delta_dir, "delta-{}.txt".format(version)), "w") as file:
+            file.write("#,#".join(comps) + "\n{}\n6\nrelated\n".format(version))
+        with open(os.path.join(base_dir, "sem-" + semester, "6.txt"), "w") as file:
+            file.write(",".join([CourseAttribute.subjectID, CourseAttribute.title]) + "\n")
+            for row in rows:
+                file.write(",".join(row) + "\n")
+        with open(os.path.join(base_dir, "sem-" + semester, "related.txt"), "w") as file:
+            file.write("6.001,6.002\n")
+
+    def test_semester_snapshots(self):
+        base_dir = tempfile.mkdtemp()
+        old_limit = snapshot_module.SEMESTER_SNAPSHOT_LIMIT
+        try:
+            with override_settings(CATALOG_BASE_DIR=base_dir):
+                mark_catalog_loaded("fall-2019", 1)
+                self.write_semester_catalog(base_dir, "spring-2001", 1, [("6.001", "SICP"), ("6.002", "Circuits")])
+                self.write_semester_catalog(base_dir, "fall-2001", 1, [("6.001", "Structure")])
+                self.assertIs(get_snapshot(), get_semester_snapshot("fall-2019"))
+                self.assertIs(get_snapshot(), get_semester_snapshot(None))
+
+                spring = get_semester_snapshot("spring-2001")
+                self.assertEqual(["6.001", "6.002"], spring.subject_ids)
+                self.assertEqual("SICP", spring.get("6.001").title)
+                self.assertEqual("6.002", spring.get("6.001").related_subjects)
+                self.assertIs(spring, get_semester_snapshot("spring-2001"))
+                self.assertRaises(ValueError, get_semester_snapshot, "fall-1999")
+                self.assertRaises(ValueError, get_semester_snapshot, "../fall-2001")
+
+                # Least recently used semesters are evicted
+                snapshot_module.SEMESTER_SNAPSHOT_LIMIT = 1
+                get_semester_snapshot("fall-2001")
+                self.assertIsNot(spring, get_semester_snapshot("spring-2001"))
+
+                # A new delta version rebuilds the semester
+                spring = get_semester_snapshot("spring-2001")
+                self.write_semester_catalog(base_dir, "spring-2001", 2, [("6.001", "SICP 2")])
+                self.assertEqual("SICP 2", get_semester_snapshot("spring-2001").get("6.001").title)
+
+                request = self.factory.get("/courses/lookup/6.001", {"sem": "fall-2001"})
+                with self.assertNumQueries(0):
+                    result = json.loads(views.lookup(request, subject_id="6.001").content)
+                self.assertEqual("Structure", result["title"])
+                request = self.factory.get("/courses/all", {"sem": "fall-2001"})
+                response = views.list_all(request)
+                self.assertEqual(["6.001"], [c["subject_id"] for c in json.loads(response.content)])
+                self.assertEqual('"catalog-fall-2001-1"', response["ETag"])
+                self.assertFalse(response.has_header("Last-Modified"))
+                request = self.factory.get("/courses/lookup/6.001", {"sem": "fall-1999"})
+                self.assertRaises(Http404, views.lookup, request, subject_id="6.001")
+        finally:
+            snapshot_module.SEMESTER_SNAPSHOT_LIMIT = old_limit
+            shutil.rmtree(base_dir)
+
+    def test_semester_snapshot_build_does_not_block_other_semesters(self):
+        base_dir = tempfile.mkdtemp()
+        old_read = snapshot_module.read_semester_courses
+        try:
+            with override_settings(CATALOG_BASE_DIR=base_dir):
+                mark_catalog_loaded("fall-2019", 1)
+                self.write_semester_catalog(base_dir, "spring-2002", 1, [("6.001", "SICP")])
+                self.write_semester_catalog(base_dir, "fall-2002", 1, [("6.001", "Structure")])
+                fall = get_semester_snapshot("fall-2002")
+
+                # While spring-2002 is being built, fall-2002 is served from the
+                # cache by another thread
+                lookups = []
+                def read_while_looking_up(semester):
+                    thread = threading.Thread(target=lambda: lookups.append(get_semester_snapshot("fall-2002")))
+                    thread.start()
+                    thread.join(5)
+                    return old_read(semester)
+                snapshot_module.read_semester_courses = read_while_looking_up
+                spring = get_semester_snapshot("spring-2002")
+                self.assertEqual([fall], lookups)
+                self.assertEqual("SICP", spring.get("6.001").title)
+        finally:
+            snapshot_module.read_semester_courses = old_read
+            shutil.rmtree(base_dir)
+
+    ### Streaming
+
+    def test_iter_json_array(self):
+        for count in range(5):
+            fragments = [json.dumps(i) for i in range(count)]
+            chunks = list(iter_json_array(fragments, chunk_size=2))
+            self.assertEqual(list(range(count)), json.loads("".join(chunks)))
+            self.assertEqual(count // 2 + 1, len(chunks))
+
+    def test_list_all_stream(self):
+        response = views.list_all(self.factory.get("/courses/all/", {"stream": "true", "full": "true"}))
+        self.assertTrue(response.streaming)
+        streamed = json.loads("".join(response.streaming_content))
+        expected = json.loads(views.list_all(self.factory.get("/courses/all/", {"full": "true"})).content)
+        self.assertEqual(expected, streamed)
+
+    def test_department_stream(self):
+        response = views.department(self.factory.get("/courses/dept/6/", {"stream": "1"}), dept="6")
+        self.assertTrue(response.streaming)
+        self.assertEqual(["6.00", "6.0001", "6.0002"],
+                         [c[CourseFields.subject_id] for c in json.loads("".join(response.streaming_content))])
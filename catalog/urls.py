@@ -3,6 +3,12 @@ from django.conf.urls import url
 from . import views
 
 urlpatterns = [
+    url(r'^autocomplete/(?P<search_term>[^?]+)', views.autocomplete, name='autocomplete'),
+    url(r'^lookup_batch', views.lookup_batch, name='lookup_batch'),
+    url(r'^prereqs/(?P<subject_id>[A-Za-z0-9.]+)', views.prerequisites, name='prerequisites'),
+    url(r'^unlocked', views.unlocked, name='unlocked'),
+    url(r'^conflicts', views.conflicts, name='conflicts'),
+    url(r'^generate_schedules', views.generate_schedules, name='generate_schedules'),
     url(r'lookup/(?P<subject_id>[A-z0-9.]+)', views.lookup, name='lookup'),
     url(r'search/(?P<search_term>[^?]+)', views.search, name='search'),
     url(r'dept/(?P<dept>[A-z0-9.]+)', views.department, name='department'),
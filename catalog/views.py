@@ -1,32 +1,205 @@
 from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound
-from django.core.exceptions import ObjectDoesNotExist
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, StreamingHttpResponse, Http404
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
+from django.views.decorators.http import condition
+from django.views.decorators.csrf import csrf_exempt
+from django.utils import timezone
+import datetime
 import os
 import json
-from .models import Course
-from django.db.models import Q
+import base64
+from bisect import bisect_right
+from .models import CourseFields
+from .snapshot import get_semester_snapshot, is_current_semester, json_array, iter_json_array, current_version
+from .semesters import semester_version
+from .search import id_title_matcher
+from .schedule import find_conflicts, conflicting_indexes, ranked_schedules, SCHEDULE_PREFERENCES
+from sync.models import Schedule
+from common.decorators import logged_in_or_basicauth, require_token_permissions
 
 # Create your views here.
 TRUE_SET = {"true", "yes", "y", "t", "1"}
 
+def requested_snapshot(request):
+    """Returns the catalog snapshot for the semester given in the "sem" GET
+    parameter (e.g. "fall-2017"), or the current semester if it is absent.
+    Raises Http404 if there is no catalog for the semester."""
+    try:
+        return get_semester_snapshot(request.GET.get("sem") or None)
+    except ValueError:
+        raise Http404("No catalog found for the given semester")
+
+def catalog_etag(request, *args, **kwargs):
+    """Returns an ETag for catalog responses, derived from the catalog version
+    most recently loaded by update_db.py, or from the version of the semester
+    given in the "sem" GET parameter. Returns None (so that no ETag is sent)
+    if no loaded version has been recorded."""
+    semester = request.GET.get("sem")
+    if not is_current_semester(semester):
+        try:
+            return "catalog-{}-{}".format(semester, semester_version(semester))
+        except ValueError:
+            return None
+    loaded, generation = current_version()
+    if loaded is None:
+        return None
+    semester, version, _ = loaded
+    return "catalog-{}-{}-{}".format(semester, version, generation)
+
+def catalog_last_modified(request, *args, **kwargs):
+    """Returns the time at which the current catalog was loaded, or None if it
+    is unknown, the catalog has since been modified in this process, or another
+    semester was requested."""
+    if not is_current_semester(request.GET.get("sem")):
+        return None
+    loaded, generation = current_version()
+    if loaded is None or generation != 0:
+        return None
+    return datetime.datetime.fromtimestamp(loaded[2], timezone.utc)
+
+# Keys that may be requested using the "fields" GET parameter
+PROJECTION_FIELDS = {value for key, value in vars(CourseFields).items() if not key.startswith("_")}
+
+def requested_fields(request):
+    """Returns the list of course JSON keys requested in the comma-separated
+    "fields" GET parameter, or None if no fields were requested. Throws a
+    ValueError if any of the fields is not a course JSON key."""
+    if not request.GET.get("fields"):
+        return None
+    fields = [field.strip() for field in request.GET["fields"].split(",") if field.strip()]
+    if not all(field in PROJECTION_FIELDS for field in fields):
+        raise ValueError
+    return fields
+
+def course_fragment(course, full, fields=None):
+    """Returns the serialized JSON for the given course record, containing only
+    the given keys if fields is not None."""
+    if fields is not None:
+        return course.json_projection(fields)
+    return course.json_fragment(full)
+
+def course_list_response(request, courses, full, fields=None):
+    """Returns a response containing a JSON array of the given course records.
+    If the "stream" GET parameter is true, the array is written incrementally
+    using a StreamingHttpResponse instead of being built in memory."""
+    fragments = (course_fragment(c, full, fields) for c in courses)
+    if request.GET.get("stream", "").lower() in TRUE_SET:
+        return StreamingHttpResponse(iter_json_array(fragments), content_type="application/json")
+    return HttpResponse(json_array(fragments), content_type="application/json")
+
+# Maximum number of courses in one page of a paginated response
+PAGE_MAX_LIMIT = 500
+
+def page_parameters(request):
+    """
+    Returns a tuple (limit, cursor) read from the "limit" and "cursor" GET
+    parameters. limit is None if the response should not be paginated, and
+    cursor is the decoded sort key of the last course on the previous page, or
+    None for the first page. Throws a ValueError if either is invalid.
+    """
+    if "limit" not in request.GET:
+        if "cursor" in request.GET:
+            raise ValueError
+        return None, None
+    limit = int(request.GET["limit"])
+    if limit < 1 or limit > PAGE_MAX_LIMIT:
+        raise ValueError
+    if not request.GET.get("cursor"):
+        return limit, None
+    try:
+        return limit, json.loads(base64.urlsafe_b64decode(str(request.GET["cursor"])))
+    except TypeError:
+        raise ValueError
+
+def encode_cursor(key):
+    """Returns an opaque cursor string for the given sort key."""
+    return base64.urlsafe_b64encode(json.dumps(key))
+
+def page_response(request, courses, next_key, total, full, fields=None):
+    """
+    Returns a response containing a JSON dictionary with a "courses" key
+    holding one page of course records, and a "next" key holding the cursor for
+    the following page (or null if this is the last page). next_key is the
+    sort key of the last course on the page if more pages follow. If the
+    boolean GET parameter "total" is true, a "total" key holds the total
+    number of results.
+    """
+    result = '{"courses":' + json_array(course_fragment(c, full, fields) for c in courses)
+    result += ',"next":' + json.dumps(encode_cursor(next_key) if next_key is not None else None)
+    if request.GET.get("total", "").lower() in TRUE_SET:
+        result += ',"total":' + str(total)
+    return HttpResponse(result + "}", content_type="application/json")
+
 def lookup(request, subject_id=None):
     """
     Provides a full JSON description of the course specified by the given subject
-    ID.
+    ID. The "fields" GET parameter may list the JSON keys to include.
     """
     if subject_id is None:
         return HttpResponseBadRequest("Provide a subject ID to look up a course.")
     try:
-        c = Course.public_courses().get(subject_id=subject_id)
-        return HttpResponse(json.dumps(c.to_json_object()), content_type="application/json")
-    except ObjectDoesNotExist:
+        fields = requested_fields(request)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid field")
+    c = requested_snapshot(request).get(subject_id)
+    if c is None:
         return HttpResponseNotFound("No subject found with the given ID")
+    return HttpResponse(course_fragment(c, True, fields), content_type="application/json")
 
+# Maximum number of subject IDs that can be looked up in one batch request
+BATCH_LOOKUP_LIMIT = 500
+
+@csrf_exempt
+def lookup_batch(request):
+    """
+    Looks up several courses at once. The subject IDs are given either as a
+    JSON list in the POST body, or as a comma-separated "ids" GET parameter.
+    Returns a JSON dictionary with a "courses" key mapping each found subject ID
+    to its JSON description, and a "missing" key listing the subject IDs that
+    were not found. As with lookup, full descriptions are returned unless the
+    boolean GET parameter "full" is false, and the "fields" GET parameter may
+    list the JSON keys to include.
+    """
+    if request.method == "POST":
+        try:
+            subject_ids = json.loads(request.body)
+        except:
+            return HttpResponseBadRequest("Invalid JSON")
+        if not isinstance(subject_ids, list) or not all(isinstance(x, basestring) for x in subject_ids):
+            return HttpResponseBadRequest("Provide a list of subject IDs to look up.")
+    else:
+        subject_ids = [x.strip() for x in request.GET.get("ids", "").split(",") if x.strip()]
+    if len(subject_ids) > BATCH_LOOKUP_LIMIT:
+        return HttpResponseBadRequest("Too many subject IDs (maximum {})".format(BATCH_LOOKUP_LIMIT))
+    try:
+        fields = requested_fields(request)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid field")
+    if "full" in request.GET:
+        full = request.GET["full"].lower() in TRUE_SET
+    else:
+        full = True
+
+    snapshot = requested_snapshot(request)
+    found = []
+    missing = []
+    for subject_id in sorted(set(subject_ids)):
+        course = snapshot.get(subject_id)
+        if course is None:
+            missing.append(subject_id)
+        else:
+            found.append(json.dumps(subject_id) + ":" + course_fragment(course, full, fields))
+    result = '{"courses":{' + ",".join(found) + '},"missing":' + json.dumps(missing) + '}'
+    return HttpResponse(result, content_type="application/json")
+
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
 def department(request, dept=None):
     """
     Provides a list of JSON descriptions of the courses whose subject IDs begin
     with the given department code. If a boolean GET parameter for "full" is
     specified, it will indicate whether the full JSON description is included.
+    If a boolean GET parameter for "stream" is true, the list is streamed. The
+    "fields" GET parameter may list the JSON keys to include.
     """
     if dept is None:
         return HttpResponseBadRequest("Provide a department to look up its courses.")
@@ -34,106 +207,427 @@ def department(request, dept=None):
         full = request.GET["full"].lower() in TRUE_SET
     else:
         full = False
-    courses = Course.public_courses().filter(subject_id__startswith=dept + ".").order_by("subject_id")
-    return HttpResponse(json.dumps([c.to_json_object(full=full) for c in courses]), content_type="application/json")
+    try:
+        fields = requested_fields(request)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid field")
+    return course_list_response(request, requested_snapshot(request).department(dept), full, fields)
 
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
 def list_all(request):
     """
     Provides a list of JSON descriptions of all courses in the database. If a
     boolean GET parameter for "full" is specified, it will indicate whether the
-    full JSON description is included.
+    full JSON description is included. If a boolean GET parameter for "stream"
+    is true, the list is streamed. The "fields" GET parameter may list the JSON
+    keys to include.
+
+    If a "limit" GET parameter is given, the response is paginated in order of
+    subject ID (see page_response), and the "cursor" GET parameter should hold
+    the "next" cursor from the previous page.
     """
     if "full" in request.GET:
         full = request.GET["full"].lower() in TRUE_SET
     else:
         full = False
-    return HttpResponse(json.dumps([c.to_json_object(full=full) for c in Course.public_courses().order_by("subject_id")]), content_type="application/json")
+    try:
+        fields = requested_fields(request)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid field")
+    try:
+        limit, cursor = page_parameters(request)
+        if cursor is not None and not isinstance(cursor, basestring):
+            raise ValueError
+    except ValueError:
+        return HttpResponseBadRequest("Invalid page parameters")
+    snapshot = requested_snapshot(request)
+    if limit is not None:
+        courses = snapshot.page(cursor, limit + 1)
+        next_key = courses[limit - 1].subject_id if len(courses) > limit else None
+        return page_response(request, courses[:limit], next_key, len(snapshot), full, fields)
+    if fields is not None or request.GET.get("stream", "").lower() in TRUE_SET:
+        return course_list_response(request, snapshot, full, fields)
+    return HttpResponse(snapshot.json_list(full), content_type="application/json")
+
+def prerequisites(request, subject_id=None):
+    """
+    Provides the compiled prerequisites and corequisites of the given subject,
+    along with a sorted list of the subject IDs of all its direct and indirect
+    prerequisites.
+    """
+    if subject_id is None:
+        return HttpResponseBadRequest("Provide a subject ID to look up its prerequisites.")
+    graph = requested_snapshot(request).prereq_graph()
+    index = graph.index_of.get(subject_id)
+    if index is None:
+        return HttpResponseNotFound("No subject found with the given ID")
+    prereqs = graph.prerequisites[index]
+    coreqs = graph.corequisites[index]
+    result = {
+        "subject_id": subject_id,
+        "prerequisites": prereqs.to_json_object() if prereqs is not None else None,
+        "corequisites": coreqs.to_json_object() if coreqs is not None else None,
+        "all_prerequisites": [c.subject_id for c in graph.all_prerequisites(subject_id)]
+    }
+    return HttpResponse(json.dumps(result), content_type="application/json")
+
+@csrf_exempt
+def unlocked(request):
+    """
+    Provides a list of JSON descriptions of the subjects whose prerequisites are
+    satisfied by a set of completed subjects, given either as a JSON list in the
+    POST body or as a comma-separated "completed" GET parameter. Only subjects
+    whose prerequisites mention one of the completed subjects (or its GIR) are
+    included. Takes the "full" and "fields" GET parameters like list_all.
+    """
+    if request.method == "POST":
+        try:
+            subject_ids = json.loads(request.body)
+        except:
+            return HttpResponseBadRequest("Invalid JSON")
+        if not isinstance(subject_ids, list) or not all(isinstance(x, basestring) for x in subject_ids):
+            return HttpResponseBadRequest("Provide a list of completed subject IDs.")
+    else:
+        subject_ids = [x.strip() for x in request.GET.get("completed", "").split(",") if x.strip()]
+    if "full" in request.GET:
+        full = request.GET["full"].lower() in TRUE_SET
+    else:
+        full = False
+    try:
+        fields = requested_fields(request)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid field")
+    courses = requested_snapshot(request).prereq_graph().unlocked_by(subject_ids)
+    return HttpResponse(json_array(course_fragment(c, full, fields) for c in courses), content_type="application/json")
+
+# Maximum number of subjects whose schedules can be compared in one request
+CONFLICT_SUBJECT_LIMIT = 500
+
+def read_schedule_selections(contents):
+    """Extracts a list of (subject ID, selected sections, allowed sections)
+    tuples from a schedule file JSON object (see the schedule file format).
+    Raises a ValueError if the contents are badly formatted."""
+    if not isinstance(contents, dict) or not isinstance(contents.get("selectedSubjects", []), list):
+        raise ValueError
+    selections = []
+    for subject in contents.get("selectedSubjects", []):
+        if not isinstance(subject, dict):
+            raise ValueError
+        subject_id = subject.get("subject_id", subject.get("id"))
+        selected = subject.get("selectedSections") or {}
+        allowed = subject.get("allowedSections") or {}
+        if not isinstance(subject_id, basestring) or not isinstance(selected, dict) or not isinstance(allowed, dict):
+            raise ValueError
+        if not all(isinstance(index, (int, long)) for index in selected.values()):
+            raise ValueError
+        if not all(isinstance(indexes, list) and all(isinstance(index, (int, long)) for index in indexes)
+                   for indexes in allowed.values()):
+            raise ValueError
+        selections.append((subject_id, selected, allowed))
+    return selections
+
+def stored_schedule_auth(view):
+    """Decorator for views that accept the ID of one of the user's stored
+    schedules in the "schedule" GET parameter. Such requests must be logged in
+    or carry a token with permission to view schedules, as for the sync
+    endpoints; other requests need no authorization."""
+    authorized_view = logged_in_or_basicauth(require_token_permissions("can_view_schedules")(view))
+    def wrapper(request, *args, **kwargs):
+        if request.method != "POST" and "schedule" in request.GET:
+            return authorized_view(request, *args, **kwargs)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+def requested_schedule_selections(request):
+    """Returns the (subject ID, selected sections, allowed sections) tuples for
+    the schedule given in a request: a schedule file in the POST body (with or
+    without compressed keys), the ID of one of the logged-in user's schedules
+    in the "schedule" GET parameter, or a comma-separated "subjects" GET
+    parameter. Raises a ValueError if the schedule is badly formatted, an
+    ObjectDoesNotExist if the stored schedule doesn't exist, and
+    PermissionDenied if the user is not logged in."""
+    if request.method == "POST":
+        return read_schedule_selections(json.loads(Schedule.expand(request.body)))
+    elif "schedule" in request.GET:
+        if not request.user.is_authenticated():
+            raise PermissionDenied
+        schedule = Schedule.objects.get(user=request.user, pk=int(request.GET["schedule"]))
+        return read_schedule_selections(json.loads(Schedule.expand(schedule.contents)))
+    return [(x.strip(), None, None) for x in request.GET.get("subjects", "").split(",") if x.strip()]
+
+def selected_schedules(snapshot, selections, term, use_selected=True):
+    """Returns a tuple (subject IDs, CourseSchedules, unscheduled subject IDs)
+    for the given (subject ID, selected sections, allowed sections) tuples in
+    the given term. Each schedule is restricted to its selected or allowed
+    sections, or only to its allowed sections if use_selected is False. Raises
+    a ValueError if the term is invalid."""
+    term_schedules = snapshot.term_schedules(term)
+    subject_ids = []
+    schedules = []
+    unscheduled = []
+    for subject_id, selected, allowed in selections:
+        if subject_id in subject_ids or subject_id in unscheduled:
+            continue
+        index = snapshot.position(subject_id)
+        if index is None or term_schedules[index] is None:
+            unscheduled.append(subject_id)
+            continue
+        subject_ids.append(subject_id)
+        schedules.append(term_schedules[index].restricted(selected if use_selected else None, allowed))
+    return subject_ids, schedules, unscheduled
+
+@csrf_exempt
+@stored_schedule_auth
+def conflicts(request):
+    """
+    Finds the pairs of subjects whose sections meet at the same time. The
+    subjects may be given as a schedule file in the POST body, in which case
+    only their selected or allowed sections are considered; as the ID of one of
+    the logged-in user's stored schedules in the "schedule" GET parameter; or as
+    a comma-separated "subjects" GET parameter. The "term" GET parameter
+    ("fall", "IAP" or "spring") selects which schedules to use.
+
+    Returns a JSON dictionary with a "conflicts" key listing each conflicting
+    pair of subjects, and an "unscheduled" key listing the subject IDs that have
+    no schedule in the catalog.
+    """
+    try:
+        selections = requested_schedule_selections(request)
+    except ObjectDoesNotExist:
+        return HttpResponseNotFound("The schedule does not exist on the server.")
+    except ValueError:
+        return HttpResponseBadRequest("Badly formatted schedule")
+    if len(selections) > CONFLICT_SUBJECT_LIMIT:
+        return HttpResponseBadRequest("Too many subjects (maximum {})".format(CONFLICT_SUBJECT_LIMIT))
+    snapshot = requested_snapshot(request)
+    try:
+        subject_ids, schedules, unscheduled = selected_schedules(snapshot, selections, request.GET.get("term"))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid term")
+
+    result = []
+    for i, j, unavoidable, pairs in find_conflicts(schedules):
+        result.append({
+            "subjects": [subject_ids[i], subject_ids[j]],
+            "unavoidable": unavoidable,
+            "sections": [[section.to_json_object(), other.to_json_object()] for section, other in pairs]
+        })
+    return HttpResponse(json.dumps({"conflicts": result, "unscheduled": unscheduled}),
+                        content_type="application/json")
+
+# Default and maximum number of generated schedules returned
+GENERATED_SCHEDULE_LIMIT = 50
+GENERATED_SCHEDULE_MAX_LIMIT = 500
+# Maximum number of subjects in a generated schedule
+GENERATED_SCHEDULE_SUBJECT_LIMIT = 12
+# Number of combinations ranked, and seconds spent searching for them
+SCHEDULE_SEARCH_LIMIT = 5000
+SCHEDULE_SEARCH_TIME_LIMIT = 2.0
+
+@csrf_exempt
+@stored_schedule_auth
+def generate_schedules(request):
+    """
+    Finds combinations of sections of a set of subjects that do not meet at the
+    same time. The subjects are given as in the conflicts endpoint; when a
+    schedule file is provided, only the allowed sections of each subject are
+    used (all of them for section types with no allowed sections), regardless
+    of which sections are selected. Takes the following GET parameters:
+
+    term: The term whose schedules are used, as in conflicts.
+    prefer: Comma-separated list of preferences used to rank the results, from
+        "no_early" (few meetings before 10 AM), "no_evening" (few meetings from
+        5 PM) and "compact" (few free slots between meetings on each day).
+    limit: The maximum number of results (default 50, at most 500).
+
+    At most 5,000 combinations are considered, within two seconds. Returns a
+    JSON dictionary whose "schedules" key lists the results, best first. Each
+    result has a "selectedSections" dictionary mapping each subject ID to a
+    dictionary of section types and option indexes, in the format of the
+    schedule file, and a "penalty" (lower is better). The "complete" key
+    indicates whether every combination was considered, and "unscheduled"
+    lists the subject IDs that have no schedule. The response is streamed.
+    """
+    try:
+        selections = requested_schedule_selections(request)
+    except ObjectDoesNotExist:
+        return HttpResponseNotFound("The schedule does not exist on the server.")
+    except ValueError:
+        return HttpResponseBadRequest("Badly formatted schedule")
+    if len(selections) > GENERATED_SCHEDULE_SUBJECT_LIMIT:
+        return HttpResponseBadRequest("Too many subjects (maximum {})".format(GENERATED_SCHEDULE_SUBJECT_LIMIT))
+    preferences = [x.strip() for x in request.GET.get("prefer", "").split(",") if x.strip()]
+    if any(preference not in SCHEDULE_PREFERENCES for preference in preferences):
+        return HttpResponseBadRequest("Invalid preference")
+    try:
+        limit = int(request.GET.get("limit", GENERATED_SCHEDULE_LIMIT))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid limit")
+    limit = max(0, min(limit, GENERATED_SCHEDULE_MAX_LIMIT))
+    snapshot = requested_snapshot(request)
+    try:
+        subject_ids, schedules, unscheduled = selected_schedules(snapshot, selections, request.GET.get("term"),
+                                                                 use_selected=False)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid term")
+
+    results, complete = ranked_schedules(schedules, preferences, limit,
+                                         SCHEDULE_SEARCH_LIMIT, SCHEDULE_SEARCH_TIME_LIMIT)
+    def fragments():
+        for penalty, combination in results:
+            selected = {subject_id: {section.section_type: section.index for section in sections}
+                        for subject_id, sections in zip(subject_ids, combination)}
+            yield json.dumps({"selectedSections": selected, "penalty": penalty})
+    def chunks():
+        yield '{"complete":' + json.dumps(complete) + ',"unscheduled":' + json.dumps(unscheduled)
+        yield ',"schedules":'
+        for chunk in iter_json_array(fragments()):
+            yield chunk
+        yield '}'
+    return StreamingHttpResponse(chunks(), content_type="application/json")
+
+# Default and maximum number of autocomplete results
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+def autocomplete(request, search_term=None):
+    """
+    Provides a list of abbreviated JSON descriptions of courses whose subject
+    ID, old subject ID, or a word in whose title begins with the given term,
+    tolerating small typos. The "limit" GET parameter sets the maximum number of
+    results (default 10, at most 50).
+    """
+    if search_term is None:
+        return HttpResponseBadRequest("Must provide a search term.")
+    try:
+        limit = int(request.GET.get("limit", AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid limit")
+    limit = max(0, min(limit, AUTOCOMPLETE_MAX_LIMIT))
+    results = requested_snapshot(request).completion_index().complete(search_term, limit)
+    return HttpResponse(json_array(c.json_fragment(full=False) for c in results), content_type="application/json")
 
 def offered_filter(offered_value):
-    """Constructs a Q filter based on the given offered value, or throws a
-    ValueError if the value is inappropriate."""
+    """Constructs a filter function based on the given offered value, or throws
+    a ValueError if the value is inappropriate. Filter functions take a
+    CatalogTable and return a boolean mask of the matching courses."""
     offered_value = offered_value.lower()
     if offered_value == "off":
         return None
     elif offered_value == "fall":
-        return Q(offered_fall=True)
+        return lambda t: t.offered_fall
     elif offered_value == "spring":
-        return Q(offered_spring=True)
+        return lambda t: t.offered_spring
     elif offered_value == "iap":
-        return Q(offered_IAP=True)
+        return lambda t: t.offered_IAP
     elif offered_value == "summer":
-        return Q(offered_summer=True)
+        return lambda t: t.offered_summer
     else:
         raise ValueError
 
 def level_filter(level_value):
-    """Constructs a Q filter based on the given level value, or throws a
+    """Constructs a filter function based on the given level value, or throws a
     ValueError if the value is inappropriate."""
     level_value = level_value.lower()
     if level_value == "off":
         return None
     elif level_value == "undergrad":
-        return Q(level="U")
+        return lambda t: t.level == "U"
     elif level_value == "grad":
-        return Q(level="G")
+        return lambda t: t.level == "G"
     else:
         raise ValueError
 
 def ci_filter(ci_value):
-    """Constructs a Q filter based on the given CI value, or throws a
+    """Constructs a filter function based on the given CI value, or throws a
     ValueError if the value is inappropriate."""
     ci_value = ci_value.lower()
     if ci_value == "off":
         return None
     elif ci_value == "cih":
-        return Q(communication_requirement="CI-H")
+        return lambda t: t.communication_requirement == "CI-H"
     elif ci_value == "cihw":
-        return Q(communication_requirement="CI-HW")
+        return lambda t: t.communication_requirement == "CI-HW"
     elif ci_value == "not-ci":
-        return Q(communication_requirement__isnull=True) | Q(communication_requirement="")
+        return lambda t: t.communication_requirement == ""
     else:
         raise ValueError
 
 def hass_filter(hass_value):
-    """Constructs a Q filter based on the given HASS value, or throws a
+    """Constructs a filter function based on the given HASS value, or throws a
     ValueError if the value is inappropriate."""
     hass_value = hass_value.lower()
     if hass_value == "off":
         return None
     elif hass_value == "any":
-        return ~Q(hass_attribute="")
-    elif hass_value in {"a", "s", "h"}:
-        return Q(hass_attribute__icontains="HASS-" + hass_value.upper())
+        return lambda t: t.hass_any
+    elif hass_value == "a":
+        return lambda t: t.hass_a
+    elif hass_value == "s":
+        return lambda t: t.hass_s
+    elif hass_value == "h":
+        return lambda t: t.hass_h
     else:
         raise ValueError
 
 def gir_filter(gir_value):
-    """Constructs a Q filter based on the given GIR value, or throws a
+    """Constructs a filter function based on the given GIR value, or throws a
     ValueError if the value is inappropriate."""
     gir_value = gir_value.lower()
     if gir_value == "off":
         return None
     elif gir_value == "any":
-        return ~Q(gir_attribute="")
+        return lambda t: t.gir_attribute != ""
     elif gir_value in {"lab", "rest"}:
-        return Q(gir_attribute=gir_value.upper())
+        attribute = gir_value.upper()
+        return lambda t: t.gir_attribute == attribute
     else:
         raise ValueError
 
-def construct_search_query(search_term, type):
-    """Constructs a Q filter based on the given search term, using the given
-    search type (contains, matches, etc.)."""
-    if type == "contains":
-        return Q(subject_id__icontains=search_term) | Q(title__icontains=search_term)
-    elif type == "matches":
-        return Q(subject_id__iexact=search_term) | Q(title__iexact=search_term)
-    elif type == "starts":
-        return Q(subject_id__istartswith=search_term) | Q(title__istartswith=search_term)
-    elif type == "ends":
-        return Q(subject_id__iendswith=search_term) | Q(title__iendswith=search_term)
+def units_filter(units_value):
+    """Constructs a filter function for a number of units ("12") or an inclusive
+    range of units ("6-12"), or throws a ValueError if the value is
+    inappropriate."""
+    if units_value.lower() == "off":
+        return None
+    comps = units_value.split("-")
+    if len(comps) == 1:
+        low = high = int(comps[0])
+    elif len(comps) == 2:
+        low, high = int(comps[0]), int(comps[1])
     else:
         raise ValueError
+    return lambda t: (t.total_units >= low) & (t.total_units <= high)
 
+def rating_filter(rating_value):
+    """Constructs a filter function for a minimum rating, or throws a ValueError
+    if the value is inappropriate."""
+    if rating_value.lower() == "off":
+        return None
+    minimum = float(rating_value)
+    return lambda t: t.rating >= minimum
+
+def hours_filter(hours_value):
+    """Constructs a filter function for a maximum number of weekly hours (in
+    class and out of class), or throws a ValueError if the value is
+    inappropriate. Courses without reported hours are excluded."""
+    if hours_value.lower() == "off":
+        return None
+    maximum = float(hours_value)
+    return lambda t: (t.hours > 0.0) & (t.hours <= maximum)
+
+def no_conflict_filter(snapshot, subject_ids_value, term):
+    """Constructs a filter function that excludes the courses with unavoidable
+    schedule conflicts with any of the given comma-separated subjects in the
+    given term, or throws a ValueError if the term is invalid. Courses without
+    schedules are never excluded."""
+    if subject_ids_value.lower() == "off":
+        return None
+    schedules = snapshot.term_schedules(term)
+    positions = (snapshot.position(x.strip()) for x in subject_ids_value.split(","))
+    busy = [schedules[i] for i in positions if i is not None and schedules[i] is not None]
+    excluded = conflicting_indexes(schedules, busy)
+    return lambda t: ~t.index_mask(excluded)
 
 def search(request, search_term=None):
     """
@@ -152,39 +646,78 @@ def search(request, search_term=None):
         (default), "fall", "spring", "IAP", "summer"
     level: The level of the course. Possible values: "off" (default), "undergrad",
         "grad"
+    units: The number of units, or an inclusive range of units, e.g. "12" or
+        "6-12". Default: "off"
+    rating: The minimum subject evaluation rating, e.g. "5.5". Default: "off"
+    hours: The maximum total weekly hours reported in subject evaluations,
+        e.g. "10". Courses without reported hours are excluded. Default: "off"
     full: Boolean indicating whether to return the full course description.
         Possible values: "n" (default), "y"
+    fields: Comma-separated list of the course JSON keys to return, e.g.
+        "subject_id,title,total_units". Overrides full.
+    limit, cursor, total: Paginate the results, as described in list_all.
+    no_conflict_with: Comma-separated list of subject IDs. Courses whose
+        schedules unavoidably conflict with any of them are excluded.
+        Default: "off"
+    term: The term whose schedules are used by no_conflict_with. Possible
+        values: "fall", "IAP", "spring". Default: the current schedules
 
-    TODO: search fields, schedule conflicts
+    The subject ID and title are matched using the match type. For "contains"
+    searches, courses whose title, instructors or description contain every
+    word in the search term also match. Results are sorted by relevance.
     """
     if search_term is None:
         return HttpResponseBadRequest("Must provide a search term.")
 
+    match_type = request.GET.get("type", "contains").lower()
+    filter_functions = [
+        ("offered", offered_filter),
+        ("level", level_filter),
+        ("gir", gir_filter),
+        ("hass", hass_filter),
+        ("ci", ci_filter),
+        ("units", units_filter),
+        ("rating", rating_filter),
+        ("hours", hours_filter)
+    ]
+    snapshot = requested_snapshot(request)
+    filters = []
     try:
-        # Construct query
-        query = construct_search_query(search_term, request.GET.get("type", "contains"))
-        if "offered" in request.GET:
-            filter = offered_filter(request.GET["offered"])
-            if filter is not None: query &= filter
-        if "level" in request.GET:
-            filter = level_filter(request.GET["level"])
-            if filter is not None: query &= filter
-        if "gir" in request.GET:
-            filter = gir_filter(request.GET["gir"])
-            if filter is not None: query &= filter
-        if "hass" in request.GET:
-            filter = hass_filter(request.GET["hass"])
-            if filter is not None: query &= filter
-        if "ci" in request.GET:
-            filter = ci_filter(request.GET["ci"])
-            if filter is not None: query &= filter
+        id_title_matcher(search_term.lower(), match_type)
+        for key, filter_function in filter_functions:
+            if key in request.GET:
+                filters.append(filter_function(request.GET[key]))
+        if "no_conflict_with" in request.GET:
+            filters.append(no_conflict_filter(snapshot, request.GET["no_conflict_with"], request.GET.get("term")))
+        fields = requested_fields(request)
     except ValueError:
         return HttpResponseBadRequest("Invalid filter value")
+    filters = [f for f in filters if f is not None]
+    try:
+        limit, cursor = page_parameters(request)
+        if cursor is not None:
+            if (not isinstance(cursor, list) or len(cursor) != 2 or
+                    isinstance(cursor[0], bool) or not isinstance(cursor[0], (int, long, float)) or
+                    not isinstance(cursor[1], basestring)):
+                raise ValueError
+            cursor = (float(cursor[0]), unicode(cursor[1]))
+    except (ValueError, TypeError, KeyError, IndexError):
+        return HttpResponseBadRequest("Invalid page parameters")
 
-    # Search by query
-    results = Course.public_courses().filter(query)
+    # Search the catalog snapshot, restricted to the courses passing the filters
+    candidates = snapshot.table().indexes(filters) if filters else None
+    results = snapshot.search_index().scored_search(search_term, match_type, candidates)
     if "full" in request.GET:
         full = request.GET["full"].lower() in TRUE_SET
     else:
         full = False
-    return HttpResponse(json.dumps([c.to_json_object(full=full) for c in results]), content_type="application/json")
+
+    if limit is not None:
+        # Results are sorted by descending score, then subject ID
+        keys = [(-score, c.subject_id) for score, c in results]
+        start = bisect_right(keys, cursor) if cursor is not None else 0
+        page = [c for score, c in results[start:start + limit]]
+        next_key = list(keys[start + limit - 1]) if start + limit < len(results) else None
+        return page_response(request, page, next_key, len(results), full, fields)
+    results = [c for score, c in results]
+    return HttpResponse(json_array(course_fragment(c, full, fields) for c in results), content_type="application/json")
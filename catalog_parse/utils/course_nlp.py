@@ -7,6 +7,7 @@ from nltk.stem import WordNetLemmatizer
 import random
 from collections import deque
 from .catalog_constants import *
+from .equivalence import EquivalenceResolver
 
 equiv_subject_keys = [
     CourseAttribute.equivalentSubjects,
@@ -114,11 +115,6 @@ def doc_distance(tf1, tf2):
         ret += tf1[word] * tf2[word] * math.log(len(word))
     return ret
 
-def is_equivalent(id, course, other_id):
-    """Returns True if the given other ID is equal or in the equivalent subjects
-    for the given course."""
-    return other_id == id or other_id in course.get(CourseAttribute.equivalentSubjects, []) or other_id in course.get(CourseAttribute.jointSubjects, []) or other_id in course.get(CourseAttribute.meetsWithSubjects, [])
-
 def write_course_features(courses_by_dept, tf_lists, related_matrix, outpath, max_keywords=5, min_keywords=1):
     # Use the below code to input min count and threshold at runtime
     '''comps = input("Choose min_count,threshold:").split(",")
@@ -254,6 +250,10 @@ def write_related_and_features(courses_by_dept, dest, progress_callback=None, pr
         progress_callback(start + 0.2 * (100.0 - start), "Writing related courses...")
     print("Writing related courses...")
 
+    # Group each subject with its equivalent, joint and meets-with subjects
+    all_courses = {id: course for courses in courses_by_dept.values() for id, course in courses.items()}
+    equivalence = EquivalenceResolver.from_courses(all_courses, equiv_subject_keys)
+
     # First determine which departments are closely related to each other
     dept_lists = {}
     for dept, courses in courses_by_dept.items():
@@ -290,7 +290,7 @@ def write_related_and_features(courses_by_dept, dest, progress_callback=None, pr
                 related_matrix[id] = {}
                 ranks = [("", 0) for i in range(k)]
                 for other_id, tf in tf_lists.items():
-                    if is_equivalent(id, course, other_id):
+                    if equivalence.equivalent(id, other_id):
                         related_matrix[id][other_id] = related_max
                         continue
                     if other_id in related_matrix:
@@ -306,8 +306,7 @@ def write_related_and_features(courses_by_dept, dest, progress_callback=None, pr
                         if dist >= ranks[i][1]:
                             comp_dept = ranks[i][0][:ranks[i][0].find(".")]
                             if comp_dept in courses_by_dept:
-                                comp_course = courses_by_dept[comp_dept][ranks[i][0]]
-                                if (other_id == ranks[i][0] or is_equivalent(ranks[i][0], comp_course, other_id)) and comp_dept != dept: break
+                                if equivalence.equivalent(ranks[i][0], other_id) and comp_dept != dept: break
                             ranks.insert(i, (other_id, dist))
                             del ranks[-1]
                             break
@@ -0,0 +1,102 @@
+"""
+Groups subjects into equivalence classes, such as a subject together with its
+joint and equivalent subjects. The classes are computed with a union-find
+structure, so equivalence is transitive: if A lists B as equivalent and B lists
+C, then A, B and C form one class.
+"""
+
+class EquivalenceResolver(object):
+    """
+    Maps subject IDs to equivalence classes. Each class is identified by its
+    canonical ID, the smallest subject ID in the class. Subject IDs that were
+    never added form classes of their own.
+    """
+
+    def __init__(self, pairs=None):
+        self._parents = {}
+        self._canonical = None
+        self._members = None
+        for subject_id, other_id in (pairs or []):
+            self.union(subject_id, other_id)
+
+    @classmethod
+    def from_courses(cls, courses, keys):
+        """Builds a resolver from a dictionary of subject IDs to course
+        dictionaries, in which each of the given keys maps to a list or a
+        comma-separated string of related subject IDs."""
+        resolver = cls()
+        for subject_id, course in courses.items():
+            resolver.add(subject_id)
+            for key in keys:
+                others = course.get(key) or []
+                if not isinstance(others, list):
+                    others = others.split(",")
+                for other_id in others:
+                    if other_id:
+                        resolver.union(subject_id, other_id)
+        return resolver
+
+    def _find(self, subject_id):
+        root = subject_id
+        while self._parents[root] != root:
+            root = self._parents[root]
+        # Path compression
+        while self._parents[subject_id] != root:
+            self._parents[subject_id], subject_id = root, self._parents[subject_id]
+        return root
+
+    def add(self, subject_id):
+        """Adds the given subject ID as a class of its own, if not present."""
+        if subject_id not in self._parents:
+            self._parents[subject_id] = subject_id
+            self._canonical = None
+
+    def union(self, subject_id, other_id):
+        """Records that the two given subject IDs are equivalent."""
+        self.add(subject_id)
+        self.add(other_id)
+        root, other_root = self._find(subject_id), self._find(other_id)
+        if root != other_root:
+            self._parents[other_root] = root
+            self._canonical = None
+
+    def _build_classes(self):
+        """Computes the canonical ID and member set of every class, so that
+        lookups are single dictionary accesses until the next union. The maps
+        are built locally and published only once complete, so that readers in
+        other threads never see a partially-built map. Returns the canonical
+        map."""
+        classes = {}
+        for subject_id in self._parents:
+            classes.setdefault(self._find(subject_id), []).append(subject_id)
+        canonical = {}
+        members = {}
+        for class_members in classes.values():
+            class_id = min(class_members)
+            members[class_id] = frozenset(class_members)
+            for subject_id in class_members:
+                canonical[subject_id] = class_id
+        # _members must be set first, since readers check _canonical
+        self._members = members
+        self._canonical = canonical
+        return canonical
+
+    def class_id(self, subject_id):
+        """Returns the canonical ID of the class containing the given subject."""
+        canonical = self._canonical
+        if canonical is None:
+            canonical = self._build_classes()
+        return canonical.get(subject_id, subject_id)
+
+    def members(self, subject_id):
+        """Returns a frozenset of the subject IDs equivalent to the given
+        subject, including itself."""
+        class_id = self.class_id(subject_id)
+        return self._members.get(class_id, frozenset([subject_id]))
+
+    def equivalent(self, subject_id, other_id):
+        """Returns whether the two given subject IDs are in the same class."""
+        return subject_id == other_id or self.class_id(subject_id) == self.class_id(other_id)
+
+    def __contains__(self, subject_id):
+        return subject_id in self._parents
@@ -96,6 +96,50 @@ def compute_semester_delta(semester_comps, version_num, req_version_num=-1):
         resp['r_delta'] = urls_to_update
     return resp
 
+loaded_catalog_file = "loaded-catalog.txt"
+loaded_requirements_file = "loaded-requirements.txt"
+_loaded_version_cache = {}
+
+def write_loaded_version(filename, semester, version):
+    """Records that the database now contains the given semester (e.g.
+    "fall-2017", or empty for requirements) and delta version. The file is
+    written in the same format as a delta file, so that running server
+    processes can pick up the new version by watching a single file."""
+    path = os.path.join(settings.CATALOG_BASE_DIR, filename)
+    with open(path, 'w') as file:
+        file.write(separator.join(semester.split('-')) + "\n")
+        file.write(str(version) + "\n")
+
+def read_loaded_version(filename):
+    """Returns a tuple (semester, version, timestamp) describing the data most
+    recently loaded into the database by update_db.py, or None if nothing has
+    been marked as loaded. The file is only re-read when its modification time
+    changes."""
+    path = os.path.join(settings.CATALOG_BASE_DIR, filename)
+    try:
+        timestamp = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _loaded_version_cache.get(path)
+    if cached is not None and cached[2] == timestamp:
+        return cached
+    semester_comps, version, _ = read_delta(path)
+    result = ('-'.join(comp.strip() for comp in semester_comps), version, timestamp)
+    _loaded_version_cache[path] = result
+    return result
+
+def mark_catalog_loaded(semester, version):
+    write_loaded_version(loaded_catalog_file, semester, version)
+
+def loaded_catalog_version():
+    return read_loaded_version(loaded_catalog_file)
+
+def mark_requirements_loaded(version):
+    write_loaded_version(loaded_requirements_file, "", version)
+
+def loaded_requirements_version():
+    return read_loaded_version(loaded_requirements_file)
+
 def list_semesters():
     sems = []
     for path in os.listdir(os.path.join(settings.CATALOG_BASE_DIR, deltas_directory)):
@@ -19,6 +19,7 @@ from sync.models import Road
 from django.contrib.auth.models import User
 from django.db import DatabaseError, transaction
 from django import db
+from catalog_parse.utils.equivalence import EquivalenceResolver
 
 max_rating = 5
 
@@ -309,21 +310,30 @@ class RankList(object):
         """Returns the objects in tuples with their corresponding numerical values."""
         return [x for x in self.list if x[0] is not None]
 
-def subject_in_list(subject, subject_list, course_data=None):
+def build_equivalence(course_data=None):
+    """Returns an EquivalenceResolver grouping each subject with its equivalent,
+    joint and meets-with subjects in the given course data (as returned by
+    read_condensed_courses), and each special GIR ID with its subject."""
+    if course_data is not None:
+        equivalence = EquivalenceResolver.from_courses(course_data, equiv_subject_keys)
+    else:
+        equivalence = EquivalenceResolver()
+    for special_id, subject_id in special_equiv_subjects.items():
+        equivalence.union(special_id, subject_id)
+    return equivalence
+
+# Used when no course data is available
+default_equivalence = build_equivalence()
+
+def subject_in_list(subject, subject_list, equivalence=None):
     """Determines whether the given subject (or one of its equivalent subjects)
-    is already present in the given subject list."""
-    if subject in special_equiv_subjects:
-        subject = special_equiv_subjects[subject]
+    is already present in the given subject list, and if so returns the
+    matching element of the list."""
+    if equivalence is None:
+        equivalence = default_equivalence
     for other_subject in subject_list:
-        if other_subject in special_equiv_subjects:
-            other_subject = special_equiv_subjects[other_subject]
-        if other_subject == subject:
+        if equivalence.equivalent(subject, other_subject):
             return other_subject
-        if course_data is None or other_subject not in course_data: continue
-        for key in equiv_subject_keys:
-            if key not in course_data[other_subject]: continue
-            if subject in course_data[other_subject][key]:
-                return other_subject
     return None
 
 def user_similarities(profiles):
@@ -357,11 +367,11 @@ def subject_distances(subjects):
     sim = cosine_similarity(subjects)
     return (1.0 - ((sim + 1.0) / 2.0)) ** 2
 
-def update_by_equivalent_subjects(subject, rank_list, profile, course_data):
+def update_by_equivalent_subjects(subject, rank_list, profile, equivalence):
     """Checks for equivalent subjects in the given rank list, and replaces it if
     this subject is more closely related to the given profile than the existing
     one. Returns True if the subject was existing, and False if not."""
-    existing = subject_in_list(subject, rank_list.objects(), course_data)
+    existing = subject_in_list(subject, rank_list.objects(), equivalence)
     if not existing:
         return False
     if subject[:subject.find('.')] in profile.departments:
@@ -379,7 +389,7 @@ REC_MIN_COUNT = 5 # Minimum number of recommendations required to save
 BASIC_RATING_REC_COUNT = 15
 RANDOM_PERTURBATION = 0.05   # Multiply by a random value from (1-x) to (1+x)
 
-def basic_rating_predictor(profiles, subject_ids, subject_id_dict, course_data=None):
+def basic_rating_predictor(profiles, subject_ids, subject_id_dict, equivalence=None):
     """
     Takes a list of user profile objects and a list of subject IDs (same order
     as used to build the regression predictions), computes the similarities
@@ -408,8 +418,8 @@ def basic_rating_predictor(profiles, subject_ids, subject_id_dict, course_data=N
         social_ratings = np.dot(similarities[i], all_user_ratings)
         top_ratings = RankList(BASIC_RATING_REC_COUNT)
         for subject, rating in zip(subject_ids, social_ratings):
-            if subject_in_list(subject, profile.subjects_taken(), course_data): continue
-            if update_by_equivalent_subjects(subject, top_ratings, profile, course_data): continue
+            if subject_in_list(subject, profile.subjects_taken(), equivalence): continue
+            if update_by_equivalent_subjects(subject, top_ratings, profile, equivalence): continue
 
             # Now weight rating by frequency in current semester
             if subject in course_distributions and profile.semester in course_distributions[subject]:
@@ -431,7 +441,7 @@ BY_MAJOR_REC_COUNT = 10 # Number of recommendations to generate
 BY_MAJOR_FREQ_CUTOFF = 10 # Number of occurrences of subject required to consider part of major/minor
 SEMESTER_DISTANCE_COEFFICIENT = 0.05
 
-def by_major_predictor(profiles, subject_ids, subject_id_dict, course_data=None):
+def by_major_predictor(profiles, subject_ids, subject_id_dict, equivalence=None):
     """Generates recommendations for people with the same major."""
 
     # Build a list of majors/minors
@@ -466,9 +476,9 @@ def by_major_predictor(profiles, subject_ids, subject_id_dict, course_data=None)
             for subj in course_distributions:
                 if sum(course_distributions[subj].values()) < BY_MAJOR_FREQ_CUTOFF:
                     continue
-                if (subj in prof.ratings and prof.ratings[subj] < 1.0) or subject_in_list(subj, prof.subjects_taken(), course_data):
+                if (subj in prof.ratings and prof.ratings[subj] < 1.0) or subject_in_list(subj, prof.subjects_taken(), equivalence):
                     continue
-                if update_by_equivalent_subjects(subj, recs, prof, course_data):
+                if update_by_equivalent_subjects(subj, recs, prof, equivalence):
                     continue
                 relevance = sum((1.0 - abs(sem - prof.semester) * SEMESTER_DISTANCE_COEFFICIENT) * freq for sem, freq in course_distributions[subj].items()) * avg_ratings.get(subj, -99999)
                 recs.add(subj, relevance)
@@ -481,14 +491,14 @@ def by_major_predictor(profiles, subject_ids, subject_id_dict, course_data=None)
 RELATED_SUBJECTS_FREQ_CUTOFF = 0.3 # Required proportion of applicable users that must have this subject
 NUM_RELATED_SUBJECTS_RECS = 1 # Number of related subjects recommendations to save per user
 
-def related_subjects_predictor(profiles, subject_ids, subject_id_dict, course_data=None):
+def related_subjects_predictor(profiles, subject_ids, subject_id_dict, equivalence=None):
     """Generates recommendations for users who have taken a given course."""
 
     covered_subjects = set()
 
     best_recommendation_per_user = {prof.username: RankList(NUM_RELATED_SUBJECTS_RECS) for prof in profiles}
     for subject_id in subject_ids:
-        if subject_in_list(subject_id, excluded_subjects, course_data): continue
+        if subject_in_list(subject_id, excluded_subjects, equivalence): continue
 
         # See which users have taken this course
         applicable_users = [p for p in profiles if subject_id in p.roads[0]]
@@ -522,9 +532,9 @@ def related_subjects_predictor(profiles, subject_ids, subject_id_dict, course_da
             for subj in course_totals:
                 if course_totals[subj] < RELATED_SUBJECTS_FREQ_CUTOFF:
                     continue
-                if (subj in prof.ratings and prof.ratings[subj] < 1.0) or subject_in_list(subj, prof.subjects_taken(), course_data):
+                if (subj in prof.ratings and prof.ratings[subj] < 1.0) or subject_in_list(subj, prof.subjects_taken(), equivalence):
                     continue
-                if update_by_equivalent_subjects(subj, recs, prof, course_data):
+                if update_by_equivalent_subjects(subj, recs, prof, equivalence):
                     continue
                 relevance = sum((1.0 - abs(sem - prof.semester) * SEMESTER_DISTANCE_COEFFICIENT) * freq for sem, freq in course_distributions[subj].items()) * avg_ratings.get(subj, -99999)
                 recs.add(subj, relevance)
@@ -573,6 +583,7 @@ if __name__ == '__main__':
             course_data = read_condensed_courses(condensed_path)
         else:
             course_data = None
+        equivalence = build_equivalence(course_data)
 
         verbose = '-v' in sys.argv
         dev_mode = '--dev' in sys.argv
@@ -619,7 +630,7 @@ if __name__ == '__main__':
 
         # Run various recommenders
         for recommender in RECOMMENDERS:
-            for rec in recommender(profiles, subject_ids, subject_id_dict, course_data):
+            for rec in recommender(profiles, subject_ids, subject_id_dict, equivalence):
                 if rec is None: continue
                 if verbose: print(rec)
                 if not dev_mode:
@@ -165,7 +165,7 @@ def preview(request):
     req_list = RequirementsList.objects.create()
     try:
         req_list.parse(req_contents, full=True)
-        html = build_presentation_items(req_list)
+        html = build_presentation_items(req_list.load_tree())
         req_list.delete()
     except:
         req_list.delete()
@@ -176,11 +176,12 @@ def show_in_row(requirement):
     """Returns whether the given requirement should be displayed in a single row."""
     if requirement.minimum_nest_depth() < 1:
         return True
-    if not requirement.requirements.exists():
+    children = requirement.child_statements()
+    if len(children) == 0:
         return True
-    if not any(r.requirement is not None for r in requirement.requirements.all()):
+    if not any(r.requirement is not None for r in children):
         return False
-    if any(r.title is not None and len(r.title) > 0 for r in requirement.requirements.all()):
+    if any(r.title is not None and len(r.title) > 0 for r in children):
         return False
     return True
 
@@ -188,9 +189,8 @@ def make_row(requirement):
     """Returns HTML for displaying the given requirement in a row."""
     html = u"<div class=\"course-list\"><div class=\"course-list-inner\">"
 
-    if requirement.requirements.exists():
-        reqs = requirement.requirements.all()
-    else:
+    reqs = requirement.child_statements()
+    if len(reqs) == 0:
         reqs = [requirement]
 
     for req in reqs:
@@ -241,17 +241,17 @@ def presentation_items(requirement, level, always_show_title=False):
     if show_in_row(requirement):
         # Show all the child requirements in a single row
         items.append(make_row(requirement))
-    elif requirement.requirements.exists():
+    elif len(requirement.child_statements()) > 0:
         # Show each child requirement as a separate row
-        show_titles = any(r.connection_type == CONNECTION_TYPE_ALL and r.requirements.exists() and r.requirements.count() > 0 for r in requirement.requirements.all())
-        for req in requirement.requirements.all():
+        show_titles = any(r.connection_type == CONNECTION_TYPE_ALL and len(r.child_statements()) > 0 for r in requirement.child_statements())
+        for req in requirement.child_statements():
             items += presentation_items(req, level + 1, show_titles)
 
     return items
 
 def build_presentation_items(list):
     """Builds HTML for the given requirements list."""
-    if not list.requirements.exists():
+    if len(list.child_statements()) == 0:
         return ""
 
     ret = []
@@ -264,7 +264,7 @@ def build_presentation_items(list):
         if list.description is not None and len(list.description) > 0:
             ret.append(u"<p class=\"req\">{}</p>".format(list.description.replace("\n\n", "<br/><br/>")))
 
-        for top_req in list.requirements.all():
+        for top_req in list.child_statements():
             rows = presentation_items(top_req, 0)
             ret += rows
     return "\n".join(ret)
@@ -39,8 +39,9 @@ class RequirementsList(RequirementsStatement):
             JSONConstants.title_no_degree: self.title_no_degree
         }
         if full:
-            if self.requirements.exists():
-                base[JSONConstants.requirements] = [child_fn(r) if child_fn is not None else r.to_json_object() for r in self.requirements.all()]
+            children = self.child_statements()
+            if len(children) > 0:
+                base[JSONConstants.requirements] = [child_fn(r) if child_fn is not None else r.to_json_object() for r in children]
             base[JSONConstants.description] = self.description if self.description is not None else ""
             if self.catalog_url is not None and len(self.catalog_url) > 0:
                 base[JSONConstants.catalog_url] = self.catalog_url
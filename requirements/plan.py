@@ -0,0 +1,126 @@
+"""
+Compiled, read-only copies of requirements lists. Computing progress only needs
+each statement's requirement, connection type and thresholds, so rather than
+walking RequirementsStatement model instances (and re-creating their Threshold
+objects) on every progress request, each RequirementsList is compiled once into
+a RequirementsPlan and kept in memory until the requirements change.
+
+A plan is invalidated when update_db.py finishes loading new requirements (see
+courseupdater.views.mark_requirements_loaded), or when a statement compiled
+into a cached plan is saved, deleted or given a new child in this process.
+Changes to other statements, such as the temporary lists built by the editor's
+preview, leave the cache alone.
+"""
+
+import threading
+from django.db.models.signals import post_save, post_delete
+from courseupdater.views import loaded_requirements_version
+from .reqlist import RequirementsStatement
+from .models import RequirementsList
+
+# Requirements containing these strings are matched against course attributes,
+# which half-class subjects satisfy together
+ATTRIBUTE_REQUIREMENT_MARKERS = ("GIR:", "HASS", "CI-")
+
+class PlanNode(object):
+    """
+    A compiled requirements statement. Nodes expose the attributes of the
+    statement that progress computation reads, with thresholds already parsed,
+    along with the statement's JSON representation without children.
+    """
+    __slots__ = ("index", "requirement", "is_plain_string", "connection_type",
+                 "threshold", "distinct_threshold", "is_attribute_requirement",
+                 "children", "json")
+
+    def __init__(self, index, statement, children):
+        self.index = index
+        self.requirement = statement.requirement
+        self.is_plain_string = statement.is_plain_string
+        self.connection_type = statement.connection_type
+        self.threshold = statement.get_threshold()
+        self.distinct_threshold = statement.get_distinct_threshold()
+        self.is_attribute_requirement = (self.requirement is not None and
+                                         any(m in self.requirement for m in ATTRIBUTE_REQUIREMENT_MARKERS))
+        self.children = tuple(children)
+        self.json = statement.to_json_object(full=False)
+
+    def to_json_object(self):
+        """Returns a copy of the statement's JSON representation, without its
+        children, that the caller may modify."""
+        return dict(self.json)
+
+
+class RequirementsPlan(object):
+    """
+    A requirements statement tree compiled into a flat array of PlanNodes in
+    pre-order, so that the root is nodes[0]. The leaf requirement strings of
+    the tree are collected in leaf_requirements, and the primary keys of its
+    statements in statement_ids.
+    """
+
+    def __init__(self, statement, version=None):
+        """Compiles the given statement, whose tree should have been loaded
+        with load_tree() to avoid a query per statement."""
+        self.version = version
+        self.nodes = []
+        self.statement_ids = set()
+        self.root = self._compile(statement)
+        self.leaf_requirements = frozenset(node.requirement for node in self.nodes
+                                           if node.requirement is not None and not node.is_plain_string)
+
+    def _compile(self, statement):
+        self.statement_ids.add(statement.pk)
+        index = len(self.nodes)
+        self.nodes.append(None)
+        children = []
+        if statement.requirement is None:
+            children = [self._compile(child) for child in statement.child_statements()]
+        node = PlanNode(index, statement, children)
+        self.nodes[index] = node
+        return node
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+_plans = {}
+_generation = 0
+_plan_lock = threading.Lock()
+
+def current_version():
+    """Returns a key that changes whenever the requirements lists change: the
+    requirements version last loaded by update_db.py, plus a counter of
+    requirements statement changes made in this process."""
+    return (loaded_requirements_version(), _generation)
+
+def get_plan(list_id):
+    """Returns the compiled plan for the requirements list with the given list
+    ID (including its file extension), compiling it if necessary. Raises
+    RequirementsList.DoesNotExist if there is no such list."""
+    version = current_version()
+    plan = _plans.get(list_id)
+    if plan is not None and plan.version == version:
+        return plan
+    with _plan_lock:
+        plan = _plans.get(list_id)
+        if plan is not None and plan.version == version:
+            return plan
+        req_list = RequirementsList.objects.get(list_id=list_id).load_tree()
+        plan = RequirementsPlan(req_list, version=version)
+        _plans[list_id] = plan
+    return plan
+
+def invalidate_plans():
+    """Forces every plan to be recompiled on its next use."""
+    global _generation
+    _generation += 1
+
+def _statement_changed(sender, instance, **kwargs):
+    for plan in list(_plans.values()):
+        if instance.pk in plan.statement_ids or instance.parent_id in plan.statement_ids:
+            invalidate_plans()
+            return
+
+for _sender in (RequirementsStatement, RequirementsList):
+    post_save.connect(_statement_changed, sender=_sender)
+    post_delete.connect(_statement_changed, sender=_sender)
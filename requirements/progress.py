@@ -1,4 +1,5 @@
 from reqlist import *
+from plan import RequirementsPlan, PlanNode
 import random
 from catalog.models import Course
 
@@ -139,38 +140,47 @@ class Progress(object):
 class RequirementsProgress(object):
     """
     Stores a user's progress towards a given requirements statement. This object
-    wraps a requirements statement and has a to_json_object() method which
-    returns the statement's own JSON dictionary representation with progress
-    information added.
+    wraps a node of a compiled RequirementsPlan and has a to_json_object() method
+    which returns the statement's own JSON dictionary representation with
+    progress information added.
 
     Note: This class is maintained separately from the Django model so that
     persistent information can be stored in a database-friendly format, while
     information specific to a user's request is transient.
     """
     def __init__(self, statement, list_path):
-        """Initializes a progress object with the given requirements statement."""
-        self.statement = statement
-        self.threshold = self.statement.get_threshold()
-        self.distinct_threshold = self.statement.get_distinct_threshold()
+        """Initializes a progress object with the given RequirementsPlan or
+        PlanNode. A RequirementsStatement may also be given, in which case it is
+        compiled into a plan first (see requirements.plan.get_plan to reuse
+        compiled requirements lists)."""
+        if isinstance(statement, RequirementsPlan):
+            statement = statement.root
+        elif not isinstance(statement, PlanNode):
+            statement = RequirementsPlan(statement).root
+        self.node = statement
+        self.threshold = self.node.threshold
+        self.distinct_threshold = self.node.distinct_threshold
         self.list_path = list_path
-        self.children = []
-        if self.statement.requirement is None:
-            for index, child in enumerate(self.statement.requirements.iterator()):
-                self.children.append(RequirementsProgress(child, list_path + "." + str(index)))
+        self.children = [RequirementsProgress(child, list_path + "." + str(index))
+                         for index, child in enumerate(self.node.children)]
 
-    def courses_satisfying_req(self, courses):
+    def courses_satisfying_req(self, courses, catalog=None, road=None):
         """
         Returns the whole courses and the half courses satisfying this requirement
-        separately.
+        separately. catalog is passed through to Course.satisfies. If road is
+        not None, it should be an IndexedRoad for courses built from the
+        catalog's RequirementIndex, which is used to match courses instead.
         """
-        if self.statement.requirement is not None:
-            req = self.statement.requirement
-            if "GIR:" in req or "HASS" in req or "CI-" in req:
+        if self.node.requirement is not None and road is not None:
+            return road.satisfying_courses(self.node.requirement, self.node.is_attribute_requirement, catalog)
+        if self.node.requirement is not None:
+            req = self.node.requirement
+            if self.node.is_attribute_requirement:
                 # Separate whole and half courses
                 whole_courses = []
                 half_courses = []
                 for c in courses:
-                    if not c.satisfies(req, courses):
+                    if not c.satisfies(req, courses, catalog):
                         continue
                     if c.is_half_class:
                         half_courses.append(c)
@@ -178,7 +188,7 @@ class RequirementsProgress(object):
                         whole_courses.append(c)
                 return whole_courses, half_courses
             else:
-                return [c for c in courses if c.satisfies(req, courses)], []
+                return [c for c in courses if c.satisfies(req, courses, catalog)], []
 
         return [], []
 
@@ -223,7 +233,7 @@ class RequirementsProgress(object):
         self.raw_fraction_fulfilled = progress.get_raw_fraction(progress_units)
         self.satisfied_courses = list(satisfied_courses)
 
-    def compute_assertions(self, courses, progress_assertions):
+    def compute_assertions(self, courses, progress_assertions, catalog=None):
         """
         Computes the fulfillment of this requirement based on progress assertions, and returns
         True if the requirement has an assertion available or False otherwise.
@@ -248,7 +258,7 @@ class RequirementsProgress(object):
             ignore = False
             override = 0
 
-        if self.statement.is_plain_string and self.threshold is not None and override:
+        if self.node.is_plain_string and self.threshold is not None and override:
             self.override_requirement(override)
             return True
         if ignore:
@@ -276,12 +286,12 @@ class RequirementsProgress(object):
             units_satisfied = 0
             for sub in substitutions:
                 for course in courses:
-                    if course.satisfies(sub, courses):
+                    if course.satisfies(sub, courses, catalog):
                         subs_satisfied += 1
                         units_satisfied += course.total_units
                         satisfied_courses.add(course)
                         break
-            if self.statement.is_plain_string and self.threshold is not None:
+            if self.node.is_plain_string and self.threshold is not None:
                 subject_progress = Progress(subs_satisfied,
                                             self.threshold.cutoff_for_criterion(CRITERION_SUBJECTS))
                 unit_progress = Progress(units_satisfied,
@@ -330,12 +340,17 @@ class RequirementsProgress(object):
             child.assertion = None
             child.bypass_children()
 
-    def compute(self, courses, progress_overrides, progress_assertions):
+    def compute(self, courses, progress_overrides, progress_assertions, catalog=None, road=None):
         """Computes and stores the status of the requirements statement using the
-        given list of Course objects."""
+        given list of Course objects. If catalog is not None, it should be the
+        current CatalogSnapshot, whose RequirementIndex is used to match courses
+        to requirements without querying the database. road is the IndexedRoad
+        of the courses, which is built here if not given."""
+        if road is None and catalog is not None:
+            road = catalog.requirement_index().road(courses)
         # Compute status of children and then self, adapted from mobile apps' computeRequirementsStatus method
         satisfied_courses = set()
-        if self.compute_assertions(courses, progress_assertions):
+        if self.compute_assertions(courses, progress_assertions, catalog):
             self.bypass_children()
             return
 
@@ -346,15 +361,15 @@ class RequirementsProgress(object):
         self.is_bypassed = False
         self.assertion = None
 
-        if self.statement.requirement is not None:
+        if self.node.requirement is not None:
             #it is a basic requirement
-            if self.statement.is_plain_string and manual_progress != 0 and self.threshold is not None:
+            if self.node.is_plain_string and manual_progress != 0 and self.threshold is not None:
                 #use manual progress
                 self.override_requirement(manual_progress)
                 return
             else:
                 #Example: requirement CI-H, we want to show how many have been fulfilled
-                whole_courses, half_courses = self.courses_satisfying_req(courses)
+                whole_courses, half_courses = self.courses_satisfying_req(courses, catalog, road)
                 satisfied_courses = whole_courses + half_courses
 
                 if not self.threshold is None:
@@ -385,7 +400,7 @@ class RequirementsProgress(object):
 
             open_children = []
             for req_progress in self.children:
-                req_progress.compute(courses, progress_overrides, progress_assertions)
+                req_progress.compute(courses, progress_overrides, progress_assertions, catalog, road)
                 req_satisfied_courses = req_progress.satisfied_courses
 
                 # Don't count anything from a requirement that is ignored
@@ -402,7 +417,7 @@ class RequirementsProgress(object):
                 # For thresholded ANY statements, children that are ALL statements
                 # count as a single satisfied course. ANY children count for
                 # all of their satisfied courses.
-                if req_progress.statement.connection_type == CONNECTION_TYPE_ALL and req_progress.children:
+                if req_progress.node.connection_type == CONNECTION_TYPE_ALL and req_progress.children:
                     num_courses_satisfied += req_progress.is_fulfilled and len(req_progress.satisfied_courses) > 0
                 else:
                     num_courses_satisfied += len(req_satisfied_courses)
@@ -413,7 +428,7 @@ class RequirementsProgress(object):
             if self.threshold is None and self.distinct_threshold is None:
                 is_fulfilled = (num_reqs_satisfied > 0)
 
-                if self.statement.connection_type == CONNECTION_TYPE_ANY:
+                if self.node.connection_type == CONNECTION_TYPE_ANY:
                     #Simple "any" statement
                     if len(sorted_progresses) > 0:
                         subject_progress = sorted_progresses[0].subject_fulfillment
@@ -439,7 +454,7 @@ class RequirementsProgress(object):
 
                     for i, child in zip(range(num_progresses_to_count), open_children):
                         satisfied_courses.update(satisfied_by_category[i])
-                        if child.statement.connection_type == CONNECTION_TYPE_ALL:
+                        if child.node.connection_type == CONNECTION_TYPE_ALL:
                             num_courses_satisfied += (child.is_fulfilled and len(child.satisfied_courses) > 0)
                         else:
                             num_courses_satisfied += len(satisfied_by_category[i])
@@ -466,7 +481,7 @@ class RequirementsProgress(object):
                     else:
                         is_fulfilled = self.threshold.is_satisfied_by(subject_progress.progress, unit_progress.progress)
 
-            if self.statement.connection_type == CONNECTION_TYPE_ALL:
+            if self.node.connection_type == CONNECTION_TYPE_ALL:
                 #"All" statement - make above progresses more stringent
                 is_fulfilled = is_fulfilled and (num_reqs_satisfied == len(open_children))
                 if subject_progress.progress == subject_progress.max and len(open_children) > num_reqs_satisfied:
@@ -497,7 +512,7 @@ class RequirementsProgress(object):
         the enclosed requirements statement, as well as progress information."""
         # Recursively decorate the JSON output of the children
         # Add custom keys indicating progress for this statement
-        stmt_json = self.statement.to_json_object(full=False)
+        stmt_json = self.node.to_json_object()
         stmt_json[JSONProgressConstants.is_fulfilled] = self.is_fulfilled
         stmt_json[JSONProgressConstants.progress] = self.progress
         stmt_json[JSONProgressConstants.progress_max] = self.progress_max
@@ -180,6 +180,30 @@ class RequirementsStatement(models.Model):
         (CRITERION_UNITS, "units")
     ), default=CRITERION_SUBJECTS)
 
+    def load_tree(self):
+        """Fetches all the statements below this one with a single query per
+        level of nesting, and caches each statement's children in memory so
+        that traversing the tree (for example to compute progress or JSON)
+        makes no further queries. Returns self."""
+        self._child_statements = []
+        frontier = {self.pk: self}
+        while frontier:
+            next_frontier = {}
+            for statement in RequirementsStatement.objects.filter(parent_id__in=list(frontier.keys())).order_by("pk"):
+                statement._child_statements = []
+                frontier[statement.parent_id]._child_statements.append(statement)
+                next_frontier[statement.pk] = statement
+            frontier = next_frontier
+        return self
+
+    def child_statements(self):
+        """Returns a list of the statements nested directly under this one,
+        using the tree cached by load_tree() if it has been loaded."""
+        children = getattr(self, "_child_statements", None)
+        if children is None:
+            return list(self.requirements.all())
+        return children
+
     def get_threshold(self):
         if self.threshold_type is not None:
             return Threshold(self.threshold_type, self.threshold_cutoff, self.threshold_criterion)
@@ -218,7 +242,7 @@ class RequirementsStatement(models.Model):
         elif self.connection_type == CONNECTION_TYPE_ALL:
             ret = "select all"
         elif self.connection_type == CONNECTION_TYPE_ANY:
-            if self.requirements.all().exists() and len(self.requirements.all()) == 2:
+            if len(self.child_statements()) == 2:
                 ret = "select either"
             else:
                 ret = "select any"
@@ -243,12 +267,12 @@ class RequirementsStatement(models.Model):
         thresh_desc = self.threshold_description()
         if self.requirement is not None:
             return "{}{}{}".format(self.title.encode("utf8") + ": " if self.title is not None else "", self.requirement.encode("utf8"), " (" + thresh_desc + ")" if len(thresh_desc) > 0 else "")
-        elif self.requirements.all().exists():
+        elif len(self.child_statements()) > 0:
             connection_string = self.get_connection_type_display()
             if len(thresh_desc) > 0:
                 connection_string += " ({})".format(thresh_desc)
 
-            return "{}{} of \n".format(self.title.encode("utf8") + ": " if self.title is not None else "", connection_string) + "\n".join([str(r) for r in self.requirements.all()])
+            return "{}{} of \n".format(self.title.encode("utf8") + ": " if self.title is not None else "", connection_string) + "\n".join([str(r) for r in self.child_statements()])
 
         return self.title if self.title is not None else "No title"
 
@@ -290,8 +314,8 @@ class RequirementsStatement(models.Model):
 
         if self.requirement is not None:
             base[JSONConstants.requirement] = self.requirement
-        elif full and self.requirements.exists():
-            base[JSONConstants.requirements] = [(child_fn(r) if child_fn is not None else r.to_json_object()) for r in self.requirements.all()]
+        elif full and len(self.child_statements()) > 0:
+            base[JSONConstants.requirements] = [(child_fn(r) if child_fn is not None else r.to_json_object()) for r in self.child_statements()]
             base[JSONConstants.connection_type] = self.connection_type
 
         return base
@@ -451,25 +475,28 @@ class RequirementsStatement(models.Model):
 
     def minimum_nest_depth(self):
         """Gives the minimum number of steps needed to traverse the tree down to a leaf (an individual course)."""
-        if self.requirements.exists():
-            return min(req.minimum_nest_depth() for req in self.requirements.all()) + 1
+        children = self.child_statements()
+        if len(children) > 0:
+            return min(req.minimum_nest_depth() for req in children) + 1
         return 0
 
     def maximum_nest_depth(self):
         """Gives the maximum number of steps needed to traverse the tree down to a leaf (an individual course)."""
-        if self.requirements.exists():
-            return max(req.minimum_nest_depth() for req in self.requirements.all()) + 1
+        children = self.child_statements()
+        if len(children) > 0:
+            return max(req.minimum_nest_depth() for req in children) + 1
         return 0
 
     def short_description(self):
         """Returns a short description of the requirement."""
         if self.requirement is not None:
             return self.requirement
-        elif self.requirements.exists():
+        children = self.child_statements()
+        if len(children) > 0:
             connection = "and" if self.connection_type == CONNECTION_TYPE_ALL else "or"
-            if self.requirements.count() == 2:
-                return "{} {} {}".format(self.requirements.all()[0].short_description(), connection, self.requirements.all()[1].short_description())
+            if len(children) == 2:
+                return "{} {} {}".format(children[0].short_description(), connection, children[1].short_description())
             else:
-                return "{} {} {} others".format(self.requirements.all()[0].short_description(), connection, self.requirements.count() - 1)
+                return "{} {} {} others".format(children[0].short_description(), connection, len(children) - 1)
 
         return baseString
@@ -1,7 +1,20 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+from django.test import Client
+from django.contrib.auth.models import User
 from .models import *
 from .progress import *
+from .plan import get_plan
+from . import views
 from catalog.models import Course
+from catalog.snapshot import get_snapshot
+from courseupdater.views import mark_requirements_loaded
+from sync.models import Road
+from common.models import APIClient
+from common.token_gen import generate_token
+import json
+import shutil
+import tempfile
 
 # Create your tests here.
 class RequirementsStatementTest(TestCase):
@@ -103,6 +116,20 @@ class RequirementsStatementTest(TestCase):
         y = children[1]
         self.assertEqual("6.009", y.requirement)
 
+    def test_load_tree(self):
+        statement = RequirementsStatement.initialize("my req", "(2.001, 2.002)/2.003, 8.01")
+        expected = statement.to_json_object()
+
+        root = RequirementsStatement.objects.get(pk=statement.pk)
+        # One query per level of nesting, plus one that finds no more children
+        with self.assertNumQueries(3):
+            root.load_tree()
+        with self.assertNumQueries(0):
+            self.assertEqual(expected, root.to_json_object())
+            str(root)
+            progress = RequirementsProgress(root, "0")
+        self.assertEqual(statement.requirements.count(), len(progress.children))
+
 
 class RequirementsProgressTest(TestCase):
 
@@ -247,3 +274,227 @@ class RequirementsProgressTest(TestCase):
         self.assertTrue(progress.is_fulfilled)
         self.assert_basic_progress(2, 2, progress)
         self.assertEqual(courses, progress.satisfied_courses)
+
+    def test_plan_cache(self):
+        req = RequirementsList.objects.create(list_id="major2.reql")
+        req.parse("2#,#Course 2#,#Mechanical Engineering\n\n\nintro\nIntroductory subjects\n\nintro := 2.001, 2.003")
+        req.save()
+        base_dir = tempfile.mkdtemp()
+        try:
+            with override_settings(CATALOG_BASE_DIR=base_dir):
+                plan = get_plan("major2.reql")
+                self.assertEqual(set(["2.001", "2.003"]), plan.leaf_requirements)
+                courses = [Course.objects.get(subject_id="2.001")]
+                with self.assertNumQueries(0):
+                    self.assertIs(plan, get_plan("major2.reql"))
+                    progress = RequirementsProgress(plan, "major2")
+                    progress.compute(courses, {}, {})
+                self.assertFalse(progress.is_fulfilled)
+                self.assertEqual(1, progress.subject_progress)
+                self.assertEqual(2, progress.subject_max)
+
+                # Matching through the catalog's requirement index gives the same result
+                progress = RequirementsProgress(plan, "major2")
+                progress.compute(courses, {}, {}, get_snapshot())
+                self.assertEqual(1, progress.subject_progress)
+                self.assertEqual(courses, progress.children[0].satisfied_courses)
+
+                # Temporary lists, such as the editor's previews, leave the plan cached
+                preview = RequirementsList.objects.create()
+                preview.parse("2#,#Preview#,#Preview\n\n\nintro\nIntro\n\nintro := 2.001, 2.002")
+                preview.delete()
+                self.assertIs(plan, get_plan("major2.reql"))
+
+                # Changing a statement or loading new requirements recompiles the plan
+                req.save()
+                new_plan = get_plan("major2.reql")
+                self.assertIsNot(plan, new_plan)
+                mark_requirements_loaded(3)
+                self.assertIsNot(new_plan, get_plan("major2.reql"))
+                self.assertRaises(RequirementsList.DoesNotExist, get_plan, "major3.reql")
+        finally:
+            shutil.rmtree(base_dir)
+
+
+    def test_progress_endpoint_queries(self):
+        req = RequirementsList.objects.create(list_id="major2.reql")
+        req.parse("2#,#Course 2#,#Mechanical Engineering\n\n\nintro\nIntroductory subjects\n\nintro := 2.001, 2.003, HASS-A/CI-H, GIR:REST{>=2}")
+        req.save()
+        base_dir = tempfile.mkdtemp()
+        request = RequestFactory().get("/requirements/progress/major2/")
+        subjects = "2.001,2.002,21M.421,CI-H,REST,REST,nonexistent"
+        try:
+            with override_settings(CATALOG_BASE_DIR=base_dir):
+                expected = views.progress(request, "major2", subjects).content
+                # Subjects are resolved from the catalog snapshot, and the plan is cached
+                with self.assertNumQueries(0):
+                    response = views.progress(request, "major2", subjects)
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(json.loads(expected), json.loads(response.content))
+                result = json.loads(response.content)
+                leaves = result["reqs"][0]["reqs"]
+                self.assertEqual(["2.001"], leaves[0]["sat_courses"])
+                self.assertEqual(["21M.421"], leaves[2]["sat_courses"])
+                self.assertEqual(["CI-H"], leaves[3]["sat_courses"])
+                self.assertEqual(["REST", "REST"], leaves[4]["sat_courses"])
+        finally:
+            shutil.rmtree(base_dir)
+
+    def test_progress_lists(self):
+        for list_id, contents in (("major2.reql", "2.001, 2.003"), ("minor2.reql", "2.002/21M.421")):
+            req = RequirementsList.objects.create(list_id=list_id)
+            req.parse("2#,#Course 2#,#Mechanical Engineering\n\n\nintro\nIntroductory subjects\n\nintro := " + contents)
+            req.save()
+        road = {"coursesOfStudy": ["major2", "minor2", "major2", "major3"],
+                "selectedSubjects": [{"subject_id": "2.001"}, {"id": "21M.421"}]}
+        base_dir = tempfile.mkdtemp()
+        factory = RequestFactory()
+        try:
+            with override_settings(CATALOG_BASE_DIR=base_dir):
+                request = factory.post("/requirements/progress_lists/", json.dumps(road), content_type="application/json")
+                response = views.progress_lists(request)
+                self.assertEqual(200, response.status_code)
+                result = json.loads(response.content)
+                self.assertEqual(["major3"], result["missing"])
+                self.assertEqual(set(["major2", "minor2"]), set(result["lists"]))
+                for list_id in ("major2", "minor2"):
+                    single = views.progress(factory.get("/requirements/progress/"), list_id, "2.001,21M.421")
+                    self.assertEqual(json.loads(single.content), result["lists"][list_id])
+                self.assertTrue(result["lists"]["minor2"]["fulfilled"])
+                self.assertFalse(result["lists"]["major2"]["fulfilled"])
+
+                request = factory.post("/requirements/progress_lists/?lists=minor2", json.dumps(road), content_type="application/json")
+                with self.assertNumQueries(0):
+                    response = views.progress_lists(request)
+                self.assertEqual(["minor2"], list(json.loads(response.content)["lists"]))
+
+                too_many = dict(road, coursesOfStudy=["major{}".format(i) for i in range(views.MAX_PROGRESS_LISTS + 1)])
+                request = factory.post("/requirements/progress_lists/", json.dumps(too_many), content_type="application/json")
+                self.assertEqual(400, views.progress_lists(request).status_code)
+                repeated = dict(road, coursesOfStudy=["minor2"] * 1000)
+                request = factory.post("/requirements/progress_lists/", json.dumps(repeated), content_type="application/json")
+                self.assertEqual(["minor2"], list(json.loads(views.progress_lists(request).content)["lists"]))
+
+                request = factory.post("/requirements/progress_lists/", "[]", content_type="application/json")
+                self.assertEqual(400, views.progress_lists(request).status_code)
+                self.assertEqual(400, views.progress_lists(factory.get("/requirements/progress_lists/")).status_code)
+        finally:
+            shutil.rmtree(base_dir)
+
+    def test_progress_lists_stored_road_with_token(self):
+        req = RequirementsList.objects.create(list_id="minor2.reql")
+        req.parse("2#,#Course 2#,#Mechanical Engineering\n\n\nintro\nIntroductory subjects\n\nintro := 2.002/21M.421")
+        req.save()
+        user = User.objects.create_user(username="student", password="password")
+        road = Road.objects.create(user=user, name="Road", contents=json.dumps(
+            {"coursesOfStudy": ["minor2"], "selectedSubjects": [{"subject_id": "21M.421"}]}))
+        url = "/requirements/progress_lists/?road={}".format(road.pk)
+        base_dir = tempfile.mkdtemp()
+        try:
+            with override_settings(CATALOG_BASE_DIR=base_dir):
+                self.assertEqual(403, Client().get(url).status_code)
+                no_permission = generate_token(None, user, 3600, APIClient(name="No roads"))
+                response = Client().get(url, HTTP_AUTHORIZATION="Bearer " + no_permission)
+                self.assertEqual(403, response.status_code)
+
+                token = generate_token(None, user, 3600, APIClient(name="Roads", can_view_roads=True))
+                response = Client().get(url, HTTP_AUTHORIZATION="Bearer " + token)
+                self.assertEqual(200, response.status_code)
+                self.assertTrue(json.loads(response.content)["lists"]["minor2"]["fulfilled"])
+        finally:
+            shutil.rmtree(base_dir)
+
+
+class RequirementsConditionalGetTest(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        req = RequirementsList.objects.create(list_id="major6-3.reql")
+        req.parse("6-3#,#Course 6-3#,#Computer Science and Engineering\n\n_6-3\nintro\n\nintro, \"Intro\" := 6.0001, 6.0002")
+        req.save()
+        self.base_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_get_json_etag(self):
+        with override_settings(CATALOG_BASE_DIR=self.base_dir):
+            response = views.get_json(self.factory.get("/requirements/get_json/major6-3/"), "major6-3")
+            self.assertEqual(200, response.status_code)
+            self.assertFalse(response.has_header("ETag"))
+
+            mark_requirements_loaded(5)
+            response = views.get_json(self.factory.get("/requirements/get_json/major6-3/"), "major6-3")
+            self.assertEqual(200, response.status_code)
+            etag = response["ETag"]
+            self.assertTrue(response.has_header("Last-Modified"))
+
+            request = self.factory.get("/requirements/get_json/major6-3/", HTTP_IF_NONE_MATCH=etag)
+            with self.assertNumQueries(0):
+                response = views.get_json(request, "major6-3")
+            self.assertEqual(304, response.status_code)
+
+            mark_requirements_loaded(6)
+            request = self.factory.get("/requirements/get_json/major6-3/", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(200, views.get_json(request, "major6-3").status_code)
+
+class RoadPrereqsTest(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        Course.objects.create(subject_id="8.01", title="Physics I", gir_attribute="PHY1", public=True)
+        Course.objects.create(subject_id="6.0001", title="Intro to Python", public=True,
+                              prerequisites="GIR:PHY1")
+        Course.objects.create(subject_id="6.0002", title="Intro to Data Science", public=True,
+                              prerequisites="''permission of instructor''", corequisites="6.0001")
+        Course.objects.create(subject_id="6.006", title="Algorithms", public=True,
+                              prerequisites="6.0001, 18.06/18.700")
+        Course.objects.create(subject_id="18.06", title="Linear Algebra", public=True,
+                              equivalent_subjects="18.C06")
+        Course.objects.create(subject_id="18.C06", title="Linear Algebra and Optimization", public=True,
+                              equivalent_subjects="18.06")
+
+    def check_road(self, subjects):
+        road = {"selectedSubjects": [{"id": subject_id, "semester": semester}
+                                     for subject_id, semester in subjects]}
+        request = self.factory.post("/requirements/prereqs/", json.dumps(road),
+                                    content_type="application/json")
+        response = views.road_prereqs(request)
+        self.assertEqual(200, response.status_code)
+        return json.loads(response.content)
+
+    def test_valid_road(self):
+        self.assertEqual([], self.check_road([("8.01", 0), ("6.0001", 1), ("6.0002", 1),
+                                              ("18.C06", 2), ("6.006", 3)]))
+
+    def test_violations(self):
+        violations = self.check_road([("6.0001", 1), ("6.0002", 2), ("8.01", 2),
+                                      ("18.06", 3), ("6.006", 3)])
+        self.assertEqual([
+            {"subject_id": "6.0001", "semester": 1, "prerequisites": "GIR:PHY1"},
+            {"subject_id": "6.006", "semester": 3,
+             "prerequisites": {"all": ["6.0001", {"any": ["18.06", "18.700"]}]}},
+        ], violations)
+
+        self.assertEqual([{"subject_id": "6.0002", "semester": 1, "corequisites": "6.0001"}],
+                         self.check_road([("6.0002", 1), ("6.0001", 2), ("8.01", 0)]))
+        # Prior credit is not checked
+        self.assertEqual([], self.check_road([("6.006", 0)]))
+
+    def test_prereq_or_coreq(self):
+        Course.objects.create(subject_id="6.0003", title="Intro to Computation", public=True,
+                              prerequisites="6.0001", either_prereq_or_coreq=True)
+        # Prerequisites may be taken in the same semester, but not later
+        self.assertEqual([], self.check_road([("8.01", 0), ("6.0001", 1), ("6.0003", 1)]))
+        self.assertEqual([{"subject_id": "6.0003", "semester": 1, "prerequisites": "6.0001"}],
+                         self.check_road([("8.01", 0), ("6.0003", 1), ("6.0001", 2)]))
+        self.assertEqual([{"subject_id": "6.006", "semester": 1,
+                           "prerequisites": {"all": ["6.0001", {"any": ["18.06", "18.700"]}]}}],
+                         self.check_road([("8.01", 0), ("18.06", 0), ("6.0001", 1), ("6.006", 1)]))
+
+    def test_bad_road(self):
+        road = {"selectedSubjects": [{"id": "6.0001"}]}
+        request = self.factory.post("/requirements/prereqs/", json.dumps(road),
+                                    content_type="application/json")
+        self.assertEqual(400, views.road_prereqs(request).status_code)
+        self.assertEqual(400, views.road_prereqs(self.factory.get("/requirements/prereqs/")).status_code)
@@ -18,6 +18,8 @@ urlpatterns = [
     url(r'^commit/(?P<edit_req>\d+)', editor.commit, name='commit'),
     url(r'^list_reqs/', views.list_reqs, name='list_reqs'),
     url(r'^get_json/(?P<list_id>.{1,50})/', views.get_json, name='get_json'),
+    url(r'^prereqs/', views.road_prereqs, name='road_prereqs'),
+    url(r'^progress_lists/', views.progress_lists, name='progress_lists'),
     url(r'^progress/(?P<list_id>.{1,50})/(?P<courses>.+)', views.progress, name='progress'),
     url(r'^progress/(?P<list_id>.{1,50})/', views.road_progress, name='road_progress'),
     url(r'^$', editor.index, name='requirements_index'),
@@ -1,91 +1,144 @@
 from django.shortcuts import render, redirect
 from django.http import HttpResponse, HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 from .models import *
 from django.contrib.auth import login, authenticate, logout
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
-from common.decorators import logged_in_or_basicauth
+from common.decorators import logged_in_or_basicauth, require_token_permissions
 import json
 import os
 import requests
+import datetime
 from courseupdater.views import *
 from sync.models import Road
 import re
 from progress import RequirementsProgress
+from plan import get_plan
 from catalog.models import Course, Attribute, HASSAttribute, GIRAttribute, CommunicationAttribute
+from catalog.snapshot import get_semester_snapshot
 import logging
+from django.utils import timezone
 
 REQUIREMENTS_EXT = ".reql"
 
 SUBJECT_ID_KEY = "subject_id"
 SUBJECT_ID_ALT_KEY = "id"
+SEMESTER_KEY = "semester"
+COURSES_OF_STUDY_KEY = "coursesOfStudy"
 
+# Maximum number of requirements lists evaluated by one progress_lists request
+MAX_PROGRESS_LISTS = 20
+
+def requirements_etag(request, *args, **kwargs):
+    """Returns an ETag for requirements list responses, derived from the
+    requirements version most recently loaded by update_db.py, or None if no
+    loaded version has been recorded."""
+    loaded = loaded_requirements_version()
+    if loaded is None:
+        return None
+    return "requirements-{}".format(loaded[1])
+
+def requirements_last_modified(request, *args, **kwargs):
+    """Returns the time at which the current requirements lists were loaded, or
+    None if it is unknown."""
+    loaded = loaded_requirements_version()
+    if loaded is None:
+        return None
+    return datetime.datetime.fromtimestamp(loaded[2], timezone.utc)
+
+@condition(etag_func=requirements_etag, last_modified_func=requirements_last_modified)
 def get_json(request, list_id):
     """Returns the raw JSON for a given requirements list, without user
     course progress."""
 
     try:
-        req = RequirementsList.objects.get(list_id=list_id + REQUIREMENTS_EXT)
+        req = RequirementsList.objects.get(list_id=list_id + REQUIREMENTS_EXT).load_tree()
         # to pretty-print, use these keyword arguments to json.dumps:
         # sort_keys=True, indent=4, separators=(',', ': ')
         return HttpResponse(json.dumps(req.to_json_object(full=True)), content_type="application/json")
     except ObjectDoesNotExist:
         return HttpResponseBadRequest("the requirements list {} does not exist".format(list_id))
 
+def resolve_courses(course_list, catalog):
+    """Returns a list of course objects for the given subject IDs, looked up in
+    the given CatalogSnapshot. Subject IDs that are not in the catalog are made
+    into generic courses if possible (see Course.make_generic), and skipped
+    otherwise."""
+    course_objs = []
+    #required to give generic courses unique id's so muliple can count towards requirement
+    unique_generic_id = 0
+    for subject_id in course_list:
+        course = catalog.get(subject_id)
+        if course is not None:
+            course_objs.append(course)
+            continue
+        try:
+            course_objs.append(Course.make_generic(subject_id, unique_generic_id))
+            unique_generic_id += 1
+        except ValueError:
+            print("Warning: course {} does not exist in the catalog".format(subject_id))
+    return course_objs
+
 def compute_progress(request, list_id, course_list, progress_overrides, progress_assertions):
     """Utility function for road_progress and progress that computes and returns
-    the progress on the given requirements list."""
+    the progress on the given requirements list. If the "sem" GET parameter is
+    given, courses are looked up in the catalog of that semester."""
     try:
-        req = RequirementsList.objects.get(list_id=list_id + REQUIREMENTS_EXT)
+        plan = get_plan(list_id + REQUIREMENTS_EXT)
     except ObjectDoesNotExist:
         return HttpResponseBadRequest("the requirements list {} does not exist".format(list_id))
 
-    # Get Course objects
-    course_objs = []
-    #required to give generic courses unique id's so muliple can count towards requirement
-    unique_generic_id = 0
-    for subject_id in course_list:
-        try:
-            course_objs.append(Course.public_courses().get(subject_id=subject_id))
-        except ObjectDoesNotExist:
-            try:
-                course_objs.append(Course.make_generic(subject_id,unique_generic_id))
-                unique_generic_id += 1
-            except ValueError:
-                print("Warning: course {} does not exist in the catalog".format(subject_id))
+    semester = request.GET.get("sem") or None
+    try:
+        catalog = get_semester_snapshot(semester)
+    except ValueError:
+        return HttpResponseBadRequest("no catalog found for semester {}".format(semester))
 
+    course_objs = resolve_courses(course_list, catalog)
 
     # Create a progress object for the requirements list
-    prog = RequirementsProgress(req, list_id)
-    prog.compute(course_objs, progress_overrides, progress_assertions)
+    prog = RequirementsProgress(plan, list_id)
+    prog.compute(course_objs, progress_overrides, progress_assertions, catalog)
     # to pretty-print, use these keyword arguments to json.dumps:
     # sort_keys=True, indent=4, separators=(',', ': ')
     return HttpResponse(json.dumps(prog.to_json_object(True)), content_type="application/json")
 
-#@logged_in_or_basicauth
-def road_progress_get(request, list_id):
-    """Returns the raw JSON for a given requirements list including user
-    progress. A 'road' query parameter should be passed that indicates the ID
-    number of the road that is being checked."""
+def load_road(request):
+    """Returns the contents of the user's road whose ID number is given in the
+    'road' query parameter. Raises PermissionDenied if the user is not logged
+    in, or a ValueError describing the problem if the road can't be read."""
     road_id = request.GET.get("road", "")
     if road_id is None or len(road_id) == 0:
-        return HttpResponseBadRequest("need a road ID")
+        raise ValueError("need a road ID")
     try:
         road_id = int(road_id)
     except:
-        return HttpResponseBadRequest("road ID must be an integer")
+        raise ValueError("road ID must be an integer")
+    if not request.user.is_authenticated():
+        raise PermissionDenied
 
     try:
         road = Road.objects.get(user=request.user, pk=road_id)
     except ObjectDoesNotExist:
         available_roads = Road.objects.filter(user=request.user)
-        return HttpResponseBadRequest("the road does not exist on the server. Available roads: " +
-                                      ", ".join(str(road.pk) for road in available_roads))
+        raise ValueError("the road does not exist on the server. Available roads: " +
+                         ", ".join(str(road.pk) for road in available_roads))
 
     try:
-        contents = json.loads(Road.expand(road.contents))
+        return json.loads(Road.expand(road.contents))
     except:
-        return HttpResponseBadRequest("badly formatted road contents")
+        raise ValueError("badly formatted road contents")
+
+#@logged_in_or_basicauth
+def road_progress_get(request, list_id):
+    """Returns the raw JSON for a given requirements list including user
+    progress. A 'road' query parameter should be passed that indicates the ID
+    number of the road that is being checked."""
+    try:
+        contents = load_road(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
 
     progress_overrides = contents.get("progressOverrides", {})
     progress_assertions = contents.get("progressAssertions", {})
@@ -115,6 +168,56 @@ def read_subjects(contents):
             course_list.append(subj[SUBJECT_ID_ALT_KEY])
     return course_list
 
+def read_subject_semesters(contents):
+    """Extracts a list of (subject ID, semester) tuples from a given road JSON
+    object. Raises a ValueError if a subject's semester is missing or is not
+    an integer."""
+    selections = []
+    for subj in contents.get("selectedSubjects", []):
+        if SUBJECT_ID_KEY in subj:
+            subject_id = subj[SUBJECT_ID_KEY]
+        elif SUBJECT_ID_ALT_KEY in subj:
+            subject_id = subj[SUBJECT_ID_ALT_KEY]
+        else:
+            continue
+        semester = subj.get(SEMESTER_KEY)
+        if isinstance(semester, bool) or not isinstance(semester, (int, long)):
+            raise ValueError("invalid semester for {}".format(subject_id))
+        selections.append((subject_id, semester))
+    return selections
+
+@csrf_exempt
+def road_prereqs(request):
+    """Checks the prerequisites and corequisites of every subject in a road.
+    The POST body should contain the JSON for the road. Returns a JSON list of
+    the subjects whose requirements are not satisfied by earlier semesters. If
+    the "sem" GET parameter is given, the catalog of that semester is used."""
+    if request.method != 'POST':
+        return HttpResponseBadRequest("road contents must be sent as a POST body")
+    try:
+        contents = json.loads(request.body)
+        selections = read_subject_semesters(contents)
+    except ValueError as e:
+        return HttpResponseBadRequest("badly formatted road contents: {}".format(e))
+    except:
+        return HttpResponseBadRequest("badly formatted road contents")
+
+    catalog_semester = request.GET.get("sem") or None
+    try:
+        graph = get_semester_snapshot(catalog_semester).prereq_graph()
+    except ValueError:
+        return HttpResponseBadRequest("no catalog found for semester {}".format(catalog_semester))
+
+    violations = []
+    for subject_id, semester, prereqs, coreqs in graph.validate_road(selections):
+        violation = {SUBJECT_ID_KEY: subject_id, SEMESTER_KEY: semester}
+        if prereqs is not None:
+            violation["prerequisites"] = prereqs.to_json_object()
+        if coreqs is not None:
+            violation["corequisites"] = coreqs.to_json_object()
+        violations.append(violation)
+    return HttpResponse(json.dumps(violations), content_type="application/json")
+
 @csrf_exempt
 def road_progress(request, list_id):
     """Returns the raw JSON for a given requirements list including user
@@ -136,6 +239,82 @@ def progress(request, list_id, courses):
     in courses as a comma-separated list of subject IDs."""
     return compute_progress(request, list_id, [c for c in courses.split(",") if len(c)], {}, {})
 
+def stored_road_auth(view):
+    """Decorator for views that accept the ID number of one of the user's roads
+    in the 'road' query parameter. Such requests must be logged in or carry a
+    token with permission to view roads, as for the sync endpoints; other
+    requests need no authorization."""
+    authorized_view = logged_in_or_basicauth(require_token_permissions("can_view_roads")(view))
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST' and 'road' in request.GET:
+            return authorized_view(request, *args, **kwargs)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+@csrf_exempt
+@stored_road_auth
+def progress_lists(request):
+    """Returns the progress of a road on several requirements lists at once,
+    resolving the road's subjects only once. The road is given as a POST body,
+    or for GET requests by its ID number in the 'road' query parameter. The
+    'lists' query parameter is a comma-separated list of requirements list IDs,
+    which defaults to the road's courses of study. If the "sem" GET parameter
+    is given, courses are looked up in the catalog of that semester."""
+    if request.method == 'POST':
+        try:
+            contents = json.loads(request.body)
+        except:
+            return HttpResponseBadRequest("badly formatted road contents")
+    elif 'road' in request.GET:
+        try:
+            contents = load_road(request)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+    else:
+        return HttpResponseBadRequest("need a road as a POST body or a road ID")
+    if not isinstance(contents, dict):
+        return HttpResponseBadRequest("badly formatted road contents")
+
+    if request.GET.get("lists"):
+        list_ids = [l for l in request.GET["lists"].split(",") if len(l)]
+    else:
+        list_ids = contents.get(COURSES_OF_STUDY_KEY, [])
+    if not isinstance(list_ids, list) or not all(isinstance(l, basestring) for l in list_ids):
+        return HttpResponseBadRequest("badly formatted courses of study")
+    unique_ids = []
+    seen = set()
+    for list_id in list_ids:
+        if list_id not in seen:
+            seen.add(list_id)
+            unique_ids.append(list_id)
+            if len(unique_ids) > MAX_PROGRESS_LISTS:
+                return HttpResponseBadRequest("at most {} requirements lists can be evaluated at once".format(MAX_PROGRESS_LISTS))
+    list_ids = unique_ids
+
+    semester = request.GET.get("sem") or None
+    try:
+        catalog = get_semester_snapshot(semester)
+    except ValueError:
+        return HttpResponseBadRequest("no catalog found for semester {}".format(semester))
+
+    course_objs = resolve_courses(read_subjects(contents), catalog)
+    road = catalog.requirement_index().road(course_objs)
+    progress_overrides = contents.get("progressOverrides", {})
+    progress_assertions = contents.get("progressAssertions", {})
+
+    results = {}
+    missing = []
+    for list_id in list_ids:
+        try:
+            plan = get_plan(list_id + REQUIREMENTS_EXT)
+        except ObjectDoesNotExist:
+            missing.append(list_id)
+            continue
+        prog = RequirementsProgress(plan, list_id)
+        prog.compute(course_objs, progress_overrides, progress_assertions, catalog, road)
+        results[list_id] = prog.to_json_object(True)
+    return HttpResponse(json.dumps({"lists": results, "missing": missing}), content_type="application/json")
+
 def list_reqs(request):
     """Return a JSON dictionary of all available requirements lists, with the
     basic metadata for those lists."""
@@ -10,6 +10,7 @@ from courseupdater.models import CatalogUpdate
 import catalog_parse as cp
 from requirements.models import *
 from catalog.models import *
+from catalog.semesters import catalog_file_paths, read_catalog_rows, read_related_rows, set_catalog_fields
 from sync.models import *
 from django.db import DatabaseError, transaction
 from django import db
@@ -31,9 +32,6 @@ from analytics.models import RequestCount
 REQUIREMENTS_INFO_KEY = "r_delta"
 CATALOG_FILES_INFO_KEY = "delta"
 
-# Filenames that contain these words will be skipped
-EXCLUDED_FILENAMES = ["condensed", "courses", "features", "enrollment", "departments"]
-
 ### CATALOG UPDATE
 
 def deploy_catalog_updates():
@@ -52,60 +50,46 @@ def deploy_catalog_updates():
 
 def update_catalog_with_file(path, semester):
     """Updates the catalog database using the given CSV file path."""
-    with open(path, 'r') as file:
-        reader = csv.reader(file)
-        headers = None
-        for comps in reader:
-            if CourseAttribute.subjectID in comps:
-                headers = comps
-                continue
-            if headers is None:
-                print("Can't read CSV file {} - no headers".format(path))
-            info = dict(zip(headers, comps))
-            try:
-                course = Course.public_courses().get(subject_id=info[CourseAttribute.subjectID])
-            except ObjectDoesNotExist:
-                course = Course.objects.create(public=True, subject_id=info[CourseAttribute.subjectID])
-            finally:
-                course.catalog_semester = semester
-                for key, val in info.items():
-                    if key not in CSV_HEADERS: continue
-                    prop, converter = CSV_HEADERS[key]
-                    setattr(course, prop, converter(val.decode('utf-8')))
-                course.save()
+    for info in read_catalog_rows(path):
+        try:
+            course = Course.public_courses().get(subject_id=info[CourseAttribute.subjectID])
+        except ObjectDoesNotExist:
+            course = Course.objects.create(public=True, subject_id=info[CourseAttribute.subjectID])
+        finally:
+            set_catalog_fields(course, info, semester)
+            course.save()
 
 def parse_related_file(path):
     """Updates the catalog database with the related subjects file."""
-    with open(path, 'r') as file:
-        for line in file:
-            comps = line.strip().replace("[J]", "").replace("J", "").split(",")
-            try:
-                course = Course.public_courses().get(subject_id=comps[0])
-                course.related_subjects = ",".join(comps[1:])
-                course.save()
-            except ObjectDoesNotExist:
-                continue
+    for subject_id, related in read_related_rows(path):
+        try:
+            course = Course.public_courses().get(subject_id=subject_id)
+            course.related_subjects = related
+            course.save()
+        except ObjectDoesNotExist:
+            continue
 
 def update_catalog():
     """Parses all files in the current semester catalog, replacing the existing Course objects."""
     Course.public_courses().delete()
 
     semester = list_semesters()[-1]
-    catalog_files = compute_semester_delta(semester.split("-"), 0, 0)[CATALOG_FILES_INFO_KEY]
+    semester_delta = compute_semester_delta(semester.split("-"), 0, 0)
 
-    related_path = None
+    catalog_files, related_path = catalog_file_paths(semester)
     for path in catalog_files:
-        filename = os.path.basename(path)
-        if any(f in filename for f in EXCLUDED_FILENAMES): continue
-        print(filename)
-        if "related" in filename:
-            # Save this for last
-            related_path = path
-        else:
-            update_catalog_with_file(os.path.join(settings.CATALOG_BASE_DIR, path), semester)
+        print(os.path.basename(path))
+        update_catalog_with_file(os.path.join(settings.CATALOG_BASE_DIR, path), semester)
+    # The related file is loaded last
     if related_path is not None:
         parse_related_file(os.path.join(settings.CATALOG_BASE_DIR, related_path))
 
+    with transaction.atomic():
+        Section.rebuild()
+
+    # Signal running servers to swap in a new catalog snapshot
+    mark_catalog_loaded(semester, semester_delta['v'])
+
 ### REQUIREMENTS UPDATE
 
 delta_prefix = "delta-"
@@ -173,6 +157,7 @@ def update_requirements():
             new_req.parse(file.read().decode('utf-8'))
         new_req.save()
 
+    mark_requirements_loaded(req_urls['rv'])
     print("The database was successfully updated with {} requirements files.".format(len(req_urls[REQUIREMENTS_INFO_KEY])))
 
 ### EDIT REQUESTS